@@ -0,0 +1,132 @@
+import math
+import re
+from collections import Counter
+
+from caching import TTLCache
+
+
+# Routing bands on the combined local score (0-1). Below LOW_BAND a short answer is
+# finalised locally, at or above HIGH_BAND it goes to the small model, everything in
+# between is uncertain and escalates to the large model.
+LOW_BAND = 0.15
+HIGH_BAND = 0.7
+SHORT_ANSWER_WORDS = 15
+LOCAL_SCORE = 3  # Rubric floor for any attempted answer
+
+LARGE_MODEL = "mistral-large-latest"
+SMALL_MODEL = "mistral-small-latest"
+
+ROUTE_LOCAL = "local"
+ROUTE_SMALL = "small"
+ROUTE_LARGE = "large"
+
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "is", "are", "was", "were",
+    "be", "by", "with", "as", "at", "it", "this", "that", "from", "what", "which", "how", "why",
+    "explain", "describe", "define", "write", "give", "state", "discuss",
+}
+
+
+def stem(word):
+    # Light suffix stripper so "processes", "processing" and "processed" share one term
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("ies"):
+        word = word[:-3] + "i"
+    elif word.endswith("sses"):
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    for suffix in ("ing", "ed", "ly"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "lsz":
+                word = word[:-1]
+            break
+    if len(word) > 3 and word.endswith("e"):
+        word = word[:-1]
+    if len(word) > 3 and word.endswith("y"):
+        word = word[:-1] + "i"
+    return word
+
+
+def tokenize(text):
+    return [stem(word) for word in re.findall(r"[a-z0-9]+", (text or "").lower()) if word not in _STOPWORDS]
+
+
+def as_keyword_list(keywords):
+    # Tests store keywords as a comma-separated string; accept lists too
+    if isinstance(keywords, str):
+        keywords = keywords.split(",")
+    return [keyword.strip() for keyword in keywords or [] if keyword and keyword.strip()]
+
+
+def keyword_coverage(answer_tokens, keywords):
+    # Share of keywords whose every word appears in the answer (multi-word keywords count once)
+    if not keywords:
+        return 0.0
+    present = set(answer_tokens)
+    hits = sum(1 for keyword in keywords if tokenize(keyword) and all(t in present for t in tokenize(keyword)))
+    return hits / len(keywords)
+
+
+def cosine_similarity(tokens_a, tokens_b):
+    counts_a, counts_b = Counter(tokens_a), Counter(tokens_b)
+    dot = sum(count * counts_b[token] for token, count in counts_a.items())
+    norm = math.sqrt(sum(c * c for c in counts_a.values())) * math.sqrt(sum(c * c for c in counts_b.values()))
+    return dot / norm if norm else 0.0
+
+
+def local_score(answer, question, keywords):
+    answer_tokens = tokenize(answer)
+    keywords = as_keyword_list(keywords)
+    coverage = keyword_coverage(answer_tokens, keywords)
+    similarity = cosine_similarity(answer_tokens, tokenize(question) + tokenize(" ".join(keywords)))
+    # Without keywords, similarity to the question text is the only signal
+    combined = 0.7 * coverage + 0.3 * similarity if keywords else similarity
+    return {
+        "coverage": round(coverage, 4),
+        "similarity": round(similarity, 4),
+        "score": round(combined, 4),
+        "words": len(re.findall(r"\w+", answer or "")),
+    }
+
+
+def route_answer(answer, question, keywords, low=LOW_BAND, high=HIGH_BAND):
+    signals = local_score(answer, question, keywords)
+    if signals["score"] < low and signals["words"] < SHORT_ANSWER_WORDS:
+        route = ROUTE_LOCAL
+    elif signals["score"] >= high:
+        route = ROUTE_SMALL
+    else:
+        route = ROUTE_LARGE
+    return route, signals
+
+
+def local_evaluation():
+    # Same "Score:/Feedback:" shape the models return, so downstream parsing is unchanged
+    return (
+        f"Score: {LOCAL_SCORE}\n"
+        "Feedback: Thank you for attempting this question. Your answer is quite brief and touches on "
+        "few of the key ideas the question is looking for. Try to explain the main concepts in more "
+        "detail and use the important terms from the topic in your next attempt."
+    )
+
+
+def normalised_answer_key(q_num, answer):
+    # Near-duplicate answers (same words, different spacing/case) share one grading call
+    return (str(q_num), " ".join(re.findall(r"\w+", (answer or "").lower())))
+
+
+# ---------------- Near-duplicate grade cache ----------------
+
+GRADE_CACHE_SIZE = 2048
+grade_cache = TTLCache(maxsize=GRADE_CACHE_SIZE, ttl=None)
+
+
+def cached_grade(key):
+    return grade_cache.get(key)
+
+
+def store_grade(key, evaluation):
+    grade_cache.set(key, evaluation)
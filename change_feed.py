@@ -0,0 +1,198 @@
+import threading
+import time
+
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+from class_analytics import analytics_cache, invalidate_test_statistics
+from test_catalog import test_cache, invalidate_test
+
+
+# Background listener on MongoDB change streams. Every score write and test edit, from this
+# process or any other, bumps an in-memory version for the affected student and test and drops
+# the matching entries from the in-process caches. Pages key their st.cache_data entries on these
+# versions, so a cached page is exact until something it depends on changes, and open sessions
+# poll the versions (no query) to rerun when a new grade lands.
+#
+# Change streams need a replica set; a single-node one is enough for local work:
+#   mongod --replSet rs0 --dbpath data && mongosh --eval "rs.initiate()"
+# Against a standalone server the feed reports itself unavailable and callers fall back to
+# querying for a data version, with the caches' TTLs as the safety net.
+
+SCORES_DB = "student"
+SCORES_COLLECTION = "student_scores"
+SYSTEM_DATABASES = ("admin", "local", "config")
+WATCHED_OPERATIONS = ["insert", "update", "replace", "delete", "drop", "dropDatabase"]
+
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 30.0
+# Server errors that mean change streams will never work here (not a replica set, not supported)
+UNSUPPORTED_CODES = (40573, 40324, 303)
+# The resume token fell off the oplog; events were missed, so everything is treated as changed
+HISTORY_LOST_CODES = (286, 280)
+
+# Session refresh poll, in seconds; it reads these versions only
+REFRESH_INTERVAL = 3
+
+
+def _watch_pipeline():
+    # Scores plus every teacher database (one collection per test)
+    return [
+        {"$match": {
+            "operationType": {"$in": WATCHED_OPERATIONS},
+            "$or": [
+                {"ns.db": SCORES_DB, "ns.coll": SCORES_COLLECTION},
+                {"ns.db": {"$nin": [SCORES_DB, *SYSTEM_DATABASES]}},
+            ],
+        }},
+        {"$project": {"operationType": 1, "ns": 1, "fullDocument.prn": 1, "fullDocument.test_id": 1}},
+    ]
+
+
+class ChangeFeed:
+
+    def __init__(self, uri, ttl_caches=None):
+        self.uri = uri
+        self.live = False
+        self.available = True
+        self.error = None
+        self._lock = threading.Lock()
+        # Bumped when events may have been missed; part of every version
+        self._epoch = 0
+        self._versions = {}
+        self._resume_token = None
+        self._thread = None
+        self._ttl_caches = ttl_caches if ttl_caches is not None else [test_cache, analytics_cache]
+        self._default_ttls = [cache.ttl for cache in self._ttl_caches]
+        self.events = 0
+        self.invalidations = 0
+        self.reconnects = 0
+        self.last_event = None
+
+    # ---------------- Versions ----------------
+
+    def version(self, scope, key):
+        # "prn", "test" (scores for a test) or "test_def"; None while the feed is not live
+        with self._lock:
+            if not self.live:
+                return None
+            return f"feed:{self._epoch}:{self._versions.get((scope, key), 0)}"
+
+    def _bump(self, scope, key):
+        self._versions[(scope, key)] = self._versions.get((scope, key), 0) + 1
+
+    # ---------------- Listener ----------------
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        client = MongoClient(self.uri)
+        delay = RETRY_DELAY
+        while self.available:
+            try:
+                with client.watch(
+                    _watch_pipeline(), full_document="updateLookup", resume_after=self._resume_token
+                ) as stream:
+                    self._set_live(True)
+                    delay = RETRY_DELAY
+                    for change in stream:
+                        self._apply(change)
+                        self._resume_token = stream.resume_token
+            except OperationFailure as e:
+                if e.code in UNSUPPORTED_CODES:
+                    self.available = False
+                elif e.code in HISTORY_LOST_CODES:
+                    self._resume_token = None
+                self._fail(e)
+            except PyMongoError as e:
+                self._fail(e)
+            if self.available:
+                self.reconnects += 1
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+        client.close()
+
+    def _set_live(self, live):
+        # While live the caches are invalidated exactly, so their TTLs are switched off; while
+        # down the TTLs come back. Either way, entries cached across the switch may have missed
+        # an event, so they are dropped and the epoch moves on.
+        with self._lock:
+            if live == self.live:
+                return
+            self.live = live
+            if live:
+                self.error = None
+            self._epoch += 1
+        for cache, ttl in zip(self._ttl_caches, self._default_ttls):
+            cache.ttl = None if live else ttl
+            cache.clear()
+
+    def _fail(self, error):
+        self.error = str(error)
+        self._set_live(False)
+
+    def _apply(self, change):
+        # Caches are dropped before the versions move: a rerun woken by the new version must not
+        # find the old entry, which would otherwise stay cached (no TTL while live) under it
+        db_name, collection = change["ns"]["db"], change["ns"].get("coll")
+        document = change.get("fullDocument") or {}
+        if db_name == SCORES_DB:
+            prn, test_id = document.get("prn"), document.get("test_id")
+            if prn is None or test_id is None:
+                # Deletes (and updates whose document is already gone) carry only the _id
+                analytics_cache.clear()
+            else:
+                invalidate_test_statistics(test_id)
+        elif collection is None:
+            # A teacher database was dropped
+            test_cache.invalidate_where(lambda key: key[0] == db_name)
+        else:
+            invalidate_test(db_name, collection)
+
+        with self._lock:
+            self.events += 1
+            self.invalidations += 1
+            self.last_event = time.time()
+            if db_name == SCORES_DB:
+                if prn is None or test_id is None:
+                    self._epoch += 1
+                else:
+                    self._bump("prn", prn)
+                    self._bump("test", test_id)
+            elif collection is None:
+                self._epoch += 1
+            else:
+                self._bump("test_def", collection)
+                self._bump("test", collection)
+
+    # ---------------- Observability ----------------
+
+    def stats(self):
+        with self._lock:
+            return {
+                "live": self.live,
+                "available": self.available,
+                "error": self.error,
+                "events": self.events,
+                "invalidations": self.invalidations,
+                "reconnects": self.reconnects,
+                "tracked_keys": len(self._versions),
+                "last_event": self.last_event,
+            }
+
+
+# One listener per server for the whole process, shared by every session
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+def get_change_feed(uri):
+    with _feeds_lock:
+        if uri not in _feeds:
+            _feeds[uri] = ChangeFeed(uri).start()
+        return _feeds[uri]
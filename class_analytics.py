@@ -0,0 +1,129 @@
+from pymongo.errors import OperationFailure
+
+from caching import TTLCache
+
+
+SCORE_BUCKETS = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100.0001]
+OUTLIER_Z = 2.0
+
+# Per-test statistics, invalidated whenever a new score for the test is saved
+ANALYTICS_CACHE_SIZE = 128
+ANALYTICS_CACHE_TTL = 900
+analytics_cache = TTLCache(maxsize=ANALYTICS_CACHE_SIZE, ttl=ANALYTICS_CACHE_TTL)
+
+
+def _percentage():
+    return {"$cond": [
+        {"$gt": ["$max_marks", 0]},
+        {"$multiply": [{"$divide": ["$total_marks", "$max_marks"]}, 100]},
+        0,
+    ]}
+
+
+def _statistics_pipeline(test_id, with_percentiles=True):
+    summary = {
+        "_id": None,
+        "students": {"$sum": 1},
+        "mean": {"$avg": "$percentage"},
+        "stddev": {"$stdDevPop": "$percentage"},
+        "min": {"$min": "$percentage"},
+        "max": {"$max": "$percentage"},
+    }
+    if with_percentiles:
+        # $percentile needs MongoDB 7.0+
+        summary["percentiles"] = {"$percentile": {
+            "input": "$percentage", "p": [0.25, 0.5, 0.75, 0.9], "method": "approximate",
+        }}
+
+    return [
+        {"$match": {"test_id": test_id}},
+        {"$project": {
+            "prn": 1, "student_name": 1, "results.question_number": 1, "results.score": 1,
+            "percentage": _percentage(),
+        }},
+        {"$facet": {
+            "summary": [{"$group": summary}],
+            "distribution": [
+                {"$bucket": {
+                    "groupBy": "$percentage",
+                    "boundaries": SCORE_BUCKETS,
+                    "default": "other",
+                    "output": {"students": {"$sum": 1}},
+                }},
+            ],
+            "questions": [
+                {"$unwind": "$results"},
+                {"$group": {
+                    "_id": "$results.question_number",
+                    "mean": {"$avg": "$results.score"},
+                    "stddev": {"$stdDevPop": "$results.score"},
+                    "answered": {"$sum": {"$cond": [{"$gt": ["$results.score", 0]}, 1, 0]}},
+                    "students": {"$sum": 1},
+                }},
+            ],
+            "outliers": [
+                # Without a window the whole class is the frame, so no sortBy is needed
+                {"$setWindowFields": {"output": {
+                    "class_mean": {"$avg": "$percentage"},
+                    "class_sd": {"$stdDevPop": "$percentage"},
+                }}},
+                {"$match": {"$expr": {"$and": [
+                    {"$gt": ["$class_sd", 0]},
+                    {"$gt": [{"$abs": {"$subtract": ["$percentage", "$class_mean"]}}, {"$multiply": [OUTLIER_Z, "$class_sd"]}]},
+                ]}}},
+                {"$project": {
+                    "_id": 0, "prn": 1, "student_name": 1, "percentage": 1,
+                    "z_score": {"$divide": [{"$subtract": ["$percentage", "$class_mean"]}, "$class_sd"]},
+                }},
+                {"$sort": {"z_score": 1}},
+            ],
+        }},
+    ]
+
+
+def _question_order(q_num):
+    return (0, int(q_num)) if str(q_num).isdigit() else (1, str(q_num))
+
+
+def compute_test_statistics(scores_collection, test_id):
+    try:
+        facets = next(scores_collection.aggregate(_statistics_pipeline(test_id)), {})
+    except OperationFailure:
+        facets = next(scores_collection.aggregate(_statistics_pipeline(test_id, with_percentiles=False)), {})
+
+    if not facets.get("summary"):
+        return None
+
+    summary = facets["summary"][0]
+    summary.pop("_id", None)
+    percentiles = summary.pop("percentiles", None) or [None] * 4
+    summary.update({"p25": percentiles[0], "median": percentiles[1], "p75": percentiles[2], "p90": percentiles[3]})
+
+    return {
+        "summary": summary,
+        "distribution": [
+            {"bucket": f"{row['_id']:.0f}-{min(row['_id'] + 10, 100):.0f}%" if row["_id"] != "other" else "other",
+             "students": row["students"]}
+            for row in facets.get("distribution", [])
+        ],
+        "questions": [
+            {
+                "question_number": row["_id"],
+                "mean": row["mean"],
+                "variance": (row["stddev"] or 0) ** 2,
+                "stddev": row["stddev"] or 0,
+                "answered": row["answered"],
+                "students": row["students"],
+            }
+            for row in sorted(facets.get("questions", []), key=lambda r: _question_order(r["_id"]))
+        ],
+        "outliers": facets.get("outliers", []),
+    }
+
+
+def get_test_statistics(scores_collection, test_id):
+    return analytics_cache.get_or_load(test_id, lambda: compute_test_statistics(scores_collection, test_id))
+
+
+def invalidate_test_statistics(test_id):
+    analytics_cache.invalidate(test_id)
@@ -0,0 +1,709 @@
+import base64
+import copy
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from concurrent.futures import as_completed
+from datetime import datetime
+
+import fitz  # PyMuPDF
+from pymongo import UpdateMany
+
+from answer_routing import (
+    route_answer, local_evaluation, normalised_answer_key, cached_grade, store_grade,
+    ROUTE_LOCAL, ROUTE_SMALL, LARGE_MODEL, SMALL_MODEL, LOW_BAND, HIGH_BAND,
+)
+from class_analytics import invalidate_test_statistics
+from page_analysis import (
+    analyse_page, page_fingerprint, find_duplicate, same_submission, MIN_INK_DENSITY, MIN_INK_STDDEV,
+)
+from page_layout import layout_tiles, MAX_TILES
+from ocr_backends import PixtralBackend
+from pipeline_metrics import EvaluationMetrics, call_with_retries
+from prompts import message_text, get_batch_grading_template, format_batch_answers
+from scheduler import scheduler as default_scheduler, GRADING, INTERACTIVE
+from score_store import (
+    ensure_indexes, save_score, bulk_update_scores, load_score_version, load_feedback, load_feedback_many,
+    merge_feedback,
+)
+from test_catalog import question_fingerprint, anchors_fingerprint
+
+
+NO_ANSWER = "No Answer Found"
+MARKS_PER_QUESTION = 5
+
+# Students' answers to one question graded per request in question-major (class) mode
+BATCH_SIZE = 8
+
+# Events yielded by GradingPipeline.evaluate, in the order they can occur
+PAGE_RENDERED = "page_rendered"
+ALREADY_GRADED = "already_graded"
+PAGE_OCR = "page_ocr"
+ANSWER_SEGMENTED = "answer_segmented"
+QUESTION_GRADED = "question_graded"
+SAVED = "saved"
+# Class mode only
+SHEET_TRANSCRIBED = "sheet_transcribed"
+BATCH_GRADED = "batch_graded"
+# Regrade after a test edit only
+REGRADE_PLANNED = "regrade_planned"
+SCORES_WRITTEN = "scores_written"
+
+# Databases whose indexes this process has already ensured
+_indexed_databases = set()
+_indexes_lock = threading.Lock()
+
+
+def event(kind, **data):
+    return {"event": kind, **data}
+
+
+def match_answers_to_questions(full_text, questions_data):
+    # Locate each question's precompiled anchor, then cut the text between consecutive anchors
+    grouped_answers = {}
+    positions = []
+    for question in questions_data:
+        grouped_answers[question["question_number"]] = NO_ANSWER
+        match = question["anchor_re"].search(full_text)
+        if match:
+            positions.append((match.start(), question["question_number"]))
+    positions.sort()
+
+    for (start_pos, q_num), (end_pos, _) in zip(positions, positions[1:] + [(len(full_text), None)]):
+        grouped_answers[q_num] = full_text[start_pos:end_pos].strip()
+
+    return grouped_answers
+
+
+def _cancel_pending(futures):
+    # Called when an event generator finishes or is closed (the session stopped, reran or
+    # navigated away): calls still queued on the shared scheduler are dropped rather than run
+    # for a page nobody is watching. Calls already running finish on their own.
+    for future in futures:
+        future.cancel()
+
+
+def _tagged(events, **tags):
+    # Re-yield a sub-generator's events with extra fields, passing its return value through
+    while True:
+        try:
+            update = next(events)
+        except StopIteration as stop:
+            return stop.value
+        yield {**update, **tags}
+
+
+def parse_batch_grades(content):
+    # {"grades": [{"id": "S1", "score": 4, "feedback": "..."}]} -> {"S1": "Score: 4\nFeedback: ..."}
+    try:
+        data = json.loads(content)
+    except ValueError:
+        match = re.search(r"\{.*\}", content, re.DOTALL)
+        try:
+            data = json.loads(match.group(0)) if match else {}
+        except ValueError:
+            data = {}
+
+    grades = data.get("grades", []) if isinstance(data, dict) else data
+    parsed = {}
+    for grade in grades if isinstance(grades, list) else []:
+        if isinstance(grade, dict) and "id" in grade and "score" in grade:
+            label = str(grade["id"]).strip("[] ")
+            parsed[label] = f"Score: {grade['score']}\nFeedback: {grade.get('feedback', '')}"
+    return parsed
+
+
+def _stored_sheet_fields(sheet, questions_data):
+    # Kept on the score document so a later test edit can be regraded without OCR
+    return {"transcript": sheet["transcript"], "anchors_fingerprint": anchors_fingerprint(questions_data)}
+
+
+def parse_score(evaluation_result):
+    score_match = re.search(r'Score:\s*(\d+\.?\d*)', evaluation_result)
+    if score_match:
+        # Ensure minimum of 3 unless blank
+        return max(3, math.ceil(float(score_match.group(1))))
+    return 3  # Default to minimum score if parsing fails
+
+
+class GradingPipeline:
+    # OCR -> segmentation -> routed grading -> persistence for one answer sheet at a time.
+    # evaluate() is a generator of events so callers can render progress as it happens.
+
+    def __init__(self, image_client, eval_client, students_db, grading_template, teacher=None,
+                 min_ink_density=MIN_INK_DENSITY, min_ink_stddev=MIN_INK_STDDEV,
+                 routing_low=LOW_BAND, routing_high=HIGH_BAND, small_model=SMALL_MODEL,
+                 scheduler=None, priority=INTERACTIVE, batch_template=None, ocr_backend=None,
+                 max_tiles=MAX_TILES):
+        self.image_client = image_client
+        # Pixtral unless a test picks another engine (see ocr_backends.py)
+        self.ocr_backend = ocr_backend or PixtralBackend(image_client)
+        # 1 sends whole pages, as before layout tiling
+        self.max_tiles = max_tiles
+        self.eval_client = eval_client
+        self.grading_template = grading_template
+        self.batch_template = batch_template or get_batch_grading_template()
+        self.teacher = teacher
+        self.min_ink_density = min_ink_density
+        self.min_ink_stddev = min_ink_stddev
+        self.routing_low = routing_low
+        self.routing_high = routing_high
+        self.small_model = small_model
+        # API calls go through the shared scheduler, queued under this teacher
+        self.scheduler = scheduler or default_scheduler
+        self.priority = priority
+
+        self.scores_collection = students_db["student_scores"]
+        self.history_collection = students_db["student_scores_history"]
+        self.submissions_collection = students_db["submission_hashes"]
+        self.feedback_collection = students_db["student_feedback"]
+
+    def with_priority(self, priority):
+        # Same configuration, queued at another priority (e.g. BATCH for whole-class runs)
+        pipeline = copy.copy(self)
+        pipeline.priority = priority
+        return pipeline
+
+    def with_ocr_backend(self, ocr_backend):
+        pipeline = copy.copy(self)
+        pipeline.ocr_backend = ocr_backend
+        return pipeline
+
+    def submit(self, resource, fn, metrics, *args):
+        # Queue one API-bound call on the shared scheduler, recording how long it waited
+        enqueued = time.monotonic()
+
+        def run():
+            metrics.incr("queued_tasks")
+            metrics.incr("queue_wait_ms", int((time.monotonic() - enqueued) * 1000))
+            return fn(*args)
+
+        return self.scheduler.submit(resource, self.teacher, run, self.priority)
+
+    def ensure_indexes(self):
+        # Once per process and database: the dashboard builds a pipeline on every rerun
+        with _indexes_lock:
+            if self.scores_collection.full_name in _indexed_databases:
+                return
+            ensure_indexes(self.scores_collection, self.history_collection)
+            self.submissions_collection.create_index([("test_id", 1), ("prn", 1), ("timestamp", -1)])
+            _indexed_databases.add(self.scores_collection.full_name)
+
+    # ---------------- Rendering ----------------
+
+    def pdf_to_base64_pymupdf(self, pdf_bytes, metrics):
+        # Blank pages and repeated scans are flagged from a thumbnail so they never reach the OCR API.
+        # Written pages are cut into layout tiles (see page_layout.py), one OCR request each.
+        pages = []
+        seen_pages = []
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            for idx, page in enumerate(doc):
+                analysis = analyse_page(page, self.min_ink_density, self.min_ink_stddev)
+                fingerprint = page_fingerprint(analysis)
+                entry = {"fingerprint": fingerprint, "tiles": [], "status": "ok", "duplicate_of": None}
+                if analysis["blank"]:
+                    metrics.incr("blank_pages_skipped")
+                    entry["status"] = "blank"
+                else:
+                    duplicate_of = find_duplicate(fingerprint, seen_pages)
+                    if duplicate_of is not None:
+                        metrics.incr("duplicate_pages_skipped")
+                        entry["status"] = "duplicate"
+                        entry["duplicate_of"] = duplicate_of
+                    else:
+                        seen_pages.append((idx, fingerprint))
+                        clips = layout_tiles(page, max_tiles=self.max_tiles) if self.max_tiles > 1 else [None]
+                        entry["tiles"] = [
+                            base64.b64encode(page.get_pixmap(clip=clip).tobytes("png")).decode("utf-8")
+                            for clip in clips
+                        ]
+                        metrics.incr("tiles", len(entry["tiles"]))
+                pages.append(entry)
+        return pages
+
+    # ---------------- OCR ----------------
+
+    def ocr_page(self, image, metrics):
+        return self.ocr_backend.recognise(image, metrics)
+
+    def extract_text_from_images(self, pages, metrics):
+        # Generator: OCRs every tile concurrently, yields a PAGE_OCR event once all of a page's
+        # tiles are back, returns the full text with tiles stitched in reading order
+        page_texts = {}
+        tile_texts = {}
+        tile_errors = {}
+        for idx, page in enumerate(pages):
+            if page["status"] == "blank":
+                page_texts[idx] = f"\nPage {idx+1}: [blank page]\n"
+            elif page["status"] == "duplicate":
+                page_texts[idx] = f"\nPage {idx+1}: [duplicate of page {page['duplicate_of']+1}]\n"
+            else:
+                tile_texts[idx] = [None] * len(page["tiles"])
+                tile_errors[idx] = []
+
+        futures = {
+            self.submit(self.ocr_backend.resource, self.ocr_page, metrics, image, metrics): (idx, tile)
+            for idx, page in enumerate(pages) if page["status"] == "ok"
+            for tile, image in enumerate(page["tiles"])
+        }
+        try:
+            for future in as_completed(futures):
+                idx, tile = futures[future]
+                try:
+                    recognised = future.result()
+                    tile_texts[idx][tile] = recognised["text"]
+                except Exception as e:
+                    tile_texts[idx][tile] = ""
+                    tile_errors[idx].append(str(e))
+                if any(text is None for text in tile_texts[idx]):
+                    continue
+
+                tiles, errors = len(tile_texts[idx]), tile_errors[idx]
+                if len(errors) == tiles:
+                    page_texts[idx] = f"\nPage {idx+1}: Error processing image\n"
+                    yield event(PAGE_OCR, page=idx, total=len(pages), tiles=tiles, error=errors[0])
+                    continue
+
+                text = "\n".join(text for text in tile_texts[idx] if text)
+                page_texts[idx] = f"\nPage {idx+1}:\n{text}\n"
+                update = event(PAGE_OCR, page=idx, total=len(pages), tiles=tiles, text=text,
+                               backend=self.ocr_backend.name)
+                if errors:
+                    update["error"] = f"{len(errors)} of {tiles} region(s) could not be read: {errors[0]}"
+                yield update
+        finally:
+            _cancel_pending(futures)
+
+        return "".join(page_texts[idx] for idx in range(len(pages)))
+
+    # ---------------- Grading ----------------
+
+    def plan_grade(self, question, student_answer, test_id, template_version):
+        # Decides who grades an answer: blank, cache, local rule, small or large model.
+        # "evaluation" is already filled in unless a model call is still needed.
+        if student_answer == NO_ANSWER or student_answer.strip() == "":
+            return {"route": None, "signals": None, "evaluation": "No answer found for this question.", "score": 0, "model": None}
+
+        started = time.perf_counter()
+        # Cheap local pre-score decides who grades: cache, local rule, small or large model
+        route, signals = route_answer(student_answer, question["question"], question["keywords"], self.routing_low, self.routing_high)
+        # The question's fingerprint keeps grades from before a test edit out of a regrade
+        cache_key = (test_id, template_version, question_fingerprint(question)) + normalised_answer_key(
+            question["question_number"], student_answer
+        )
+        evaluation_result = cached_grade(cache_key)
+        model = None
+
+        if evaluation_result is not None:
+            route = "cache"
+        elif route == ROUTE_LOCAL:
+            evaluation_result = local_evaluation()
+        else:
+            model = self.small_model if route == ROUTE_SMALL else LARGE_MODEL
+
+        return {"route": route, "signals": signals, "evaluation": evaluation_result, "score": None,
+                "model": model, "cache_key": cache_key, "started": started}
+
+    def finish_grade(self, question, student_answer, plan, metrics, error=None, seconds=None):
+        # `seconds` is the time spent grading this answer; by default everything since plan_grade
+        evaluation_result = plan["evaluation"]
+        score = plan["score"]
+        if plan["route"] is not None:
+            if seconds is None:
+                seconds = time.perf_counter() - plan["started"]
+            metrics.incr(f"routed_{plan['route']}")
+            metrics.incr(f"routed_{plan['route']}_ms", seconds * 1000)
+        if error is not None:
+            evaluation_result = "Error in evaluation process. Score: 0"
+            score = 0
+        elif score is None:
+            score = parse_score(evaluation_result)
+
+        return {
+            "question_number": question["question_number"],
+            "question": question["question"],
+            "answer": student_answer,
+            "evaluation": evaluation_result,
+            "score": score,
+            "route": plan["route"],
+            "local_score": plan["signals"]["score"] if plan["signals"] else None,
+            "fingerprint": question_fingerprint(question),
+            "error": error,
+        }
+
+    def call_model(self, question, student_answer, model, metrics):
+        # Static instructions form a stable prefix; the question and answer go last
+        eval_prompt = self.grading_template.render(
+            q_num=question["question_number"],
+            question=question["question"],
+            keywords=", ".join(question["keywords"]),
+            answer=student_answer,
+        )
+
+        metrics.incr("grading_payload_bytes", len(message_text(eval_prompt).encode("utf-8")))
+        eval_response = call_with_retries(
+            lambda: self.eval_client.chat.complete(model=model, messages=eval_prompt),
+            metrics,
+        )
+        metrics.record_usage(model, eval_response)
+        return eval_response.choices[0].message.content
+
+    def grade_answer(self, question, student_answer, test_id, metrics):
+        # Thread-safe: grades one answer and returns its result entry
+        plan = self.plan_grade(question, student_answer, test_id, self.grading_template.version)
+        error = None
+        if plan["evaluation"] is None:
+            try:
+                plan["evaluation"] = self.call_model(question, student_answer, plan["model"], metrics)
+                store_grade(plan["cache_key"], plan["evaluation"])
+            except Exception as e:
+                error = str(e)
+
+        return self.finish_grade(question, student_answer, plan, metrics, error)
+
+    def grade_batch(self, question, model, answers, metrics):
+        # Thread-safe: grades several students' answers to one question in a single request.
+        # Returns [(evaluation, error)] in the order of `answers`; students missing from the
+        # reply are regraded one at a time.
+        labelled = [(f"S{i+1}", answer) for i, answer in enumerate(answers)]
+        batch_prompt = self.batch_template.render(
+            q_num=question["question_number"],
+            question=question["question"],
+            keywords=", ".join(question["keywords"]),
+            answers=format_batch_answers(labelled),
+        )
+
+        with metrics.stage("batch_request"):
+            return self._grade_batch(question, model, labelled, batch_prompt, metrics)
+
+    def _grade_batch(self, question, model, labelled, batch_prompt, metrics):
+        metrics.incr("grading_payload_bytes", len(message_text(batch_prompt).encode("utf-8")))
+        try:
+            batch_response = call_with_retries(
+                lambda: self.eval_client.chat.complete(
+                    model=model, messages=batch_prompt, response_format={"type": "json_object"}
+                ),
+                metrics,
+            )
+            metrics.record_usage(model, batch_response)
+            grades = parse_batch_grades(batch_response.choices[0].message.content)
+        except Exception as e:
+            return [(None, str(e))] * len(labelled)
+
+        outcomes = []
+        for label, answer in labelled:
+            if label in grades:
+                outcomes.append((grades[label], None))
+                continue
+            metrics.incr("batch_fallbacks")
+            try:
+                outcomes.append((self.call_model(question, answer, model, metrics), None))
+            except Exception as e:
+                outcomes.append((None, str(e)))
+        return outcomes
+
+    def evaluate_answers(self, grouped_answers, questions_data, test_id, metrics):
+        # Generator: grades questions concurrently, yields QUESTION_GRADED as each completes,
+        # returns results in question order
+        results = [None] * len(questions_data)
+        futures = {
+            self.submit(
+                GRADING, self.grade_answer, metrics,
+                question, grouped_answers.get(question["question_number"], NO_ANSWER), test_id, metrics,
+            ): i
+            for i, question in enumerate(questions_data)
+        }
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                yield event(QUESTION_GRADED, index=i, total=len(questions_data), result=results[i])
+        finally:
+            _cancel_pending(futures)
+        return results
+
+    # ---------------- Persistence ----------------
+
+    def save_results(self, results, student_name, prn, test_id, extra=None):
+        total_marks = sum(result["score"] for result in results)
+        max_marks = len(results) * MARKS_PER_QUESTION
+        stored = [{k: v for k, v in result.items() if k != "error"} for result in results]
+
+        # One current document per test and student; earlier attempts go to history
+        score_id, version = save_score(self.scores_collection, self.history_collection, {
+            "test_id": test_id,
+            "student_name": student_name,
+            "prn": prn,
+            "results": stored,
+            "total_marks": total_marks,
+            "max_marks": max_marks,
+            "timestamp": datetime.now(),
+            **(extra or {}),
+        }, self.feedback_collection)
+        invalidate_test_statistics(test_id)
+        return score_id, version, total_marks, max_marks
+
+    def find_previous_submission(self, test_id, prn, file_sha256, page_fingerprints=None):
+        # Look up an earlier grading of the same sheet, by exact file hash or matching page fingerprints
+        for submission in self.submissions_collection.find({"test_id": test_id, "prn": prn}).sort("timestamp", -1):
+            if submission.get("file_sha256") == file_sha256:
+                return submission
+            if page_fingerprints and same_submission(page_fingerprints, submission.get("page_fingerprints", [])):
+                return submission
+        return None
+
+    def load_saved_score(self, submission):
+        # The attempt this sheet was graded as. Records written before versions were stored can
+        # only be trusted while no later attempt has been saved; otherwise the sheet is regraded.
+        version = submission.get("version")
+        if version is None:
+            saved = self.scores_collection.find_one({"_id": submission.get("score_id")})
+            if saved is None or (saved.get("version") or 1) > 1:
+                return None
+        else:
+            saved = load_score_version(self.scores_collection, self.history_collection,
+                                       submission["test_id"], submission["prn"], version)
+        return load_feedback(self.feedback_collection, saved) if saved else None
+
+    def record_submission(self, test_id, prn, file_sha256, page_fingerprints, score_id, version):
+        self.submissions_collection.insert_one({
+            "test_id": test_id,
+            "prn": prn,
+            "teacher": self.teacher,
+            "file_sha256": file_sha256,
+            "page_fingerprints": page_fingerprints,
+            "score_id": score_id,
+            "version": version,
+            "timestamp": datetime.now(),
+        })
+
+    # ---------------- Whole sheet ----------------
+
+    def transcribe(self, pdf_bytes, questions_data, test_id, prn, metrics, force_regrade=False):
+        # Generator shared by both grading modes: render, resubmission check, OCR, segmentation.
+        # Returns the segmented sheet, or None after yielding ALREADY_GRADED.
+        # Stage timings include the time the caller spends handling each yielded event.
+        file_sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+
+        previous = None if force_regrade else self.find_previous_submission(test_id, prn, file_sha256)
+        saved = self.load_saved_score(previous) if previous else None
+        if saved:
+            metrics.incr("cache_hits")
+            yield event(ALREADY_GRADED, score=saved)
+            return None
+
+        with metrics.stage("render"):
+            pages = self.pdf_to_base64_pymupdf(pdf_bytes, metrics)
+        metrics.incr("pages", len(pages))
+        for idx, page in enumerate(pages):
+            yield event(PAGE_RENDERED, page=idx, total=len(pages), status=page["status"])
+
+        page_fingerprints = [page["fingerprint"] for page in pages if page["status"] != "blank"]
+        previous = None if force_regrade else self.find_previous_submission(test_id, prn, file_sha256, page_fingerprints)
+        saved = self.load_saved_score(previous) if previous else None
+        if saved:
+            metrics.incr("cache_hits")
+            yield event(ALREADY_GRADED, score=saved)
+            return None
+        metrics.incr("cache_misses")
+
+        with metrics.stage("ocr"):
+            full_text = yield from self.extract_text_from_images(pages, metrics)
+
+        with metrics.stage("segment"):
+            grouped_answers = match_answers_to_questions(full_text, questions_data)
+        for question in questions_data:
+            answer = grouped_answers[question["question_number"]]
+            yield event(ANSWER_SEGMENTED, question_number=question["question_number"], found=answer != NO_ANSWER)
+
+        return {"file_sha256": file_sha256, "page_fingerprints": page_fingerprints, "answers": grouped_answers, "transcript": full_text}
+
+    def evaluate(self, pdf_bytes, questions_data, test_id, student_name, prn, metrics, force_regrade=False):
+        metrics.labels["grading_mode"] = "sheet"
+        sheet = yield from self.transcribe(pdf_bytes, questions_data, test_id, prn, metrics, force_regrade)
+        if sheet is None:
+            return
+
+        with metrics.stage("grading"):
+            results = yield from self.evaluate_answers(sheet["answers"], questions_data, test_id, metrics)
+
+        with metrics.stage("save"):
+            score_id, version, total_marks, max_marks = self.save_results(
+                results, student_name, prn, test_id, _stored_sheet_fields(sheet, questions_data)
+            )
+            self.record_submission(test_id, prn, sheet["file_sha256"], sheet["page_fingerprints"], score_id, version)
+        yield event(SAVED, score_id=score_id, total_marks=total_marks, max_marks=max_marks)
+
+    # ---------------- Whole class, question-major ----------------
+
+    def evaluate_class(self, sheets, questions_data, test_id, batch_size=BATCH_SIZE, force_regrade=False):
+        # sheets: [{"student_name", "prn", "pdf_bytes"}]. Every sheet is transcribed first; grading
+        # then goes question by question with up to batch_size students' answers per request, so
+        # the instructions and rubric are sent once per batch instead of once per student.
+        # Events carry the student's prn; ALREADY_GRADED and SAVED also carry the sheet's metrics.
+        prepared = []
+        for sheet_index, sheet in enumerate(sheets):
+            metrics = EvaluationMetrics(test_id, sheet["prn"], teacher=self.teacher)
+            metrics.labels.update({
+                "grading_mode": "batch",
+                "prompt_version": self.batch_template.version,
+                "batch_size": batch_size,
+            })
+            transcribed = yield from _tagged(
+                self.transcribe(sheet["pdf_bytes"], questions_data, test_id, sheet["prn"], metrics, force_regrade),
+                prn=sheet["prn"], metrics=metrics,
+            )
+            if transcribed is not None:
+                prepared.append({**sheet, **transcribed, "metrics": metrics, "results": [None] * len(questions_data)})
+            yield event(SHEET_TRANSCRIBED, prn=sheet["prn"], index=sheet_index, total=len(sheets))
+
+        if not prepared:
+            return
+
+        yield from self.grade_question_major(prepared, questions_data, test_id, batch_size)
+
+        for sheet in prepared:
+            metrics = sheet["metrics"]
+            with metrics.stage("save"):
+                score_id, version, total_marks, max_marks = self.save_results(
+                    sheet["results"], sheet["student_name"], sheet["prn"], test_id,
+                    _stored_sheet_fields(sheet, questions_data),
+                )
+                self.record_submission(test_id, sheet["prn"], sheet["file_sha256"], sheet["page_fingerprints"],
+                                       score_id, version)
+            yield event(SAVED, prn=sheet["prn"], student_name=sheet["student_name"], score_id=score_id,
+                        total_marks=total_marks, max_marks=max_marks, metrics=metrics)
+
+    def grade_question_major(self, prepared, questions_data, test_id, batch_size=BATCH_SIZE):
+        # Fills every None in each sheet's "results" (one slot per question) from its "answers".
+        # Blank, cached and locally scored answers are settled here; the rest are batched per model.
+        grading_started = time.perf_counter()
+        futures = {}
+        for q_index, question in enumerate(questions_data):
+            by_model = {}
+            for sheet in prepared:
+                if sheet["results"][q_index] is not None:
+                    continue
+                answer = sheet["answers"].get(question["question_number"], NO_ANSWER)
+                plan = self.plan_grade(question, answer, test_id, self.batch_template.version)
+                if plan["evaluation"] is None:
+                    by_model.setdefault(plan["model"], []).append((sheet, answer, plan))
+                else:
+                    sheet["results"][q_index] = self.finish_grade(question, answer, plan, sheet["metrics"])
+
+            for model, entries in by_model.items():
+                for chunk_start in range(0, len(entries), batch_size):
+                    chunk = entries[chunk_start:chunk_start + batch_size]
+                    # One collector per request; each student is charged an equal share afterwards
+                    chunk_metrics = EvaluationMetrics(test_id, None, teacher=self.teacher)
+                    future = self.submit(
+                        GRADING, self.grade_batch, chunk_metrics,
+                        question, model, [answer for _, answer, _ in chunk], chunk_metrics,
+                    )
+                    futures[future] = (q_index, chunk, chunk_metrics)
+
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                q_index, chunk, chunk_metrics = futures[future]
+                question = questions_data[q_index]
+                outcomes = future.result()
+                # Each answer is charged its share of the request, not the time it waited in the queue
+                seconds = chunk_metrics.stages.get("batch_request", 0.0) / len(chunk)
+                for (sheet, answer, plan), (evaluation, error) in zip(chunk, outcomes):
+                    sheet["metrics"].absorb(chunk_metrics, 1 / len(chunk))
+                    if evaluation is not None:
+                        plan["evaluation"] = evaluation
+                        store_grade(plan["cache_key"], evaluation)
+                    sheet["results"][q_index] = self.finish_grade(question, answer, plan, sheet["metrics"], error, seconds)
+                yield event(BATCH_GRADED, question_number=question["question_number"], students=len(chunk),
+                            done=done, total=len(futures))
+        finally:
+            _cancel_pending(futures)
+
+        grading_seconds = time.perf_counter() - grading_started
+        for sheet in prepared:
+            sheet["metrics"].add_stage_time("grading", grading_seconds / len(prepared))
+
+    # ---------------- Regrade after a test edit ----------------
+
+    def regrade_test(self, questions_data, test_id, batch_size=BATCH_SIZE):
+        # Brings every stored score for test_id in line with the current definition without OCR.
+        # Stored answers are reused; transcripts are re-segmented only when the anchors changed,
+        # and only questions whose wording, keywords or answer changed are graded again.
+        # Scores saved before transcripts and fingerprints were stored can only reuse their answers.
+        anchors = anchors_fingerprint(questions_data)
+        prepared, skipped, resegmented = [], [], 0
+
+        # Score documents are slim; their answers and transcripts come from student_feedback
+        documents = list(self.scores_collection.find({"test_id": test_id}))
+        feedback = load_feedback_many(self.feedback_collection, documents)
+
+        for document in documents:
+            full = merge_feedback(document, feedback.get(document.get("feedback_id")))
+            previous = {result.get("question_number"): result for result in full.get("results", [])}
+            resegment = document.get("anchors_fingerprint") != anchors and bool(full.get("transcript"))
+            if resegment:
+                answers = match_answers_to_questions(full["transcript"], questions_data)
+                resegmented += 1
+            else:
+                answers = {q_num: result.get("answer") for q_num, result in previous.items()}
+
+            if any(answers.get(question["question_number"]) is None for question in questions_data):
+                # Neither a transcript nor the segmented answer was stored; needs the PDF again
+                skipped.append(document["prn"])
+                continue
+
+            results = []
+            for question in questions_data:
+                old = previous.get(question["question_number"])
+                unchanged = (
+                    old is not None
+                    and old.get("fingerprint") == question_fingerprint(question)
+                    and old.get("answer") == answers[question["question_number"]]
+                )
+                results.append(old if unchanged else None)
+
+            if None not in results and len(previous) == len(questions_data):
+                continue
+
+            metrics = EvaluationMetrics(test_id, document["prn"], teacher=self.teacher)
+            metrics.labels.update({"grading_mode": "regrade", "prompt_version": self.batch_template.version})
+            if resegment:
+                metrics.incr("resegmented")
+            prepared.append({"document": document, "transcript": full.get("transcript"), "answers": answers,
+                             "results": results, "metrics": metrics})
+
+        yield event(REGRADE_PLANNED, students=len(prepared), skipped=skipped, resegmented=resegmented,
+                    answers=sum(result is None for sheet in prepared for result in sheet["results"]))
+        if not prepared:
+            return
+
+        yield from self.grade_question_major(prepared, questions_data, test_id, batch_size)
+
+        updates = []
+        for sheet in prepared:
+            stored = [{k: v for k, v in result.items() if k != "error"} for result in sheet["results"]]
+            updates.append((sheet["document"], {
+                "results": stored,
+                "total_marks": sum(result["score"] for result in stored),
+                "max_marks": len(stored) * MARKS_PER_QUESTION,
+                "anchors_fingerprint": anchors,
+                "regraded_at": datetime.now(),
+                # Carried over to the new feedback document
+                "transcript": sheet["transcript"],
+            }))
+
+        for written in bulk_update_scores(self.scores_collection, self.history_collection, updates,
+                                          feedback_collection=self.feedback_collection):
+            yield event(SCORES_WRITTEN, written=written, total=len(updates))
+        # The regraded version stands for the same sheet, so its submission records follow it
+        self.submissions_collection.bulk_write([
+            UpdateMany({"test_id": test_id, "prn": document["prn"], "version": document.get("version")},
+                       {"$inc": {"version": 1}})
+            for document, _ in updates
+        ], ordered=False)
+        invalidate_test_statistics(test_id)
+        yield event(SAVED, students=len(updates), metrics=[sheet["metrics"] for sheet in prepared])
@@ -0,0 +1,130 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from answer_routing import as_keyword_list, tokenize
+from score_store import load_feedback_many, merge_feedback
+
+
+def build_keyword_index(questions):
+    # Vocabulary of keyword terms plus a (terms x keywords) incidence matrix and a
+    # (keywords x questions) membership matrix, built once per test
+    question_numbers = [str(q.get("question_number", i + 1)) for i, q in enumerate(questions)]
+    vocabulary = {}
+    keyword_terms = []
+    keyword_question = []
+    for q_idx, question in enumerate(questions):
+        # Compiled tests carry stemmed keyword terms already; older ones are tokenized here
+        keyword_term_lists = question.get("keyword_terms") or [
+            sorted(set(tokenize(keyword))) for keyword in as_keyword_list(question.get("keywords"))
+        ]
+        for terms in keyword_term_lists:
+            if not terms:
+                continue
+            keyword_terms.append([vocabulary.setdefault(term, len(vocabulary)) for term in terms])
+            keyword_question.append(q_idx)
+
+    term_keyword = np.zeros((len(vocabulary), len(keyword_terms)), dtype=np.float32)
+    for k_idx, term_ids in enumerate(keyword_terms):
+        term_keyword[term_ids, k_idx] = 1.0
+
+    keyword_membership = np.zeros((len(keyword_terms), len(questions)), dtype=np.float32)
+    keyword_membership[np.arange(len(keyword_terms)), keyword_question] = 1.0
+
+    return {
+        "question_numbers": question_numbers,
+        "vocabulary": vocabulary,
+        "term_keyword": term_keyword,
+        "keyword_length": term_keyword.sum(axis=0),
+        "keyword_membership": keyword_membership,
+        "keywords_per_question": keyword_membership.sum(axis=0),
+    }
+
+
+def term_matrix(texts, vocabulary):
+    # Sparse binary presence matrix (answers x vocabulary) in CSR form: memory grows with the
+    # keyword terms actually found, not with answers x vocabulary
+    indptr, indices = [0], []
+    for text in texts:
+        indices.extend({vocabulary[token] for token in tokenize(text) if token in vocabulary})
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.float32)
+    return csr_matrix((data, indices, indptr), shape=(len(texts), len(vocabulary)))
+
+
+def coverage_matrix(answers, questions, index=None):
+    # answers: iterable of (student, question_number, text).
+    # Returns (students, question_numbers, matrix) where matrix[s, q] is the share of
+    # question q's keywords found in student s's answer, NaN where no answer exists.
+    index = index or build_keyword_index(questions)
+    answers = list(answers)
+    students = sorted({student for student, _, _ in answers})
+    student_pos = {student: i for i, student in enumerate(students)}
+    question_pos = {q_num: i for i, q_num in enumerate(index["question_numbers"])}
+    answers = [a for a in answers if str(a[1]) in question_pos]
+
+    matrix = np.full((len(students), len(question_pos)), np.nan, dtype=np.float32)
+    if not answers:
+        return students, index["question_numbers"], matrix
+
+    row_idx = np.array([student_pos[student] for student, _, _ in answers])
+    col_idx = np.array([question_pos[str(q_num)] for _, q_num, _ in answers])
+
+    presence = term_matrix([text for _, _, text in answers], index["vocabulary"])
+    # A keyword is hit when every one of its terms is present
+    hits = (presence @ index["term_keyword"]) >= index["keyword_length"]
+    per_question = hits.astype(np.float32) @ index["keyword_membership"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        per_question = per_question / index["keywords_per_question"]
+
+    matrix[row_idx, col_idx] = per_question[np.arange(len(answers)), col_idx]
+    return students, index["question_numbers"], matrix
+
+
+def load_class_answers(scores_collection, feedback_collection, test_id, batch_size=200):
+    # Stream only the per-question answer text for one test. Answers live in the compressed
+    # feedback documents (inline for scores saved before the split), fetched a batch at a time.
+    cursor = scores_collection.find(
+        {"test_id": test_id},
+        {"_id": 0, "prn": 1, "feedback_id": 1, "results.question_number": 1, "results.answer": 1},
+        batch_size=batch_size,
+    )
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) == batch_size:
+            yield from _batch_answers(feedback_collection, batch)
+            batch = []
+    yield from _batch_answers(feedback_collection, batch)
+
+
+def _batch_answers(feedback_collection, documents):
+    feedback = load_feedback_many(feedback_collection, documents)
+    for document in documents:
+        full = merge_feedback(document, feedback.get(document.get("feedback_id")))
+        for result in full.get("results", []):
+            if result.get("answer"):
+                yield document["prn"], str(result.get("question_number")), result["answer"]
+
+
+if __name__ == "__main__":
+    # Benchmark: python keyword_coverage.py [answers]
+    import random
+    import sys
+    import time
+
+    n_answers = int(sys.argv[1]) if len(sys.argv) > 1 else 6000
+    words = [f"term{i}" for i in range(400)]
+    questions = [
+        {"question_number": str(q), "keywords": ", ".join(random.sample(words, 6))}
+        for q in range(1, 7)
+    ]
+    answers = [
+        (f"PRN{i // 6:05d}", str(i % 6 + 1), " ".join(random.choices(words, k=120)))
+        for i in range(n_answers)
+    ]
+
+    start = time.perf_counter()
+    students, question_numbers, matrix = coverage_matrix(answers, questions)
+    elapsed = time.perf_counter() - start
+    print(f"{n_answers} answers -> {matrix.shape[0]} students x {matrix.shape[1]} questions "
+          f"in {elapsed * 1000:.1f} ms (mean coverage {np.nanmean(matrix):.3f})")
@@ -0,0 +1,401 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+import pymongo
+
+
+# Concurrent-user load test for stud_dashboard.py. Starts the dashboard with `streamlit run`
+# and drives it like browsers would: each simulated student is a headless websocket session
+# that logs in and then cycles Home -> View Test Results -> Performance Analytics. Reports,
+# for each user count in --users, per-page p50/p99 rerun time (request sent until the script
+# finished), MongoDB operations per rerun and the server process's CPU and RSS.
+#
+#   python load_test.py --mongo-uri mongodb://localhost:27017 --seed --users 1,5,10,20
+#   python load_test.py --users 20 --max-p99-ms 1500      # exits non-zero over budget
+#
+# --seed writes LOAD* students into the `student` database and test definitions into the
+# loadtest_teacher database of --mongo-uri, so point it at a local scratch server. MongoDB
+# operations come from serverStatus and include background traffic such as the change feed,
+# which is measured while idle and subtracted. CPU and RSS are read from /proc (Linux).
+# Sessions do not run the periodic refresh fragment a browser would.
+
+DASHBOARD = "stud_dashboard.py"
+PAGES = {"home": "🏠 Home", "results": "📊 View Test Results", "analytics": "📈 Performance Analytics"}
+ROUTE = ["home", "results", "analytics"]
+
+PRN_PREFIX = "LOAD"
+TEACHER_DB = "loadtest_teacher"
+SUBJECTS = ["Physics", "Chemistry", "Mathematics", "Biology", "Computer Science"]
+QUESTIONS_PER_TEST = 6
+SEED_PASSWORD = "loadtest"
+
+SERVER_START_TIMEOUT = 60
+RERUN_TIMEOUT = 300
+
+
+# ---------------- Seeding ----------------
+
+def seed(client, students, tests, batch_size=1000):
+    import bcrypt
+    from score_store import ensure_indexes, split_feedback, feedback_document
+
+    db = client["student"]
+    scores, feedback = db["student_scores"], db["student_feedback"]
+    seeded = {"prn": {"$regex": f"^{PRN_PREFIX}"}}
+    feedback.delete_many({"_id": {"$in": scores.distinct("feedback_id", seeded)}})
+    scores.delete_many(seeded)
+    db["stud_metadata"].delete_many(seeded)
+    client.drop_database(TEACHER_DB)
+    ensure_indexes(scores, db["student_scores_history"])
+
+    test_ids = [f"LOADTEST{t:03d}" for t in range(tests)]
+    for t, test_id in enumerate(test_ids):
+        client[TEACHER_DB][test_id].insert_one({"quiz_id": test_id, "subject": SUBJECTS[t % len(SUBJECTS)], "questions": []})
+
+    password = bcrypt.hashpw(SEED_PASSWORD.encode(), bcrypt.gensalt()).decode()
+    prns = [f"{PRN_PREFIX}{i:05d}" for i in range(students)]
+    db["stud_metadata"].insert_many([
+        {"student_name": f"Load Student {i}", "prn": prn, "mothers_name": "Seed", "password": password,
+         "created_at": datetime.now()}
+        for i, prn in enumerate(prns)
+    ])
+
+    rng = random.Random(0)
+    started = datetime.now() - timedelta(days=tests * 7)
+    pending_scores, pending_feedback = [], []
+    for i, prn in enumerate(prns):
+        for t, test_id in enumerate(test_ids):
+            results = []
+            for q in range(1, QUESTIONS_PER_TEST + 1):
+                score = rng.randint(0, 5)
+                results.append({"question_number": str(q), "question": f"Question {q} of {test_id}",
+                                "answer": "answer text " * 40, "evaluation": f"Feedback text. Score: {score}",
+                                "score": score, "route": "large", "local_score": None, "fingerprint": None})
+            hot, payload = split_feedback({
+                "test_id": test_id, "student_name": f"Load Student {i}", "prn": prn, "results": results,
+                "total_marks": sum(r["score"] for r in results), "max_marks": QUESTIONS_PER_TEST * 5,
+                "timestamp": started + timedelta(days=t * 7, minutes=i), "version": 1,
+                "transcript": "transcript text " * 200,
+            })
+            cold = feedback_document(payload)
+            hot["feedback_id"] = cold["_id"]
+            pending_scores.append(hot)
+            pending_feedback.append(cold)
+        if len(pending_scores) >= batch_size or i == len(prns) - 1:
+            feedback.insert_many(pending_feedback, ordered=False)
+            scores.insert_many(pending_scores, ordered=False)
+            pending_scores, pending_feedback = [], []
+    return prns
+
+
+# ---------------- Server and measurements ----------------
+
+def start_server(mongo_uri, port):
+    secrets = tempfile.NamedTemporaryFile("w", suffix=".toml", delete=False)
+    secrets.write(f"MONGO_URI = {json.dumps(mongo_uri)}\n")
+    secrets.close()
+    log = tempfile.NamedTemporaryFile("w", suffix=".log", delete=False)
+    server = subprocess.Popen([
+        sys.executable, "-m", "streamlit", "run", DASHBOARD,
+        "--server.headless", "true", "--server.address", "127.0.0.1", "--server.port", str(port),
+        "--server.enableXsrfProtection", "false", "--server.fileWatcherType", "none",
+        "--browser.gatherUsageStats", "false", "--secrets.files", secrets.name,
+    ], stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            break
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1)
+            return server
+        except OSError:
+            time.sleep(0.5)
+    server.kill()
+    sys.exit(f"Dashboard did not start; see {log.name}")
+
+
+def process_usage(pid):
+    # (CPU seconds, current RSS MB, peak RSS MB) from /proc, or Nones elsewhere
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        memory = {}
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM"):
+                    memory[name] = int(value.split()[0]) / 1024
+        return cpu, memory.get("VmRSS"), memory.get("VmHWM")
+    except (OSError, ValueError, IndexError):
+        return None, None, None
+
+
+class MongoOps:
+    # Server-side operation count (queries, getMores and commands such as aggregate).
+    # Each difference between two readings includes one serverStatus call of ours.
+
+    def __init__(self, client):
+        self.client = client
+
+    def total(self):
+        try:
+            counters = self.client.admin.command("serverStatus")["opcounters"]
+        except pymongo.errors.PyMongoError:
+            return None
+        return counters["query"] + counters["getmore"] + counters["command"]
+
+    def idle_rate(self, seconds=3.0):
+        before = self.total()
+        time.sleep(seconds)
+        after = self.total()
+        return None if before is None else (after - before - 1) / seconds
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+
+
+# ---------------- Browser sessions ----------------
+
+class Session:
+    # One Streamlit session over the websocket protocol the browser uses
+
+    def __init__(self, url):
+        self.url = url
+        self.websocket = None
+        self.page_script_hash = ""
+        self.elements = []
+
+    async def connect(self):
+        import websockets
+
+        self.websocket = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+
+    async def close(self):
+        await self.websocket.close()
+
+    async def rerun(self, widgets=()):
+        # Returns (seconds until the script finished, exception messages shown on the page)
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        message.rerun_script.page_script_hash = self.page_script_hash
+        message.rerun_script.widget_states.widgets.extend(widgets)
+
+        started = time.perf_counter()
+        await self.websocket.send(message.SerializeToString())
+        self.elements, errors = [], []
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await asyncio.wait_for(self.websocket.recv(), RERUN_TIMEOUT))
+            kind = forward.WhichOneof("type")
+            if kind == "new_session":
+                self.page_script_hash = forward.new_session.page_script_hash
+            elif kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                element = forward.delta.new_element
+                self.elements.append(element)
+                if element.WhichOneof("type") == "exception":
+                    errors.append(element.exception.message)
+            elif kind == "script_finished" and forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return time.perf_counter() - started, errors
+
+    def widget_id(self, kind, match):
+        for element in self.elements:
+            if element.WhichOneof("type") == kind:
+                widget = getattr(element, kind)
+                if match(widget):
+                    return widget.id
+        raise LookupError(f"No {kind} on the page")
+
+    async def login(self, prn, password):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        await self.rerun()
+        _, errors = await self.rerun([
+            WidgetState(id=self.widget_id("text_input", lambda w: w.id.endswith("-login_prn")), string_value=prn),
+            WidgetState(id=self.widget_id("text_input", lambda w: w.id.endswith("-login_password")), string_value=password),
+            WidgetState(id=self.widget_id("button", lambda w: w.label == "Login"), trigger_value=True),
+        ])
+        if errors:
+            raise RuntimeError(f"login failed: {errors[0]}")
+
+    async def open_page(self, page):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        # Same as clicking the entry in the sidebar menu
+        menu = self.widget_id("component_instance", lambda w: "option_menu" in w.component_name)
+        elapsed, errors = await self.rerun([WidgetState(id=menu, json_value=json.dumps(PAGES[page]))])
+        if page == "results" and not errors and not self.shows_results():
+            # First visit: the session remembers the search afterwards, as in the browser
+            search = self.widget_id("button", lambda w: w.label == "Search")
+            elapsed, errors = await self.rerun([WidgetState(id=search, trigger_value=True)])
+        return elapsed, errors
+
+    def shows_results(self):
+        return any(element.WhichOneof("type") == "alert" and element.alert.body.startswith("Found")
+                   for element in self.elements)
+
+
+async def logged_in_sessions(url, prns, users):
+    sessions = []
+    for index in range(users):
+        session = Session(url)
+        await session.connect()
+        await session.login(prns[index % len(prns)], SEED_PASSWORD)
+        sessions.append(session)
+    return sessions
+
+
+# ---------------- Scenarios ----------------
+
+async def queries_per_page(url, prn, ops, idle_rate, repeats=3):
+    # One session on its own: first visit (cold caches) and the mean over repeat visits
+    session = Session(url)
+    await session.connect()
+    await session.login(prn, SEED_PASSWORD)
+    report = {}
+    for page in ROUTE:
+        counts = []
+        for _ in range(1 + repeats):
+            before, started = ops.total(), time.perf_counter()
+            await session.open_page(page)
+            if before is not None:
+                counts.append(ops.total() - before - 1 - idle_rate * (time.perf_counter() - started))
+        report[page] = {"cold": counts[0], "warm": sum(counts[1:]) / repeats} if counts else None
+    await session.close()
+    return report
+
+
+async def run_users(url, prns, users, rounds, server_pid, ops, idle_rate):
+    sessions = await logged_in_sessions(url, prns, users)
+    timings = {page: [] for page in ROUTE}
+    errors = []
+
+    async def user(index, session):
+        # Students start on different pages
+        route = ROUTE[index % len(ROUTE):] + ROUTE[:index % len(ROUTE)]
+        for _ in range(rounds):
+            for page in route:
+                try:
+                    elapsed, page_errors = await session.open_page(page)
+                except (LookupError, asyncio.TimeoutError) as e:
+                    errors.append(f"{page}: {e!r}")
+                    continue
+                timings[page].append(elapsed)
+                errors.extend(f"{page}: {error}" for error in page_errors)
+
+    cpu_before, _, _ = process_usage(server_pid)
+    ops_before = ops.total()
+    started = time.perf_counter()
+    await asyncio.gather(*(user(index, session) for index, session in enumerate(sessions)))
+    wall = time.perf_counter() - started
+    cpu_after, rss, peak_rss = process_usage(server_pid)
+    ops_after = ops.total()
+    for session in sessions:
+        await session.close()
+
+    reruns = sum(len(values) for values in timings.values())
+    return {
+        "users": users,
+        "reruns": reruns,
+        "reruns_per_second": reruns / wall if wall else 0.0,
+        "pages": {
+            page: {"p50_ms": percentile(values, 0.5) * 1000, "p99_ms": percentile(values, 0.99) * 1000,
+                   "samples": len(values)}
+            for page, values in timings.items()
+        },
+        "mongo_ops_per_rerun": (ops_after - ops_before - 1 - idle_rate * wall) / reruns if reruns and ops_before is not None else None,
+        "server_cpu_cores": (cpu_after - cpu_before) / wall if cpu_before is not None and wall else None,
+        "server_rss_mb": rss,
+        "server_peak_rss_mb": peak_rss,
+        "errors": errors[:5],
+        "error_count": len(errors),
+    }
+
+
+def fmt(value, spec, unit=""):
+    return "n/a" if value is None else f"{value:{spec}}{unit}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-user load test for the student dashboard")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--seed", action="store_true", help="(re)create LOAD* students and tests first")
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--tests", type=int, default=12)
+    parser.add_argument("--users", default="1,5,10,20", help="comma-separated concurrent user counts")
+    parser.add_argument("--rounds", type=int, default=3, help="page cycles per user")
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--max-p99-ms", type=float, help="fail when any page's p99 exceeds this")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.mongo_uri)
+    if args.seed:
+        started = time.perf_counter()
+        prns = seed(client, args.students, args.tests)
+        print(f"Seeded {len(prns)} students x {args.tests} tests in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    else:
+        prns = sorted(client["student"]["stud_metadata"].distinct("prn", {"prn": {"$regex": f"^{PRN_PREFIX}"}}))
+        if not prns:
+            sys.exit("No seeded students found; run with --seed")
+
+    server = start_server(args.mongo_uri, args.port)
+    url = f"ws://127.0.0.1:{args.port}/_stcore/stream"
+    ops = MongoOps(client)
+    try:
+        idle_rate = ops.idle_rate() or 0.0
+        report = {"queries_per_page": asyncio.run(queries_per_page(url, prns[0], ops, idle_rate)), "runs": []}
+        for users in args.users.split(","):
+            report["runs"].append(asyncio.run(run_users(url, prns, int(users), args.rounds, server.pid, ops, idle_rate)))
+    finally:
+        server.terminate()
+        server.wait()
+
+    # Capacity: the most concurrent users for which every page stayed within the p99 budget
+    failed = False
+    if args.max_p99_ms is not None:
+        within = [run["users"] for run in report["runs"]
+                  if all(page["p99_ms"] <= args.max_p99_ms for page in run["pages"].values()) and not run["error_count"]]
+        report["capacity_users"] = max(within) if within else 0
+        failed = len(within) < len(report["runs"])
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print("MongoDB operations per rerun, one session (first visit / repeat visits):")
+        for page, counts in report["queries_per_page"].items():
+            print(f"  {page:10} " + (f"{counts['cold']:5.1f} / {counts['warm']:.1f}" if counts else "n/a"))
+        for run in report["runs"]:
+            print(f"\n{run['users']} users: {run['reruns_per_second']:.1f} reruns/s, "
+                  f"{fmt(run['mongo_ops_per_rerun'], '.1f')} Mongo ops/rerun, "
+                  f"server {fmt(run['server_cpu_cores'], '.2f')} CPU cores, "
+                  f"RSS {fmt(run['server_rss_mb'], '.0f', ' MB')} (peak {fmt(run['server_peak_rss_mb'], '.0f', ' MB')})"
+                  + (f", {run['error_count']} errors" if run["error_count"] else ""))
+            for page, stats in run["pages"].items():
+                print(f"  {page:10} p50 {stats['p50_ms']:7.0f} ms   p99 {stats['p99_ms']:7.0f} ms   ({stats['samples']} reruns)")
+            for error in run["errors"]:
+                print(f"  error: {error}")
+        if "capacity_users" in report:
+            print(f"\nCapacity at p99 <= {args.max_p99_ms:.0f} ms: {report['capacity_users']} concurrent users")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import base64
+import io
+import os
+
+from pipeline_metrics import call_with_retries
+from scheduler import OCR, LOCAL_OCR
+
+
+# OCR engines behind one interface: recognise(image_b64, metrics) -> {"text", "confidence", "backend"}.
+# `image_b64` is a base64 PNG as produced by GradingPipeline.pdf_to_base64_pymupdf. `confidence`
+# is 0-1 for engines that report one and None otherwise. `resource` names the scheduler budget
+# the backend's calls are queued on (see scheduler.py).
+
+OCR_MODEL = "pixtral-12b-2409"
+OCR_INSTRUCTION = "Extract all the handwritten text from this image, preserving formatting and layout."
+
+PIXTRAL = "pixtral"
+TESSERACT = "tesseract"
+TESSERACT_WITH_FALLBACK = "tesseract+pixtral"
+OCR_BACKENDS = [PIXTRAL, TESSERACT, TESSERACT_WITH_FALLBACK]
+DEFAULT_OCR_BACKEND = PIXTRAL
+
+# Local pages whose mean word confidence falls below this are sent to the remote backend
+MIN_LOCAL_CONFIDENCE = 0.6
+
+
+class PixtralBackend:
+    name = PIXTRAL
+    resource = OCR
+
+    def __init__(self, client, model=OCR_MODEL):
+        self.client = client
+        self.model = model
+
+    def recognise(self, image_b64, metrics):
+        metrics.incr("ocr_payload_bytes", len(image_b64))
+        extract_messages = [{"role": "user", "content": [
+            {"type": "text", "text": OCR_INSTRUCTION},
+            {"type": "image_url", "image_url": f"data:image/png;base64,{image_b64}"}
+        ]}]
+        chat_response = call_with_retries(
+            lambda: self.client.chat.complete(model=self.model, messages=extract_messages),
+            metrics,
+        )
+        metrics.record_usage(self.model, chat_response)
+        metrics.incr("ocr_remote_pages")
+        return {"text": chat_response.choices[0].message.content.strip(), "confidence": None, "backend": self.name}
+
+
+class TesseractBackend:
+    # Local CPU OCR through pytesseract (needs the tesseract binary on PATH). Tesseract is tuned
+    # for print, so neat block handwriting works best; pair it with a fallback for the rest.
+    name = TESSERACT
+    resource = LOCAL_OCR
+
+    def __init__(self, lang="eng", config="--psm 6"):
+        try:
+            import pytesseract
+            from PIL import Image
+        except ImportError as e:
+            raise RuntimeError("The tesseract OCR backend needs `pip install pytesseract pillow` "
+                               "and the tesseract binary") from e
+        # pytesseract imports fine without the binary; probe it here so callers fall back now
+        # instead of every page failing later
+        try:
+            pytesseract.get_tesseract_version()
+        except (OSError, pytesseract.TesseractNotFoundError) as e:
+            raise RuntimeError("The tesseract binary was not found on PATH") from e
+        self._tesseract = pytesseract
+        self._image = Image
+        self.lang = lang
+        self.config = config
+
+    def recognise(self, image_b64, metrics):
+        image = self._image.open(io.BytesIO(base64.b64decode(image_b64)))
+        data = self._tesseract.image_to_data(
+            image, lang=self.lang, config=self.config, output_type=self._tesseract.Output.DICT
+        )
+
+        # Rebuild lines from Tesseract's word boxes; confidence is the mean over recognised words
+        lines, confidences = {}, []
+        for word, conf, block, paragraph, line in zip(
+            data["text"], data["conf"], data["block_num"], data["par_num"], data["line_num"]
+        ):
+            if not word.strip() or float(conf) < 0:
+                continue
+            lines.setdefault((block, paragraph, line), []).append(word)
+            confidences.append(float(conf) / 100)
+
+        metrics.incr("ocr_local_pages")
+        return {
+            "text": "\n".join(" ".join(words) for words in lines.values()),
+            "confidence": sum(confidences) / len(confidences) if confidences else 0.0,
+            "backend": self.name,
+        }
+
+
+class FallbackBackend:
+    # Tries the local engine first and only pays for the remote one when the page reads poorly.
+    # Queued on the remote budget, since any page may end up there.
+    resource = OCR
+
+    def __init__(self, primary, fallback, min_confidence=MIN_LOCAL_CONFIDENCE):
+        self.primary = primary
+        self.fallback = fallback
+        self.min_confidence = min_confidence
+        self.name = f"{primary.name}+{fallback.name}"
+
+    def recognise(self, image_b64, metrics):
+        result = self.primary.recognise(image_b64, metrics)
+        if result["confidence"] is not None and result["confidence"] >= self.min_confidence and result["text"].strip():
+            return result
+        metrics.incr("ocr_fallbacks")
+        return self.fallback.recognise(image_b64, metrics)
+
+
+def build_ocr_backend(name, image_client=None, min_confidence=MIN_LOCAL_CONFIDENCE):
+    if name == TESSERACT:
+        return TesseractBackend()
+    if name == TESSERACT_WITH_FALLBACK:
+        return FallbackBackend(TesseractBackend(), PixtralBackend(image_client), min_confidence)
+    return PixtralBackend(image_client)
+
+
+if __name__ == "__main__":
+    # Offline benchmark: python ocr_backends.py answers.pdf [tesseract]
+    import sys
+    import time
+
+    from pipeline_metrics import EvaluationMetrics
+    from grading_pipeline import GradingPipeline
+
+    pdf_path = sys.argv[1]
+    backend_name = sys.argv[2] if len(sys.argv) > 2 else TESSERACT
+    image_client = None
+    if backend_name != TESSERACT:
+        from mistralai import Mistral
+        image_client = Mistral(api_key=os.environ["MISTRAL_API_KEY_IMAGE"])
+    backend = build_ocr_backend(backend_name, image_client)
+
+    metrics = EvaluationMetrics("benchmark", None)
+    pipeline = GradingPipeline(None, None, {"student_scores": None, "student_scores_history": None, "submission_hashes": None, "student_feedback": None}, None)
+    with open(pdf_path, "rb") as f:
+        pages = pipeline.pdf_to_base64_pymupdf(f.read(), metrics)
+
+    for idx, page in enumerate(pages):
+        if page["status"] != "ok":
+            print(f"page {idx+1}: {page['status']}")
+            continue
+        for tile, image in enumerate(page["tiles"]):
+            start = time.perf_counter()
+            result = backend.recognise(image, metrics)
+            confidence = f"{result['confidence']:.2f}" if result["confidence"] is not None else "-"
+            print(f"page {idx+1} tile {tile+1}: {time.perf_counter() - start:.2f}s via {result['backend']}, "
+                  f"confidence {confidence}, {len(result['text'])} chars")
+    print({name: value for name, value in metrics.counters.items() if value})
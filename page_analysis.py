@@ -0,0 +1,116 @@
+import math
+from collections import Counter
+
+import fitz  # PyMuPDF
+import numpy as np
+
+
+# Defaults for the blank-page pre-filter; override through st.secrets
+BLANK_PAGE_SCALE = 0.25          # Render at 1/4 resolution, plenty for ink statistics
+BLANK_PAGE_MARGIN = 0.05         # Ignore scanner shadows along the page edges
+INK_LEVEL = 160                  # Grayscale values below this count as ink
+MIN_INK_DENSITY = 0.004          # Fraction of ink pixels a written page must exceed
+MIN_INK_STDDEV = 8.0             # Pixel standard deviation a written page must exceed
+DHASH_SIZE = 16                  # 16x16 difference hash -> 256-bit fingerprint per page
+DHASH_MARGIN = 2.0               # Brightness drop (grey levels) a hash bit needs; blank paper stays 0
+MAX_HASH_DISTANCE = 3            # Hamming distance at which two pages can count as the same scan
+MAX_INK_DIFFERENCE = 0.01        # ...and the relative difference their mean ink may show
+
+
+def grayscale_thumbnail(page, scale=BLANK_PAGE_SCALE, margin=BLANK_PAGE_MARGIN):
+    rect = page.rect
+    clip = fitz.Rect(
+        rect.x0 + rect.width * margin,
+        rect.y0 + rect.height * margin,
+        rect.x1 - rect.width * margin,
+        rect.y1 - rect.height * margin,
+    )
+    return page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY, clip=clip, alpha=False)
+
+
+def ink_stats(pixmap, ink_level=INK_LEVEL):
+    # A 256-bucket histogram keeps this linear in C and avoids per-pixel Python arithmetic
+    histogram = Counter(pixmap.samples)
+    total = sum(histogram.values())
+    if not total:
+        return {"ink_density": 0.0, "ink_mean": 0.0, "stddev": 0.0}
+
+    ink = sum(count for value, count in histogram.items() if value < ink_level)
+    mean = sum(value * count for value, count in histogram.items()) / total
+    variance = sum(count * (value - mean) ** 2 for value, count in histogram.items()) / total
+    # ink_mean is the ink density without the INK_LEVEL cut (mean darkness, 0-1). Scanner noise
+    # moves faint strokes across the cut, so only this one is stable enough to compare two scans.
+    return {"ink_density": ink / total, "ink_mean": (255 - mean) / 255, "stddev": math.sqrt(variance)}
+
+
+def _block_means(pixmap, cols, rows):
+    # Box-filter the thumbnail down to a cols x rows grid of mean brightness
+    width, height = pixmap.width, pixmap.height
+    gray = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(height, pixmap.stride)[:, :width]
+    # Cell c spans the pixels x with x * cols // width == c (likewise for rows)
+    x_starts = -(-np.arange(cols) * width // cols)
+    y_starts = -(-np.arange(rows) * height // rows)
+    sums = np.add.reduceat(np.add.reduceat(gray.astype(np.int64), y_starts, axis=0), x_starts, axis=1)
+    counts = np.outer(np.diff(np.append(y_starts, height)), np.diff(np.append(x_starts, width)))
+    return sums / counts
+
+
+def dhash(pixmap, size=DHASH_SIZE, margin=DHASH_MARGIN):
+    # Difference hash: one bit per horizontally adjacent pair, set when brightness drops by more
+    # than `margin`, so scanner noise on evenly lit paper cannot flip bits
+    grid = _block_means(pixmap, size + 1, size)
+    return np.packbits(grid[:, :-1] > grid[:, 1:] + margin).tobytes().hex()
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+
+def analyse_page(page, min_density=MIN_INK_DENSITY, min_stddev=MIN_INK_STDDEV):
+    # One thumbnail render feeds both the blank check and the perceptual hash
+    thumbnail = grayscale_thumbnail(page)
+    stats = ink_stats(thumbnail)
+    stats["blank"] = stats["ink_density"] < min_density or stats["stddev"] < min_stddev
+    stats["dhash"] = dhash(thumbnail)
+    return stats
+
+
+def is_blank_page(page, min_density=MIN_INK_DENSITY, min_stddev=MIN_INK_STDDEV):
+    stats = analyse_page(page, min_density, min_stddev)
+    return stats["blank"], stats
+
+
+def page_fingerprint(stats):
+    # What duplicate detection compares, and what submission records store per page
+    return {"dhash": stats["dhash"], "ink_mean": stats["ink_mean"]}
+
+
+def same_page(page_a, page_b, max_distance=MAX_HASH_DISTANCE, max_ink_difference=MAX_INK_DIFFERENCE):
+    # A re-scan of a page hashes within a few bits of the original, but so can a sparse page on
+    # the same booklet template with a line or two of different text. Those differ in how much
+    # ink they carry, so a duplicate needs both a close hash and matching mean ink.
+    # Records from before page fingerprints (bare hash strings) never match.
+    if not isinstance(page_a, dict) or not isinstance(page_b, dict):
+        return False
+    if page_a.get("ink_mean") is None or page_b.get("ink_mean") is None:
+        return False
+    if len(page_a["dhash"]) != len(page_b["dhash"]):
+        return False
+    if hamming_distance(page_a["dhash"], page_b["dhash"]) > max_distance:
+        return False
+    a, b = page_a["ink_mean"], page_b["ink_mean"]
+    return abs(a - b) <= max_ink_difference * max(a, b)
+
+
+def find_duplicate(page, seen_pages, max_distance=MAX_HASH_DISTANCE):
+    # Index of the first earlier page that is the same scan, or None
+    for idx, seen in seen_pages:
+        if same_page(page, seen, max_distance):
+            return idx
+    return None
+
+
+def same_submission(pages_a, pages_b, max_distance=MAX_HASH_DISTANCE):
+    if not pages_a or len(pages_a) != len(pages_b):
+        return False
+    return all(same_page(a, b, max_distance) for a, b in zip(pages_a, pages_b))
@@ -0,0 +1,87 @@
+import fitz  # PyMuPDF
+import numpy as np
+
+from page_analysis import INK_LEVEL
+
+
+# Cuts a written page into a few horizontal tiles along whitespace, so each OCR request covers
+# a bounded region and one failure loses a region instead of the page. Tiles start where the
+# left margin carries a mark (usually a question number), so they line up with question anchors.
+# Reading order is top to bottom; answer sheets are single-column.
+
+LAYOUT_SCALE = 0.5               # Half resolution is enough to find lines and gaps
+RULED_LINE_INK = 0.5             # Rows darker than this are ruled lines or scanner edges, not text
+MIN_ROW_INK = 0.004              # Fraction of ink pixels for a row to count as written
+MIN_GAP = 0.012                  # Whitespace band (fraction of page height) that separates blocks
+MARGIN_WIDTH = 0.12              # Left strip where question numbers are written
+MIN_MARGIN_INK = 0.02            # Ink in that strip, on a block's first line, that marks a new question
+LINE_HEIGHT = 0.03               # Rough height of one handwritten line
+MIN_TILE_HEIGHT = 0.08           # Smaller tiles are merged into their neighbour
+MAX_TILE_HEIGHT = 0.45           # Blocks are grouped into a tile up to this height
+MAX_TILES = 4                    # Per page; keeps the request count per sheet bounded
+TILE_PADDING = 0.01              # Context kept above and below each tile
+
+
+def ink_mask(page, scale=LAYOUT_SCALE, ink_level=INK_LEVEL):
+    pixmap = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY, alpha=False)
+    gray = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.stride)[:, :pixmap.width]
+    return gray < ink_level
+
+
+def text_bands(mask, min_gap=MIN_GAP, min_row_ink=MIN_ROW_INK, ruled_line_ink=RULED_LINE_INK):
+    # Horizontal projection profile -> [(first_row, end_row)] of written blocks
+    profile = mask.mean(axis=1)
+    written = (profile > min_row_ink) & (profile < ruled_line_ink)
+    rows = np.flatnonzero(written)
+    if not len(rows):
+        return []
+
+    gap_rows = max(1, int(min_gap * mask.shape[0]))
+    breaks = np.flatnonzero(np.diff(rows) > gap_rows)
+    starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    ends = np.concatenate((rows[breaks], [rows[-1]])) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def starts_question(mask, band, margin_width=MARGIN_WIDTH, min_margin_ink=MIN_MARGIN_INK, line_height=LINE_HEIGHT):
+    # Vertical profile of the left margin on the block's first line
+    start, end = band
+    first_line = mask[start:min(end, start + max(1, int(line_height * mask.shape[0]))), :max(1, int(margin_width * mask.shape[1]))]
+    return first_line.mean() > min_margin_ink
+
+
+def group_bands(mask, bands, min_tile=MIN_TILE_HEIGHT, max_tile=MAX_TILE_HEIGHT, max_tiles=MAX_TILES):
+    height = mask.shape[0]
+    groups = []
+    for band in bands:
+        if groups:
+            group_start, group_end = groups[-1]
+            too_small = group_end - group_start < min_tile * height
+            fits = band[1] - group_start <= max_tile * height
+            if too_small or (fits and not starts_question(mask, band)):
+                groups[-1] = (group_start, band[1])
+                continue
+        groups.append(band)
+
+    # Too many tiles: merge the adjacent pair with the smallest combined height
+    while len(groups) > max_tiles:
+        i = min(range(len(groups) - 1), key=lambda j: groups[j + 1][1] - groups[j][0])
+        groups[i:i + 2] = [(groups[i][0], groups[i + 1][1])]
+    return groups
+
+
+def layout_tiles(page, scale=LAYOUT_SCALE, max_tiles=MAX_TILES):
+    # Page-space rectangles, top to bottom; the whole page when no structure is found
+    mask = ink_mask(page, scale)
+    groups = group_bands(mask, text_bands(mask), max_tiles=max_tiles)
+    if len(groups) <= 1:
+        return [page.rect]
+
+    rect = page.rect
+    row_height = rect.height / mask.shape[0]
+    padding = TILE_PADDING * rect.height
+    return [
+        fitz.Rect(rect.x0, max(rect.y0, rect.y0 + start * row_height - padding),
+                  rect.x1, min(rect.y1, rect.y0 + end * row_height + padding))
+        for start, end in groups
+    ]
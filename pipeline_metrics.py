@@ -0,0 +1,458 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# Approximate list prices in USD per million tokens, used to estimate spend per evaluation
+MODEL_PRICING = {
+    "pixtral-12b-2409": {"prompt": 0.15, "completion": 0.15},
+    "mistral-large-latest": {"prompt": 2.0, "completion": 6.0},
+    "mistral-small-latest": {"prompt": 0.1, "completion": 0.3},
+}
+
+# Counters every evaluation reports, even when they stay at zero
+DEFAULT_COUNTERS = [
+    "pages",
+    "blank_pages_skipped",
+    "duplicate_pages_skipped",
+    "ocr_payload_bytes",
+    "grading_payload_bytes",
+    "api_calls",
+    "retries",
+    "errors",
+    "cache_hits",
+    "cache_misses",
+    "routed_cache",
+    "routed_local",
+    "routed_small",
+    "routed_large",
+    "routed_cache_ms",
+    "routed_local_ms",
+    "routed_small_ms",
+    "routed_large_ms",
+    "queued_tasks",
+    "queue_wait_ms",
+    "batch_fallbacks",
+    "resegmented",
+    "ocr_local_pages",
+    "ocr_remote_pages",
+    "ocr_fallbacks",
+    "tiles",
+]
+
+
+class EvaluationMetrics:
+    # Collects wall time per stage, counters and token usage for a single answer sheet.
+    # Thread-safe, since OCR and grading calls for one sheet run concurrently.
+
+    def __init__(self, test_id, prn, teacher=None):
+        self._lock = threading.Lock()
+        self.test_id = test_id
+        self.prn = prn
+        self.teacher = teacher
+        self.started_at = datetime.now()
+        self.stages = {}
+        self.counters = {name: 0 for name in DEFAULT_COUNTERS}
+        self.tokens = {}
+        self.labels = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_stage_time(name, time.perf_counter() - start)
+
+    def add_stage_time(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_usage(self, model, response):
+        # Mistral responses carry prompt/completion token counts in `usage`
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        with self._lock:
+            model_tokens = self.tokens.setdefault(model, {"prompt": 0, "completion": 0})
+            model_tokens["prompt"] += getattr(usage, "prompt_tokens", 0) or 0
+            model_tokens["completion"] += getattr(usage, "completion_tokens", 0) or 0
+
+    def absorb(self, other, share=1.0):
+        # Add a fraction of another collector's counters and tokens, e.g. one student's share
+        # of a request that graded several students at once
+        with self._lock:
+            for name, value in other.counters.items():
+                if value:
+                    self.counters[name] = self.counters.get(name, 0) + value * share
+            for model, usage in other.tokens.items():
+                model_tokens = self.tokens.setdefault(model, {"prompt": 0, "completion": 0})
+                model_tokens["prompt"] += usage["prompt"] * share
+                model_tokens["completion"] += usage["completion"] * share
+
+    def estimated_cost(self):
+        cost = 0.0
+        for model, usage in self.tokens.items():
+            pricing = MODEL_PRICING.get(model)
+            if not pricing:
+                continue
+            cost += usage["prompt"] * pricing["prompt"] / 1_000_000
+            cost += usage["completion"] * pricing["completion"] / 1_000_000
+        return cost
+
+    def to_document(self):
+        return {
+            "test_id": self.test_id,
+            "prn": self.prn,
+            "teacher": self.teacher,
+            "timestamp": self.started_at,
+            "total_seconds": round(sum(self.stages.values()), 4),
+            "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+            # Model names contain dots, which MongoDB does not allow in field names
+            "tokens": [
+                {"model": model, "prompt": usage["prompt"], "completion": usage["completion"]}
+                for model, usage in self.tokens.items()
+            ],
+            "estimated_cost_usd": round(self.estimated_cost(), 6),
+            "labels": dict(self.labels),
+        }
+
+
+# HTTP statuses worth another attempt besides 5xx: request timeout and rate limit
+RETRY_STATUS_CODES = (408, 429)
+# httpx base class for timeouts and connection/network failures, matched by name so this module
+# does not depend on which httpx build the Mistral SDK ships with
+TRANSPORT_ERRORS = ("TransportError",)
+
+
+def is_transient(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # Mistral SDK errors carry the response status
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in RETRY_STATUS_CODES or status >= 500
+    return any(cls.__name__ in TRANSPORT_ERRORS for cls in type(error).__mro__)
+
+
+def call_with_retries(fn, metrics=None, attempts=3, backoff=1.0):
+    # Retry transient API failures (rate limits, timeouts, 5xx) with exponential backoff.
+    # Anything else (auth, bad request, bugs) is raised on the first attempt.
+    for attempt in range(attempts):
+        try:
+            if metrics is not None:
+                metrics.incr("api_calls")
+            return fn()
+        except Exception as e:
+            if attempt == attempts - 1 or not is_transient(e):
+                if metrics is not None:
+                    metrics.incr("errors")
+                raise
+            if metrics is not None:
+                metrics.incr("retries")
+            time.sleep(backoff * (2 ** attempt))
+
+
+def save_metrics(metrics_collection, metrics):
+    document = metrics.to_document()
+    metrics_collection.insert_one(document)
+    return document
+
+
+# ---------------- Dashboard aggregations ----------------
+
+def _window_match(since=None, teacher=None):
+    match = {}
+    if since is not None:
+        match["timestamp"] = {"$gte": since}
+    if teacher:
+        match["teacher"] = teacher
+    return match
+
+
+def sheets_per_hour(metrics_collection, since=None, teacher=None):
+    pipeline = [
+        {"$match": _window_match(since, teacher)},
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}},
+            "sheets": {"$sum": 1},
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "hour": "$_id", "sheets": 1}},
+    ]
+    return list(metrics_collection.aggregate(pipeline))
+
+
+def latency_percentiles(metrics_collection, since=None, teacher=None, percentiles=(0.5, 0.9, 0.99)):
+    # $percentile needs MongoDB 7.0+; the approximate method is computed in a single pass
+    fields = {"ocr": "$stages.ocr", "grading": "$stages.grading", "total": "$total_seconds"}
+    group = {"_id": None}
+    for name, path in fields.items():
+        group[name] = {"$percentile": {"input": path, "p": list(percentiles), "method": "approximate"}}
+    pipeline = [{"$match": _window_match(since, teacher)}, {"$group": group}]
+    row = next(metrics_collection.aggregate(pipeline), None)
+    if not row:
+        return []
+    return [
+        {"stage": name, **{f"p{int(p * 100)}": row[name][i] for i, p in enumerate(percentiles)}}
+        for name in fields
+        if row.get(name) and row[name][0] is not None
+    ]
+
+
+def per_sheet_summary(metrics_collection, since=None, teacher=None):
+    pipeline = [
+        {"$match": _window_match(since, teacher)},
+        {"$project": {
+            "counters": 1,
+            "total_seconds": 1,
+            "estimated_cost_usd": 1,
+            "tokens": {"$sum": {"$map": {
+                "input": {"$ifNull": ["$tokens", []]},
+                "as": "t",
+                "in": {"$add": ["$$t.prompt", "$$t.completion"]},
+            }}},
+        }},
+        {"$group": {
+            "_id": None,
+            "sheets": {"$sum": 1},
+            "pages": {"$sum": "$counters.pages"},
+            "blank_pages_skipped": {"$sum": "$counters.blank_pages_skipped"},
+            "duplicate_pages_skipped": {"$sum": "$counters.duplicate_pages_skipped"},
+            "api_calls": {"$sum": "$counters.api_calls"},
+            "retries": {"$sum": "$counters.retries"},
+            "errors": {"$sum": "$counters.errors"},
+            "cache_hits": {"$sum": "$counters.cache_hits"},
+            "cache_misses": {"$sum": "$counters.cache_misses"},
+            "tokens": {"$sum": "$tokens"},
+            "cost": {"$sum": "$estimated_cost_usd"},
+            "avg_seconds": {"$avg": "$total_seconds"},
+            "routed_cache": {"$sum": "$counters.routed_cache"},
+            "routed_local": {"$sum": "$counters.routed_local"},
+            "routed_small": {"$sum": "$counters.routed_small"},
+            "routed_large": {"$sum": "$counters.routed_large"},
+            "queue_wait_ms": {"$sum": "$counters.queue_wait_ms"},
+            "ocr_local_pages": {"$sum": "$counters.ocr_local_pages"},
+            "ocr_fallbacks": {"$sum": "$counters.ocr_fallbacks"},
+        }},
+    ]
+    row = next(metrics_collection.aggregate(pipeline), None)
+    if not row:
+        return None
+
+    sheets = row["sheets"] or 1
+    api_calls = row["api_calls"] or 0
+    cache_lookups = row["cache_hits"] + row["cache_misses"]
+    return {
+        "sheets": row["sheets"],
+        "pages_per_sheet": row["pages"] / sheets,
+        "ocr_skipped_per_sheet": (row["blank_pages_skipped"] + row["duplicate_pages_skipped"]) / sheets,
+        "api_calls_per_sheet": api_calls / sheets,
+        "tokens_per_sheet": row["tokens"] / sheets,
+        "cost_per_sheet": row["cost"] / sheets,
+        "avg_seconds": row["avg_seconds"] or 0.0,
+        "cache_hit_rate": row["cache_hits"] / cache_lookups if cache_lookups else 0.0,
+        "retry_rate": row["retries"] / api_calls if api_calls else 0.0,
+        "error_rate": row["errors"] / api_calls if api_calls else 0.0,
+        "routing": {route: row[f"routed_{route}"] for route in ("cache", "local", "small", "large")},
+        "queue_wait_per_sheet": (row["queue_wait_ms"] or 0) / 1000 / sheets,
+        "ocr_local_per_sheet": (row["ocr_local_pages"] - row["ocr_fallbacks"]) / sheets,
+    }
+
+
+def prompt_template_report(metrics_collection, since=None, teacher=None, model="mistral-large-latest"):
+    # Compare grading input tokens and latency per sheet across prompt template versions
+    pipeline = [
+        {"$match": {**_window_match(since, teacher), "labels.prompt_version": {"$exists": True}}},
+        {"$project": {
+            "version": "$labels.prompt_version",
+            "grading_seconds": "$stages.grading",
+            "grading_tokens": {"$filter": {"input": "$tokens", "as": "t", "cond": {"$eq": ["$$t.model", model]}}},
+        }},
+        {"$unwind": "$grading_tokens"},
+        {"$group": {
+            "_id": "$version",
+            "sheets": {"$sum": 1},
+            "prompt_tokens_per_sheet": {"$avg": "$grading_tokens.prompt"},
+            "completion_tokens_per_sheet": {"$avg": "$grading_tokens.completion"},
+            "grading_seconds_per_sheet": {"$avg": "$grading_seconds"},
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {
+            "_id": 0, "version": "$_id", "sheets": 1, "prompt_tokens_per_sheet": 1,
+            "completion_tokens_per_sheet": 1, "grading_seconds_per_sheet": 1,
+        }},
+    ]
+    return list(metrics_collection.aggregate(pipeline))
+
+
+def grading_mode_report(metrics_collection, since=None, teacher=None):
+    # Per-sheet grading against question-major batch grading: requests, tokens, cost and time per sheet.
+    # OCR is identical in both modes, so the differences come from grading.
+    pipeline = [
+        {"$match": _window_match(since, teacher)},
+        {"$project": {
+            "mode": {"$ifNull": ["$labels.grading_mode", "sheet"]},
+            "api_calls": "$counters.api_calls",
+            "grading_seconds": "$stages.grading",
+            "estimated_cost_usd": 1,
+            "prompt_tokens": {"$sum": "$tokens.prompt"},
+            "completion_tokens": {"$sum": "$tokens.completion"},
+        }},
+        {"$group": {
+            "_id": "$mode",
+            "sheets": {"$sum": 1},
+            "api_calls_per_sheet": {"$avg": "$api_calls"},
+            "prompt_tokens_per_sheet": {"$avg": "$prompt_tokens"},
+            "completion_tokens_per_sheet": {"$avg": "$completion_tokens"},
+            "cost_per_sheet": {"$avg": "$estimated_cost_usd"},
+            "grading_seconds_per_sheet": {"$avg": "$grading_seconds"},
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {
+            "_id": 0, "mode": "$_id", "sheets": 1, "api_calls_per_sheet": 1, "prompt_tokens_per_sheet": 1,
+            "completion_tokens_per_sheet": 1, "cost_per_sheet": 1, "grading_seconds_per_sheet": 1,
+        }},
+    ]
+    return list(metrics_collection.aggregate(pipeline))
+
+
+# ---------------- OpenMetrics export ----------------
+
+def collect_totals(metrics_collection, match=None):
+    # Sum every stored evaluation server-side so the export never loads raw documents
+    pipeline = [{"$match": match or {}}]
+    pipeline.append({
+        "$facet": {
+            "evaluations": [{"$count": "count"}],
+            "stages": [
+                {"$project": {"stages": {"$objectToArray": "$stages"}}},
+                {"$unwind": "$stages"},
+                {"$group": {"_id": "$stages.k", "seconds": {"$sum": "$stages.v"}}},
+            ],
+            "counters": [
+                {"$project": {"counters": {"$objectToArray": "$counters"}}},
+                {"$unwind": "$counters"},
+                {"$group": {"_id": "$counters.k", "value": {"$sum": "$counters.v"}}},
+            ],
+            "tokens": [
+                {"$unwind": "$tokens"},
+                {"$group": {
+                    "_id": "$tokens.model",
+                    "prompt": {"$sum": "$tokens.prompt"},
+                    "completion": {"$sum": "$tokens.completion"},
+                }},
+            ],
+            "cost": [{"$group": {"_id": None, "usd": {"$sum": "$estimated_cost_usd"}}}],
+        }
+    })
+    facets = next(metrics_collection.aggregate(pipeline), {})
+
+    evaluations = facets.get("evaluations") or [{"count": 0}]
+    cost = facets.get("cost") or [{"usd": 0.0}]
+    return {
+        "evaluations": evaluations[0]["count"],
+        "stages": {row["_id"]: row["seconds"] for row in facets.get("stages", [])},
+        "counters": {row["_id"]: row["value"] for row in facets.get("counters", [])},
+        "tokens": {
+            row["_id"]: {"prompt": row["prompt"], "completion": row["completion"]}
+            for row in facets.get("tokens", [])
+        },
+        "estimated_cost_usd": cost[0]["usd"],
+    }
+
+
+
+def estimate_routing_savings(totals, large_model="mistral-large-latest"):
+    # Spend avoided by not sending cached, locally finalised and small-model answers to the
+    # large model, priced at the observed average large-model call, minus what the small model cost
+    counters = totals["counters"]
+    large_calls = counters.get("routed_large", 0)
+    large_usage = totals["tokens"].get(large_model)
+    if not large_calls or not large_usage:
+        return 0.0
+
+    def spend(model, usage):
+        pricing = MODEL_PRICING.get(model, {"prompt": 0, "completion": 0})
+        return (usage["prompt"] * pricing["prompt"] + usage["completion"] * pricing["completion"]) / 1_000_000
+
+    cost_per_large_call = spend(large_model, large_usage) / large_calls
+    avoided = counters.get("routed_cache", 0) + counters.get("routed_local", 0) + counters.get("routed_small", 0)
+    other_spend = sum(
+        spend(model, usage) for model, usage in totals["tokens"].items()
+        if model != large_model and model != "pixtral-12b-2409"
+    )
+    return avoided * cost_per_large_call - other_spend
+
+
+def route_latencies(totals):
+    # Average grading time per answer on each route, in seconds
+    counters = totals["counters"]
+    return {
+        route: counters.get(f"routed_{route}_ms", 0) / 1000 / counters[f"routed_{route}"]
+        for route in ("cache", "local", "small", "large")
+        if counters.get(f"routed_{route}")
+    }
+
+
+def estimate_latency_savings(totals):
+    # Grading time avoided by not sending cached, locally finalised and small-model answers to the
+    # large model: each is charged the observed average large-model call minus its own route's time
+    latencies = route_latencies(totals)
+    if "large" not in latencies:
+        return 0.0
+    counters = totals["counters"]
+    return sum(
+        counters[f"routed_{route}"] * (latencies["large"] - latencies[route])
+        for route in ("cache", "local", "small")
+        if route in latencies
+    )
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_openmetrics(totals, prefix="grading"):
+    lines = []
+
+    def family(name, metric_type, help_text, samples):
+        lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        suffix = "_total" if metric_type == "counter" else ""
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+            label_text = "{" + label_text + "}" if label_text else ""
+            lines.append(f"{prefix}_{name}{suffix}{label_text} {value}")
+
+    family("evaluations", "counter", "Answer sheets evaluated.",
+           [({}, totals["evaluations"])])
+    family("stage_seconds", "counter", "Wall time spent in each pipeline stage.",
+           [({"stage": stage}, round(seconds, 4)) for stage, seconds in sorted(totals["stages"].items())])
+    family("events", "counter", "Pipeline counters such as pages, API calls, retries and cache hits.",
+           [({"name": name}, value) for name, value in sorted(totals["counters"].items())])
+    family("tokens", "counter", "Tokens reported by the Mistral usage fields.",
+           [({"model": model, "kind": kind}, usage[kind])
+            for model, usage in sorted(totals["tokens"].items())
+            for kind in ("prompt", "completion")])
+    family("estimated_cost_usd", "counter", "Estimated API spend in USD.",
+           [({}, round(totals["estimated_cost_usd"], 6))])
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    # Print the OpenMetrics exposition for all stored evaluations, e.g. for a textfile collector
+    import os
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    mongo_client = MongoClient(os.environ["MONGO_URI"])
+    print(render_openmetrics(collect_totals(mongo_client["student"]["pipeline_metrics"])), end="")
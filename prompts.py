@@ -0,0 +1,133 @@
+import re
+
+
+def normalise_whitespace(text):
+    # Strip indentation and trailing spaces, collapse runs of spaces, drop blank lines
+    lines = (re.sub(r"[ \t]+", " ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def estimate_tokens(text):
+    # Mistral's tokenizer averages roughly four characters per token on English prose;
+    # good enough to compare templates without shipping the tokenizer
+    return max(1, round(len(text) / 4)) if text else 0
+
+
+class PromptTemplate:
+    # A versioned grading prompt. `prefix` holds the static instructions and is identical
+    # for every call; `payload` carries the per-question content and always comes last.
+
+    def __init__(self, version, prefix, payload, suffix="", split_messages=True):
+        self.version = version
+        self.prefix = prefix
+        self.payload = payload
+        self.suffix = suffix
+        self.split_messages = split_messages
+
+    def render(self, **fields):
+        payload = self.payload.format(**fields)
+        if self.split_messages:
+            return [
+                {"role": "system", "content": self.prefix},
+                {"role": "user", "content": payload},
+            ]
+        return [{"role": "user", "content": self.prefix + payload + self.suffix}]
+
+    def static_tokens(self):
+        return estimate_tokens(self.prefix) + estimate_tokens(self.suffix)
+
+
+def message_text(messages):
+    return "".join(message["content"] for message in messages)
+
+
+# ---------------- Grading templates ----------------
+
+_INSTRUCTIONS = """
+    As an expert educational assessor, evaluate the following student answer based on content accuracy, keyword usage, and clarity.
+    Be EXTREMELY lenient and generous while giving marks to encourage student learning.
+    Use a minimum score of 3 and maximum of 5, even for minimal or partially correct answers.
+    If the student has made any attempt at all, the minimum score should be 3.
+    If the answer has some relevance to the topic, give at least 4 marks.
+    Only give less than 3 marks if the answer is completely blank or entirely unrelated.
+    Give same marking for same answer content everytime.
+"""
+
+_CRITERIA = """
+    Evaluation Criteria:
+    - Content Accuracy: Assess factual correctness and relevance with extreme leniency.
+    - Keyword Usage: Consider even minimal keyword matches positively.
+    - Clarity & Completeness: Reward any attempt at structure and coherence.
+
+    STRICT RESPONSE FORMAT (NO MARKING SYSTEM DISCLOSURE):
+    Score: [numeric score from 3-5 unless completely blank]
+    Feedback: [Short, 4-5 lines of encouraging feedback highlighting strengths first, then gentle suggestions]
+"""
+
+_INDENT = " " * 28
+
+GRADING_TEMPLATES = {
+    # v1: the original single-message prompt, indentation and all, kept for comparison
+    "v1": PromptTemplate(
+        "v1",
+        prefix="\n" + "\n".join(_INDENT + line.strip() + "  " for line in _INSTRUCTIONS.strip().splitlines()) + "\n\n",
+        payload=(
+            _INDENT + "QUESTION {q_num}: {question}\n\n"
+            + _INDENT + "EXPECTED KEYWORDS: {keywords}\n\n"
+            + _INDENT + "STUDENT ANSWER: {answer}\n\n"
+        ),
+        suffix="\n".join(_INDENT + line.strip() + "  " for line in _CRITERIA.strip().splitlines()) + "\n" + _INDENT,
+        split_messages=False,
+    ),
+    # v2: whitespace-normalised static instructions as a stable system prefix, variable content last
+    "v2": PromptTemplate(
+        "v2",
+        prefix=normalise_whitespace(_INSTRUCTIONS + _CRITERIA),
+        payload="QUESTION {q_num}: {question}\nEXPECTED KEYWORDS: {keywords}\nSTUDENT ANSWER: {answer}",
+    ),
+}
+
+DEFAULT_GRADING_TEMPLATE = "v2"
+
+
+def get_grading_template(version=None):
+    return GRADING_TEMPLATES.get(version or DEFAULT_GRADING_TEMPLATE, GRADING_TEMPLATES[DEFAULT_GRADING_TEMPLATE])
+
+
+# ---------------- Question-major batch grading ----------------
+
+# Several students' answers to one question per request. Students are labelled S1..SK so
+# names never reach the model, and the reply is JSON so each grade maps back to its student.
+_BATCH_CRITERIA = """
+    Several students' answers to the same question follow, each labelled with an ID such as [S1].
+    Grade every answer independently against the same standard; identical content must get an identical score.
+    Evaluation Criteria:
+    - Content Accuracy: Assess factual correctness and relevance with extreme leniency.
+    - Keyword Usage: Consider even minimal keyword matches positively.
+    - Clarity & Completeness: Reward any attempt at structure and coherence.
+
+    STRICT RESPONSE FORMAT (NO MARKING SYSTEM DISCLOSURE), a single JSON object:
+    {"grades": [{"id": "S1", "score": <numeric score from 3-5 unless completely blank>, "feedback": "<short, 4-5 lines of encouraging feedback highlighting strengths first, then gentle suggestions>"}]}
+    Include exactly one entry for every ID.
+"""
+
+BATCH_GRADING_TEMPLATES = {
+    "v2-batch": PromptTemplate(
+        "v2-batch",
+        prefix=normalise_whitespace(_INSTRUCTIONS + _BATCH_CRITERIA),
+        payload="QUESTION {q_num}: {question}\nEXPECTED KEYWORDS: {keywords}\nSTUDENT ANSWERS:\n{answers}",
+    ),
+}
+
+DEFAULT_BATCH_GRADING_TEMPLATE = "v2-batch"
+
+
+def get_batch_grading_template(version=None):
+    return BATCH_GRADING_TEMPLATES.get(
+        version or DEFAULT_BATCH_GRADING_TEMPLATE, BATCH_GRADING_TEMPLATES[DEFAULT_BATCH_GRADING_TEMPLATE]
+    )
+
+
+def format_batch_answers(answers):
+    # answers: [(label, text)] -> "[S1]\n<text>\n\n[S2]\n<text>"
+    return "\n\n".join(f"[{label}]\n{text}" for label, text in answers)
@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# Process-wide scheduler for outbound Mistral calls. Every Streamlit session submits its OCR
+# and grading calls here instead of running its own pool, so the two API keys see one bounded
+# stream of requests no matter how many teachers are grading at once.
+#
+# Each resource ("ocr", "grading", "local_ocr") has a concurrency budget. Waiting calls sit in
+# per-teacher queues; interactive requests are always dispatched before batch ones, and within a priority
+# teachers take turns in proportion to their weight (start-time fair queuing on a virtual clock).
+
+OCR = "ocr"
+GRADING = "grading"
+# Local OCR engines are CPU-bound, so their budget follows the core count rather than the API
+LOCAL_OCR = "local_ocr"
+DEFAULT_BUDGETS = {OCR: 4, GRADING: 6, LOCAL_OCR: os.cpu_count() or 2}
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+WAIT_SAMPLES = 2000
+
+
+class _Task:
+    __slots__ = ("fn", "future", "tenant", "priority", "enqueued")
+
+    def __init__(self, fn, tenant, priority):
+        self.fn = fn
+        self.future = Future()
+        self.tenant = tenant
+        self.priority = priority
+        self.enqueued = time.monotonic()
+
+
+class _Resource:
+    def __init__(self, budget):
+        self.budget = budget
+        self.running = 0
+        # priority -> tenant -> deque of tasks
+        self.queues = {INTERACTIVE: {}, BATCH: {}}
+        # tenant -> virtual time of its next dispatch; reset whenever a tenant goes idle
+        self.virtual_time = {}
+        self.clock = 0.0
+        self.dispatched = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+
+class FairScheduler:
+
+    def __init__(self, budgets=None, max_threads=64):
+        self._lock = threading.Lock()
+        self._resources = {name: _Resource(budget) for name, budget in (budgets or DEFAULT_BUDGETS).items()}
+        self._weights = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="scheduler")
+
+    # ---------------- Configuration ----------------
+
+    def set_budget(self, resource, budget):
+        with self._lock:
+            self._resource(resource).budget = max(1, int(budget))
+            self._dispatch(resource)
+
+    def set_weight(self, tenant, weight):
+        with self._lock:
+            self._weights[tenant] = max(float(weight), 0.01)
+
+    def _resource(self, resource):
+        if resource not in self._resources:
+            self._resources[resource] = _Resource(DEFAULT_BUDGETS.get(resource, 4))
+        return self._resources[resource]
+
+    # ---------------- Submission ----------------
+
+    def submit(self, resource, tenant, fn, priority=INTERACTIVE):
+        # Returns a concurrent.futures.Future, so callers can use as_completed() as with a pool
+        task = _Task(fn, tenant, priority)
+        with self._lock:
+            state = self._resource(resource)
+            tenant_queue = state.queues[priority].setdefault(tenant, deque())
+            if tenant not in state.virtual_time:
+                # A tenant that was idle joins at the current clock instead of claiming back-pay
+                state.virtual_time[tenant] = state.clock
+            tenant_queue.append(task)
+            self._dispatch(resource)
+        return task.future
+
+    def _next_task(self, state):
+        for priority in (INTERACTIVE, BATCH):
+            waiting = [tenant for tenant, tasks in state.queues[priority].items() if tasks]
+            if not waiting:
+                continue
+            tenant = min(waiting, key=lambda t: state.virtual_time[t])
+            task = state.queues[priority][tenant].popleft()
+            # Cancelled while queued (its session went away): dropped without charging the tenant
+            if not task.future.cancelled():
+                state.clock = state.virtual_time[tenant]
+                state.virtual_time[tenant] += 1.0 / self._weights.get(tenant, 1.0)
+            if not state.queues[priority][tenant]:
+                del state.queues[priority][tenant]
+                if not any(tenant in queues for queues in state.queues.values()):
+                    state.virtual_time.pop(tenant, None)
+            return task
+        return None
+
+    def _dispatch(self, resource):
+        # Caller holds the lock
+        state = self._resources[resource]
+        while state.running < state.budget:
+            task = self._next_task(state)
+            if task is None:
+                return
+            if not task.future.set_running_or_notify_cancel():
+                continue
+            state.running += 1
+            state.dispatched += 1
+            state.waits.append((time.monotonic() - task.enqueued, task.tenant, task.priority))
+            self._executor.submit(self._run, resource, task)
+
+    def _run(self, resource, task):
+        try:
+            task.future.set_result(task.fn())
+        except BaseException as e:
+            task.future.set_exception(e)
+        finally:
+            with self._lock:
+                self._resources[resource].running -= 1
+                self._dispatch(resource)
+
+    # ---------------- Observability ----------------
+
+    def stats(self):
+        # Live queue depth per teacher and priority, plus wait-time percentiles over recent dispatches
+        with self._lock:
+            snapshot = {}
+            for name, state in self._resources.items():
+                waits = sorted(wait for wait, _, _ in state.waits)
+                snapshot[name] = {
+                    "budget": state.budget,
+                    "running": state.running,
+                    "dispatched": state.dispatched,
+                    "queued": sum(len(tasks) for queues in state.queues.values() for tasks in queues.values()),
+                    "queues": [
+                        {"tenant": tenant, "priority": PRIORITY_NAMES[priority], "depth": len(tasks)}
+                        for priority, queues in state.queues.items()
+                        for tenant, tasks in queues.items()
+                    ],
+                    "wait_p50": _percentile(waits, 0.5),
+                    "wait_p95": _percentile(waits, 0.95),
+                    "wait_max": waits[-1] if waits else 0.0,
+                }
+            return snapshot
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+scheduler = FairScheduler()
@@ -0,0 +1,150 @@
+import csv
+import io
+import tempfile
+
+
+# Gradebook export of student_scores. Documents are streamed through a batched cursor that
+# projects only the totals and per-question scores, and each format writer consumes rows as
+# they arrive, so memory stays flat however large the class or date range is while the file is
+# built, in a spooled temporary file that moves to disk once it outgrows SPOOL_BYTES. Only the
+# finished file is read back, as bytes, which is what st.download_button accepts.
+
+CURSOR_BATCH = 1000
+PARQUET_ROW_GROUP = 10000
+SPOOL_BYTES = 8 * 1024 * 1024
+
+BASE_COLUMNS = ["test_id", "prn", "student_name", "timestamp", "total_marks", "max_marks", "percentage"]
+FORMATS = {"CSV": ("csv", "text/csv"), "Parquet": ("parquet", "application/vnd.apache.parquet")}
+
+
+def export_query(test_ids=None, since=None, until=None):
+    query = {}
+    if test_ids is not None:
+        query["test_id"] = {"$in": list(test_ids)}
+    if since or until:
+        query["timestamp"] = {**({"$gte": since} if since else {}), **({"$lt": until} if until else {})}
+    return query
+
+
+def question_columns(scores_collection, query):
+    # One score column per question number seen in the export, in question order
+    numbers = scores_collection.distinct("results.question_number", query)
+    numbers.sort(key=lambda q: (0, int(q)) if str(q).isdigit() else (1, str(q)))
+    return [f"Q{number}" for number in numbers]
+
+
+def iter_rows(scores_collection, query, batch_size=CURSOR_BATCH):
+    projection = {"_id": 0, "test_id": 1, "prn": 1, "student_name": 1, "timestamp": 1,
+                  "total_marks": 1, "max_marks": 1, "results.question_number": 1, "results.score": 1}
+    cursor = scores_collection.find(query, projection, batch_size=batch_size).sort([("test_id", 1), ("prn", 1)])
+    for document in cursor:
+        yield score_row(document)
+
+
+def score_row(document):
+    max_marks = document.get("max_marks") or 0
+    total_marks = document.get("total_marks") or 0
+    row = {
+        "test_id": document.get("test_id"),
+        "prn": document.get("prn"),
+        "student_name": document.get("student_name"),
+        "timestamp": document.get("timestamp"),
+        "total_marks": total_marks,
+        "max_marks": max_marks,
+        "percentage": round(total_marks / max_marks * 100, 2) if max_marks else None,
+    }
+    for result in document.get("results", []):
+        row[f"Q{result.get('question_number')}"] = result.get("score")
+    return row
+
+
+# ---------------- Writers ----------------
+
+def write_csv(rows, columns, binary_file):
+    text = io.TextIOWrapper(binary_file, encoding="utf-8", newline="")
+    writer = csv.DictWriter(text, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+    text.flush()
+    # Hand the underlying file back without closing it
+    text.detach()
+
+
+def write_parquet(rows, columns, binary_file, row_group=PARQUET_ROW_GROUP):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    fields = [
+        pa.field("test_id", pa.string()), pa.field("prn", pa.string()), pa.field("student_name", pa.string()),
+        pa.field("timestamp", pa.timestamp("ms")), pa.field("total_marks", pa.float64()),
+        pa.field("max_marks", pa.float64()), pa.field("percentage", pa.float64()),
+    ]
+    fields += [pa.field(name, pa.float64()) for name in columns[len(BASE_COLUMNS):]]
+    schema = pa.schema(fields)
+
+    with pq.ParquetWriter(binary_file, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == row_group:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+
+WRITERS = {"csv": write_csv, "parquet": write_parquet}
+
+
+def export_scores(scores_collection, query, extension):
+    # -> the finished export as bytes
+    columns = BASE_COLUMNS + question_columns(scores_collection, query)
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as output:
+        WRITERS[extension](iter_rows(scores_collection, query), columns, output)
+        output.seek(0)
+        return output.read()
+
+
+if __name__ == "__main__":
+    # Benchmark without a database: python score_export.py [rows]
+    # Streams synthetic cursor documents through both writers and compares peak Python memory
+    # with the naive list() + DataFrame export.
+    import sys
+    import time
+    import tracemalloc
+    from datetime import datetime, timedelta
+
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_questions = 6
+    columns = BASE_COLUMNS + [f"Q{q}" for q in range(1, n_questions + 1)]
+    start_date = datetime(2025, 1, 1)
+
+    def documents():
+        for i in range(n_rows):
+            scores = [(i * 7 + q) % 6 for q in range(n_questions)]
+            yield {"test_id": f"TEST{i % 50:02d}", "prn": f"PRN{i:06d}", "student_name": f"Student {i}",
+                   "timestamp": start_date + timedelta(minutes=i), "total_marks": sum(scores),
+                   "max_marks": n_questions * 5,
+                   "results": [{"question_number": str(q + 1), "score": s} for q, s in enumerate(scores)]}
+
+    def naive(output):
+        import pandas as pd
+        frame = pd.DataFrame([score_row(document) for document in list(documents())], columns=columns)
+        output.write(frame.to_csv(index=False).encode("utf-8"))
+
+    runs = [
+        ("csv (streamed)", lambda output: write_csv(map(score_row, documents()), columns, output)),
+        ("parquet (streamed)", lambda output: write_parquet(map(score_row, documents()), columns, output)),
+        ("csv (list + DataFrame)", naive),
+    ]
+    for label, run in runs:
+        output = tempfile.TemporaryFile()
+        tracemalloc.start()
+        started = time.perf_counter()
+        run(output)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label:24} {n_rows} rows in {elapsed:.2f}s, peak {peak / 2**20:.1f} MiB, "
+              f"file {output.tell() / 2**20:.1f} MiB")
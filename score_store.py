@@ -0,0 +1,296 @@
+import json
+import zlib
+from datetime import datetime
+
+import pymongo
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+
+# student_scores keeps exactly one current document per (test_id, prn);
+# every superseded attempt is copied to student_scores_history.
+SCORE_KEY = [("test_id", pymongo.ASCENDING), ("prn", pymongo.ASCENDING)]
+
+# Score documents are read on every Home and Analytics rerun but only need totals and
+# per-question scores. The question text, the student's answer, the model's feedback and the
+# OCR transcript go to student_feedback instead: one immutable, zlib-compressed document per
+# saved attempt, referenced by feedback_id and fetched only when someone opens the sheet.
+# Documents saved before the split still carry these fields inline; readers accept both.
+COLD_FIELDS = ("question", "answer", "evaluation")
+FEEDBACK_CODEC = "zlib"
+COMPRESSION_LEVEL = 6
+
+
+# ---------------- Hot/cold split ----------------
+
+def split_feedback(score_fields):
+    # -> (fields for the score document, cold payload or None when there is nothing to move)
+    results = score_fields.get("results")
+    transcript = score_fields.get("transcript")
+    if results is None and transcript is None:
+        return dict(score_fields), None
+
+    hot = {name: value for name, value in score_fields.items() if name != "transcript"}
+    payload = {"transcript": transcript}
+    if results is not None:
+        hot["results"] = [{k: v for k, v in result.items() if k not in COLD_FIELDS} for result in results]
+        payload["results"] = [{k: result[k] for k in COLD_FIELDS if k in result} for result in results]
+    return hot, payload
+
+
+def feedback_document(payload):
+    raw = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+    return {
+        "_id": ObjectId(),
+        "codec": FEEDBACK_CODEC,
+        "raw_bytes": len(raw),
+        "blob": zlib.compress(raw, COMPRESSION_LEVEL),
+    }
+
+
+def merge_feedback(score_document, feedback):
+    # The full view of a score: its cold fields put back, in question order
+    if feedback is None:
+        return score_document
+    payload = json.loads(zlib.decompress(feedback["blob"]))
+    merged = dict(score_document)
+    if payload.get("results") is not None:
+        merged["results"] = [
+            {**result, **cold} for result, cold in zip(score_document.get("results", []), payload["results"])
+        ]
+    if payload.get("transcript") is not None:
+        merged["transcript"] = payload["transcript"]
+    return merged
+
+
+def load_feedback(feedback_collection, score_document):
+    feedback_id = score_document.get("feedback_id")
+    if feedback_id is None:
+        return score_document
+    return merge_feedback(score_document, feedback_collection.find_one({"_id": feedback_id}))
+
+
+def load_feedback_many(feedback_collection, score_documents):
+    # {feedback_id: feedback document} for a batch of scores, in one query
+    ids = [document["feedback_id"] for document in score_documents if document.get("feedback_id") is not None]
+    if not ids:
+        return {}
+    return {feedback["_id"]: feedback for feedback in feedback_collection.find({"_id": {"$in": ids}})}
+
+
+def _store_feedback(feedback_collection, score_fields):
+    # Writes the cold half first, so a score never points at feedback that is not there yet
+    hot, payload = split_feedback(score_fields)
+    if payload is None:
+        return hot
+    feedback = feedback_document(payload)
+    feedback_collection.insert_one(feedback)
+    hot["feedback_id"] = feedback["_id"]
+    return hot
+
+
+def ensure_indexes(scores_collection, history_collection):
+    try:
+        scores_collection.create_index(SCORE_KEY, unique=True, name="test_id_prn_unique")
+    except OperationFailure:
+        # Older append-only data still holds duplicates; fold them into history first
+        migrate_duplicate_scores(scores_collection, history_collection)
+        scores_collection.create_index(SCORE_KEY, unique=True, name="test_id_prn_unique")
+    history_collection.create_index(SCORE_KEY + [("version", pymongo.DESCENDING)])
+
+
+def _history_entry(document, superseded_at):
+    entry = {key: value for key, value in document.items() if key != "_id"}
+    entry["score_id"] = document["_id"]
+    entry["superseded_at"] = superseded_at
+    return entry
+
+
+def migrate_duplicate_scores(scores_collection, history_collection):
+    # Keep the newest document per (test_id, prn) and move the rest to history
+    duplicates = scores_collection.aggregate([
+        {"$sort": {"timestamp": -1}},
+        {"$group": {
+            "_id": {"test_id": "$test_id", "prn": "$prn"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+
+    moved = 0
+    now = datetime.now()
+    for group in duplicates:
+        stale_ids = group["ids"][1:]
+        stale = list(scores_collection.find({"_id": {"$in": stale_ids}}))
+        if stale:
+            history_collection.insert_many([_history_entry(doc, now) for doc in stale])
+            scores_collection.delete_many({"_id": {"$in": stale_ids}})
+            moved += len(stale)
+    return moved
+
+
+def save_score(scores_collection, history_collection, score_document, feedback_collection=None):
+    # Atomic upsert: a pipeline update bumps the version and returns the superseded attempt.
+    # With a feedback collection the heavy text is stored there and dropped from the score.
+    # -> (score _id, version written). Every attempt shares the _id; the version tells them apart.
+    key = {"test_id": score_document["test_id"], "prn": score_document["prn"]}
+    if feedback_collection is not None:
+        score_document = _store_feedback(feedback_collection, score_document)
+    fields = {name: {"$literal": value} for name, value in score_document.items() if name != "_id"}
+    fields["version"] = {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+    if feedback_collection is not None:
+        # An older inline transcript would otherwise survive the $set
+        fields["transcript"] = "$$REMOVE"
+
+    try:
+        previous = scores_collection.find_one_and_update(
+            key, [{"$set": fields}], upsert=True, return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # Two first-time saves raced on the upsert; the loser retries as a plain update
+        previous = scores_collection.find_one_and_update(
+            key, [{"$set": fields}], upsert=True, return_document=ReturnDocument.BEFORE
+        )
+
+    if previous is None:
+        return scores_collection.find_one(key, {"_id": 1})["_id"], 1
+
+    history_collection.insert_one(_history_entry(previous, score_document.get("timestamp", datetime.now())))
+    return previous["_id"], (previous.get("version") or 0) + 1
+
+
+def load_score_version(scores_collection, history_collection, test_id, prn, version):
+    # One attempt by version: the current document while it is still that version, else its history copy
+    current = scores_collection.find_one({"test_id": test_id, "prn": prn})
+    if current is not None and (current.get("version") or 0) == version:
+        return current
+    return history_collection.find_one({"test_id": test_id, "prn": prn, "version": version})
+
+
+def bulk_update_scores(scores_collection, history_collection, updates, batch_size=500, feedback_collection=None):
+    # updates: [(current_document, changed_fields)]. Writes in unordered batches, copying each
+    # superseded document to history first; yields the running count of documents written.
+    now = datetime.now()
+    written = 0
+    for start in range(0, len(updates), batch_size):
+        chunk = updates[start:start + batch_size]
+        operations = []
+        if feedback_collection is not None:
+            feedback = []
+            for document, fields in chunk:
+                hot, payload = split_feedback(fields)
+                if payload is not None:
+                    feedback.append(feedback_document(payload))
+                    hot["feedback_id"] = feedback[-1]["_id"]
+                operations.append(({"_id": document["_id"]}, {"$set": hot, "$inc": {"version": 1}, "$unset": {"transcript": ""}}))
+            if feedback:
+                feedback_collection.insert_many(feedback, ordered=False)
+        else:
+            operations = [({"_id": document["_id"]}, {"$set": fields, "$inc": {"version": 1}}) for document, fields in chunk]
+
+        history_collection.insert_many([_history_entry(document, now) for document, _ in chunk])
+        scores_collection.bulk_write([UpdateOne(query, update) for query, update in operations], ordered=False)
+        written += len(chunk)
+        yield written
+
+
+def migrate_feedback(collection, feedback_collection, batch_size=500):
+    # Moves inline feedback and transcripts of existing documents (scores or history) to
+    # student_feedback; yields the running count of documents migrated. Safe to re-run.
+    pending = {"feedback_id": {"$exists": False},
+               "$or": [{"results.evaluation": {"$exists": True}}, {"transcript": {"$exists": True}}]}
+    ids = [document["_id"] for document in collection.find(pending, {"_id": 1})]
+    migrated = 0
+    for start in range(0, len(ids), batch_size):
+        chunk = collection.find({"_id": {"$in": ids[start:start + batch_size]}, **pending},
+                                {"_id": 1, "results": 1, "transcript": 1})
+        feedback, operations = [], []
+        for document in chunk:
+            hot, payload = split_feedback({"results": document.get("results"), "transcript": document.get("transcript")})
+            feedback.append(feedback_document(payload))
+            hot["feedback_id"] = feedback[-1]["_id"]
+            if hot["results"] is None:
+                del hot["results"]
+            operations.append(UpdateOne({"_id": document["_id"], "feedback_id": {"$exists": False}},
+                                        {"$set": hot, "$unset": {"transcript": ""}}))
+        if operations:
+            feedback_collection.insert_many(feedback, ordered=False)
+            collection.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+        yield migrated
+
+
+# ---------------- Measurements ----------------
+
+def storage_report(collection):
+    # Document count and sizes as the server stores them (bytes, before/after compression)
+    stats = next(collection.aggregate([{"$collStats": {"storageStats": {}}}]), {}).get("storageStats", {})
+    return {
+        "documents": stats.get("count", 0),
+        "avg_document_bytes": stats.get("avgObjSize", 0),
+        "data_bytes": stats.get("size", 0),
+        "storage_bytes": stats.get("storageSize", 0),
+        "index_bytes": stats.get("totalIndexSize", 0),
+    }
+
+
+def hot_query_latency(scores_collection, samples=50):
+    # The Home/Analytics query for sampled students: whole documents, as the pages fetched them
+    import time
+    import bson
+
+    prns = [row["_id"] for row in scores_collection.aggregate([
+        {"$sample": {"size": samples}}, {"$group": {"_id": "$prn"}},
+    ])]
+    timings, transferred = [], 0
+    for prn in prns:
+        start = time.perf_counter()
+        documents = list(scores_collection.find({"prn": prn}))
+        timings.append(time.perf_counter() - start)
+        transferred += sum(len(bson.encode(document)) for document in documents)
+    timings.sort()
+    if not timings:
+        return {"queries": 0}
+    return {
+        "queries": len(timings),
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "bytes_per_query": transferred / len(timings),
+    }
+
+
+if __name__ == "__main__":
+    # One-off migrations:
+    #   python score_store.py                 fold duplicate scores into history
+    #   python score_store.py split-feedback  move feedback and transcripts out of the score documents
+    import os
+    import sys
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    students_db = pymongo.MongoClient(os.environ["MONGO_URI"])["student"]
+    scores, history = students_db["student_scores"], students_db["student_scores_history"]
+
+    if sys.argv[1:] == ["split-feedback"]:
+        feedback_collection = students_db["student_feedback"]
+        before = {"scores": storage_report(scores), "latency": hot_query_latency(scores)}
+        for collection in (scores, history):
+            migrated = 0
+            for migrated in migrate_feedback(collection, feedback_collection):
+                print(f"{collection.name}: {migrated} document(s) migrated", end="\r")
+            print(f"{collection.name}: {migrated} document(s) migrated")
+        after = {"scores": storage_report(scores), "latency": hot_query_latency(scores)}
+
+        print(f"{'':24}{'before':>14}{'after':>14}")
+        for section in ("scores", "latency"):
+            for name, value in before[section].items():
+                print(f"{section + '.' + name:24}{value:>14.1f}{after[section].get(name, 0):>14.1f}")
+        cold = storage_report(feedback_collection)
+        print(f"student_feedback: {cold['documents']} document(s), {cold['data_bytes']} bytes "
+              f"({cold['storage_bytes']} on disk)")
+    else:
+        moved = migrate_duplicate_scores(scores, history)
+        ensure_indexes(scores, history)
+        print(f"Moved {moved} superseded score document(s) to student_scores_history")
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+# Cold-start profile for a dashboard: what its first script run imports (python -X importtime)
+# and how long that first run takes under Streamlit's AppTest. Every run is a fresh interpreter,
+# i.e. a cold container. Track the numbers over time; --budget-ms turns it into a check.
+#
+#   python startup_profile.py stud_dashboard.py --runs 5
+#   python startup_profile.py tchr_dashboard.py --mongo-uri mongodb://localhost:27017 --json
+#
+# The student dashboard opens on Login, which pings MongoDB; point --mongo-uri at a running
+# server or the ping timeout dominates the first render.
+
+MARKER = "--- dashboard imports start ---"
+
+RUNNER = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+print({marker!r}, file=sys.stderr, flush=True)
+app = AppTest.from_file({path!r}, default_timeout=120)
+app.secrets["MONGO_URI"] = {mongo_uri!r}
+app.secrets["MISTRAL_API_KEY_IMAGE"] = "profile"
+app.secrets["MISTRAL_API_KEY_EVALUATION"] = "profile"
+start = time.perf_counter()
+app.run()
+first_render = time.perf_counter() - start
+start = time.perf_counter()
+app.run()
+rerun = time.perf_counter() - start
+print(json.dumps({{
+    "first_render_s": first_render,
+    "rerun_s": rerun,
+    "exceptions": [str(e.value) for e in app.exception],
+}}))
+"""
+
+
+def parse_importtime(stderr):
+    # Top-level imports after the marker: {module: cumulative microseconds}
+    modules = {}
+    started = False
+    for line in stderr.splitlines():
+        if line.strip() == MARKER:
+            started = True
+            continue
+        if not started or not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def profile_once(path, mongo_uri):
+    code = RUNNER.format(marker=MARKER, path=path, mongo_uri=mongo_uri)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(path)) or ".",
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["imports"] = parse_importtime(proc.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import and first-render profile for a dashboard")
+    parser.add_argument("dashboard", help="e.g. stud_dashboard.py")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--mongo-uri", default=os.environ.get("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--budget-ms", type=float, help="fail when the median first render is slower")
+    parser.add_argument("--json", action="store_true", help="print one JSON summary line")
+    args = parser.parse_args()
+
+    runs = [profile_once(args.dashboard, args.mongo_uri) for _ in range(args.runs)]
+    first_render_ms = statistics.median(run["first_render_s"] for run in runs) * 1000
+    rerun_ms = statistics.median(run["rerun_s"] for run in runs) * 1000
+    imports = runs[-1]["imports"]
+    import_ms = sum(imports.values()) / 1000
+    top = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    if args.json:
+        print(json.dumps({
+            "dashboard": args.dashboard,
+            "runs": args.runs,
+            "first_render_ms": round(first_render_ms, 1),
+            "rerun_ms": round(rerun_ms, 1),
+            "import_ms": round(import_ms, 1),
+            "top_imports_ms": {name: round(us / 1000, 1) for name, us in top},
+            "exceptions": runs[-1]["exceptions"],
+        }))
+    else:
+        print(f"{args.dashboard}: first render {first_render_ms:.0f} ms, rerun {rerun_ms:.0f} ms "
+              f"(median of {args.runs} cold starts)")
+        print(f"Imports during the first run: {import_ms:.0f} ms")
+        for name, us in top:
+            print(f"  {us / 1000:8.1f} ms  {name}")
+        for exception in runs[-1]["exceptions"]:
+            print(f"Script raised: {exception}")
+
+    if args.budget_ms is not None and first_render_ms > args.budget_ms:
+        sys.exit(f"First render {first_render_ms:.0f} ms exceeds the {args.budget_ms:.0f} ms budget")
+
+
+if __name__ == "__main__":
+    main()
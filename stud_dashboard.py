@@ -5,16 +5,27 @@ from streamlit_option_menu import option_menu
 import os
 from dotenv import load_dotenv
 import bcrypt
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from change_feed import get_change_feed, REFRESH_INTERVAL
+
+# pandas and Plotly (via student_analytics) are imported inside the sections that use them,
+# so the login page renders without loading them. See startup_profile.py.
 
 # Load environment variables
 load_dotenv()
 MONGO_URI = st.secrets["MONGO_URI"]  
 # Connect to MongoDB
 client = MongoClient(MONGO_URI)
+# Process-wide change-stream listener: keeps cached pages exact and tells open pages about new grades
+feed = get_change_feed(MONGO_URI)
+
+
+@st.fragment(run_every=REFRESH_INTERVAL)
+def refresh_on_change(scope, key, seen):
+    # Reads the feed's in-memory version only; reruns the page once new data has landed
+    if feed.version(scope, key) != seen:
+        st.rerun()
 
 # ---------------- Streamlit UI Configuration ----------------
 st.set_page_config(page_title="Student Dashboard", page_icon="📚", layout="wide")
@@ -112,6 +123,7 @@ if selected == "🔑 Login/Signup":
             st.session_state["authenticated"] = False
             st.session_state["student_name"] = ""
             st.session_state["prn"] = ""
+            st.session_state.pop("results_query", None)
             st.success("✅ Logged out successfully.")
 
 # -------------------- Home Section --------------------
@@ -132,9 +144,14 @@ elif selected == "🏠 Home":
     metadata_collection = students_db["stud_metadata"]
     scores_collection = students_db["student_scores"]
     
+    from student_data import results_version, load_results
+
     # Fetch student data
     student_data = metadata_collection.find_one({"prn": prn})
-    student_scores = list(scores_collection.find({"prn": prn}))
+    version = results_version(feed, scores_collection, prn)
+    student_scores = load_results(prn, version, scores_collection)
+    if feed.live:
+        refresh_on_change("prn", prn, version)
     
     # Dashboard Layout
     col1, col2 = st.columns([2, 1])
@@ -185,6 +202,8 @@ elif selected == "🏠 Home":
             })
         
         if recent_tests_data:
+            import pandas as pd
+
             recent_df = pd.DataFrame(recent_tests_data)
             st.dataframe(recent_df, use_container_width=True)
         else:
@@ -228,18 +247,24 @@ elif selected == "📊 View Test Results":
     with col2:
         test_id_filter = st.text_input("Test ID (optional)", key="test_id_filter")
     
+    # The search is kept in the session so the results stay up when the page reruns for a new grade
     if st.button("Search"):
+        st.session_state["results_query"] = test_id_filter
+    
+    if "results_query" in st.session_state:
+        from student_data import results_version, load_result_pages, load_question_feedback
+
         # Direct connection to student database and student_scores collection
         student_db = client["student"]
         scores_collection = student_db["student_scores"]
+        feedback_collection = student_db["student_feedback"]
         
-        # Build query based on PRN and optional test_id
-        query = {"prn": prn}
-        if test_id_filter:
-            query["test_id"] = test_id_filter
-        
-        # Execute the query
-        results = list(scores_collection.find(query))
+        # Cached per PRN, optional test_id and data version
+        test_id_filter = st.session_state["results_query"]
+        version = results_version(feed, scores_collection, prn)
+        results = load_result_pages(prn, test_id_filter, version, scores_collection)
+        if feed.live:
+            refresh_on_change("prn", prn, version)
         
         if results:
             st.success(f"Found {len(results)} test results for PRN: {prn}")
@@ -275,9 +300,13 @@ elif selected == "📊 View Test Results":
                             st.markdown(f"**Percentage:** {percentage:.1f}%")
                     
                     # Display question-wise results if available
-                    if "results" in result and result["results"]:
+                    if "results" in result and result["results"] and st.toggle("Show question-wise feedback", key=f"feedback_{test_id}"):
                         st.subheader("Question-wise Feedback")
-                        for question_result in result["results"]:
+                        # Feedback is stored apart from the score and only fetched when asked for
+                        question_results = result["results"]
+                        if result.get("feedback_id") is not None:
+                            question_results = load_question_feedback(str(result["feedback_id"]), feedback_collection, result)
+                        for question_result in question_results:
                             question_num = question_result.get('question_number', 'Unknown')
                             question_text = question_result.get('question', 'No question text')
                             
@@ -312,6 +341,11 @@ elif selected == "📈 Performance Analytics":
     if not st.session_state.get("authenticated", False):
         st.warning("⚠️ Please login to view your analytics.")
         st.stop()
+
+    from student_analytics import (
+        performance_frame, subject_summary,
+        timeline_spec, subject_bar_spec, subject_radar_spec, question_spec, trend_spec, distribution_spec,
+    )
     
     # Get student info from session
     prn = st.session_state["prn"]
@@ -320,117 +354,49 @@ elif selected == "📈 Performance Analytics":
     students_db = client["student"]
     scores_collection = students_db["student_scores"]
     
-    # Fetch all test results for this student
-    all_results = list(scores_collection.find({"prn": prn}))
+    from student_data import results_version, subjects_version, load_results, load_test_subjects
+
+    # Everything below is cached per (prn, subject, data version); a widget change only
+    # recomputes the piece that depends on it
+    version = results_version(feed, scores_collection, prn)
+    all_results = load_results(prn, version, scores_collection)
+    if feed.live:
+        refresh_on_change("prn", prn, version)
     
     if not all_results:
         st.info("No test data available for analysis. Take some tests to see analytics.")
         st.stop()
     
-    # Extract subject information for all tests
-    test_subjects = {}
-    
-    # First, get all test IDs
-    test_ids = [result.get("test_id") for result in all_results]
-    
-    # Then, search all databases for subject information
-    for db_name in client.list_database_names():
-        # Skip system databases
-        if db_name.startswith('admin') or db_name.startswith('local') or db_name.startswith('config'):
-            continue
-        
-        current_db = client[db_name]
-        
-        # Check each test_id
-        for test_id in test_ids:
-            if test_id in current_db.list_collection_names():
-                test_collection = current_db[test_id]
-                test_info = test_collection.find_one({})
-                
-                if test_info and "subject" in test_info:
-                    test_subjects[test_id] = test_info["subject"]
+    # Subject for each test, looked up across the teacher databases
+    test_ids = tuple(sorted({result.get("test_id") for result in all_results if result.get("test_id")}))
+    test_subjects = load_test_subjects(test_ids, subjects_version(feed, test_ids), client)
     
     # If we have subject information, allow filtering by subject
     if test_subjects:
-        unique_subjects = list(set(test_subjects.values()))
+        unique_subjects = sorted(set(test_subjects.values()))
         selected_subject = st.selectbox("Select Subject for Analysis", ["All Subjects"] + unique_subjects)
     else:
         selected_subject = "All Subjects"
     
-    # Filter results by subject if needed
-    if selected_subject != "All Subjects":
-        filtered_test_ids = [test_id for test_id, subject in test_subjects.items() if subject == selected_subject]
-        filtered_results = [result for result in all_results if result.get("test_id") in filtered_test_ids]
-    else:
-        filtered_results = all_results
+    df = performance_frame(prn, selected_subject, version, all_results, test_subjects)
     
-    if not filtered_results:
+    if df.empty:
         st.warning(f"No test data available for subject: {selected_subject}")
         st.stop()
     
-    # Prepare data for visualization
-    analysis_data = []
+    if selected_subject != "All Subjects":
+        filtered_results = [result for result in all_results if test_subjects.get(result.get("test_id")) == selected_subject]
+    else:
+        filtered_results = all_results
     
-    for result in filtered_results:
-        test_id = result.get("test_id", "Unknown")
-        timestamp = result.get("timestamp", datetime.now())
-        total_marks = result.get("total_marks", 0)
-        max_marks = result.get("max_marks", 1)
-        percentage = (total_marks / max_marks) * 100 if max_marks > 0 else 0
-        subject = test_subjects.get(test_id, "Unknown Subject")
-        
-        analysis_data.append({
-            "Test ID": test_id,
-            "Date": timestamp,
-            "Total Marks": total_marks,
-            "Max Marks": max_marks,
-            "Percentage": percentage,
-            "Subject": subject
-        })
-    
-    # Convert to DataFrame for easier plotting
-    df = pd.DataFrame(analysis_data)
-    df = df.sort_values("Date")
+    # Used for both subject-wise performance and personalized insights
+    subject_df = subject_summary(prn, selected_subject, version, df)
     
     # ---- VISUALIZATIONS ----
     
     # 1. Performance Timeline
     st.subheader("📊 Performance Timeline")
-    
-    fig = px.line(df, x="Date", y="Percentage", 
-                 title="Performance Over Time",
-                 labels={"Percentage": "Score (%)", "Date": "Test Date"},
-                 markers=True)
-    
-    fig.update_layout(
-        xaxis_title="Test Date",
-        yaxis_title="Score (%)",
-        yaxis=dict(range=[0, 105]),
-        hovermode="x unified"
-    )
-    
-    st.plotly_chart(fig, use_container_width=True)
-    
-    # Create subject_df for analysis - FIX: moved this here so it's created before being used
-    # Used for both subject-wise performance and personalized insights
-    subject_performance = {}
-    for _, row in df.iterrows():
-        subject = row["Subject"]
-        if subject not in subject_performance:
-            subject_performance[subject] = {"scores": [], "count": 0}
-        subject_performance[subject]["scores"].append(row["Percentage"])
-        subject_performance[subject]["count"] += 1
-    
-    # Create subject_df here with proper structure
-    subject_data = []
-    for subject, data in subject_performance.items():
-        subject_data.append({
-            "Subject": subject,
-            "Average_Score": sum(data["scores"]) / len(data["scores"]) if data["scores"] else 0,
-            "Tests_Taken": data["count"]
-        })
-    
-    subject_df = pd.DataFrame(subject_data)
+    st.plotly_chart(timeline_spec(prn, selected_subject, version, df), use_container_width=True)
     
     # 2. Subject-wise Performance (if we have multiple subjects)
     if len(test_subjects) > 1 and selected_subject == "All Subjects":
@@ -440,36 +406,12 @@ elif selected == "📈 Performance Analytics":
         
         with fig1:
             # Bar chart for average scores
-            fig = px.bar(subject_df, x="Subject", y="Average_Score",
-                        labels={"Average_Score": "Average Score (%)", "Subject": "Subject"},
-                        title="Average Score by Subject")
-            
-            fig.update_layout(yaxis=dict(range=[0, 105]))
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(subject_bar_spec(prn, selected_subject, version, subject_df), use_container_width=True)
         
         with fig2:
             # Radar chart for subject strength analysis
             if not subject_df.empty:  # Make sure we have data
-                fig = go.Figure()
-                
-                fig.add_trace(go.Scatterpolar(
-                    r=subject_df["Average_Score"].tolist(),
-                    theta=subject_df["Subject"].tolist(),
-                    fill='toself',
-                    name='Your Score'
-                ))
-                
-                fig.update_layout(
-                    polar=dict(
-                        radialaxis=dict(
-                            visible=True,
-                            range=[0, 100]
-                        )
-                    ),
-                    title="Subject Strength Analysis"
-                )
-                
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(subject_radar_spec(prn, selected_subject, version, subject_df), use_container_width=True)
     
     # 3. Question-wise Analysis for recent tests
     st.subheader("🔍 Question-wise Performance")
@@ -489,57 +431,18 @@ elif selected == "📈 Performance Analytics":
         test_result = filtered_results[selected_idx]
         
         if "results" in test_result and test_result["results"]:
-            # Extract question data
-            question_data = []
-            
-            for question in test_result["results"]:
-                question_data.append({
-                    "Question": f"Q{question.get('question_number', '?')}",
-                    "Score": question.get('score', 0),
-                    "Max Score": 5  # Assuming max score is 5 per question
-                })
-            
-            question_df = pd.DataFrame(question_data)
-            
-            # Create bar chart for question scores
-            fig = px.bar(question_df, x="Question", y="Score",
-                        labels={"Score": "Score", "Question": "Question Number"},
-                        title=f"Scores by Question - {selected_test}",
-                        range_y=[0, 5.5])
-            
-            fig.add_hline(y=5, line_dash="dash", line_color="green", annotation_text="Max Score")
-            
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(question_spec(prn, version, selected_test, test_result), use_container_width=True)
         else:
             st.info("No question-wise data available for this test.")
     else:
         st.info("No tests available for question-wise analysis.")
     
     # 4. Performance Trends and Improvement Analysis
-    if len(filtered_results) >= 2:
+    if len(df) >= 2:
         st.subheader("📈 Performance Trends")
         
-        # Calculate moving average for trend line
-        df['MA_3'] = df['Percentage'].rolling(window=min(3, len(df))).mean()
-        
-        # Performance over last few tests
-        fig = px.line(df, x="Date", y=["Percentage", "MA_3"],
-                     title="Performance Trend Analysis",
-                     labels={"value": "Score (%)", "Date": "Test Date", "variable": "Metric"},
-                     color_discrete_map={"Percentage": "royalblue", "MA_3": "firebrick"})
-        
-        fig.update_layout(
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
-            ),
-            yaxis=dict(range=[0, 105])
-        )
-        
-        st.plotly_chart(fig, use_container_width=True)
+        # Performance over last few tests with a 3-test moving average
+        st.plotly_chart(trend_spec(prn, selected_subject, version, df), use_container_width=True)
         
         # Calculate improvement metrics
         first_test = df.iloc[0]["Percentage"]
@@ -559,19 +462,7 @@ elif selected == "📈 Performance Analytics":
     
     # 5. Performance Distribution
     st.subheader("📊 Score Distribution")
-    
-    # Create histogram of scores
-    fig = px.histogram(df, x="Percentage", 
-                     nbins=10, 
-                     title="Distribution of Test Scores",
-                     labels={"Percentage": "Score (%)", "count": "Number of Tests"})
-    
-    fig.update_layout(
-        xaxis=dict(range=[0, 105]),
-        bargap=0.2
-    )
-    
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(distribution_spec(prn, selected_subject, version, df), use_container_width=True)
     
     # 6. Custom Insights Based on Data
     st.subheader("🔍 Personalized Insights")
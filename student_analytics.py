@@ -0,0 +1,121 @@
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import streamlit as st
+
+from student_data import CACHE_TTL
+
+
+# Pure, cacheable building blocks for the student Performance Analytics page.
+# Cached functions take hashable keys (prn, subject, data version) and receive the heavy
+# inputs through underscore-prefixed arguments, which st.cache_data does not hash.
+# Figures are returned as plain dict specs so cached copies are cheap to pickle.
+# The Mongo loaders live in student_data.py so the lighter pages can use them without pandas.
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def performance_frame(prn, subject, version, _results, _test_subjects):
+    df = pd.DataFrame(_results, columns=["test_id", "timestamp", "total_marks", "max_marks"])
+    df["Subject"] = df["test_id"].map(_test_subjects).fillna("Unknown Subject")
+    if subject != "All Subjects":
+        df = df[df["Subject"] == subject]
+
+    max_marks = df["max_marks"].fillna(1)
+    df = df.assign(
+        **{
+            "Test ID": df["test_id"].fillna("Unknown"),
+            "Date": df["timestamp"],
+            "Total Marks": df["total_marks"].fillna(0),
+            "Max Marks": max_marks,
+            "Percentage": (df["total_marks"].fillna(0) / max_marks.where(max_marks > 0) * 100).fillna(0),
+        }
+    )[["Test ID", "Date", "Total Marks", "Max Marks", "Percentage", "Subject"]]
+    df = df.sort_values("Date").reset_index(drop=True)
+    df["MA_3"] = df["Percentage"].rolling(window=min(3, len(df)) or 1).mean()
+    return df
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def subject_summary(prn, subject, version, _df):
+    return (
+        _df.groupby("Subject", sort=False)["Percentage"]
+        .agg(Average_Score="mean", Tests_Taken="count")
+        .reset_index()
+    )
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def timeline_spec(prn, subject, version, _df):
+    fig = px.line(_df, x="Date", y="Percentage",
+                  title="Performance Over Time",
+                  labels={"Percentage": "Score (%)", "Date": "Test Date"},
+                  markers=True)
+    fig.update_layout(
+        xaxis_title="Test Date",
+        yaxis_title="Score (%)",
+        yaxis=dict(range=[0, 105]),
+        hovermode="x unified"
+    )
+    return fig.to_dict()
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def subject_bar_spec(prn, subject, version, _subject_df):
+    fig = px.bar(_subject_df, x="Subject", y="Average_Score",
+                 labels={"Average_Score": "Average Score (%)", "Subject": "Subject"},
+                 title="Average Score by Subject")
+    fig.update_layout(yaxis=dict(range=[0, 105]))
+    return fig.to_dict()
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def subject_radar_spec(prn, subject, version, _subject_df):
+    fig = go.Figure()
+    fig.add_trace(go.Scatterpolar(
+        r=_subject_df["Average_Score"].tolist(),
+        theta=_subject_df["Subject"].tolist(),
+        fill='toself',
+        name='Your Score'
+    ))
+    fig.update_layout(
+        polar=dict(radialaxis=dict(visible=True, range=[0, 100])),
+        title="Subject Strength Analysis"
+    )
+    return fig.to_dict()
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def question_spec(prn, version, test_label, _test_result):
+    question_df = pd.DataFrame([
+        {"Question": f"Q{question.get('question_number', '?')}", "Score": question.get('score', 0)}
+        for question in _test_result.get("results", [])
+    ])
+    fig = px.bar(question_df, x="Question", y="Score",
+                 labels={"Score": "Score", "Question": "Question Number"},
+                 title=f"Scores by Question - {test_label}",
+                 range_y=[0, 5.5])
+    fig.add_hline(y=5, line_dash="dash", line_color="green", annotation_text="Max Score")
+    return fig.to_dict()
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def trend_spec(prn, subject, version, _df):
+    fig = px.line(_df, x="Date", y=["Percentage", "MA_3"],
+                  title="Performance Trend Analysis",
+                  labels={"value": "Score (%)", "Date": "Test Date", "variable": "Metric"},
+                  color_discrete_map={"Percentage": "royalblue", "MA_3": "firebrick"})
+    fig.update_layout(
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        yaxis=dict(range=[0, 105])
+    )
+    return fig.to_dict()
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def distribution_spec(prn, subject, version, _df):
+    fig = px.histogram(_df, x="Percentage",
+                       nbins=10,
+                       title="Distribution of Test Scores",
+                       labels={"Percentage": "Score (%)", "count": "Number of Tests"})
+    fig.update_layout(xaxis=dict(range=[0, 105]), bargap=0.2)
+    return fig.to_dict()
@@ -0,0 +1,72 @@
+import streamlit as st
+
+from score_store import load_feedback
+
+
+# Cached Mongo reads shared by the student pages. Entries are keyed on a data version, so a
+# cached page is only served while nothing it shows has changed. With the change feed live
+# (change_feed.py) the versions come from memory; otherwise one small aggregate per rerun works
+# them out. The TTL only bounds memory, not freshness.
+
+CACHE_TTL = 3600
+SYSTEM_DATABASES = ("admin", "local", "config")
+
+
+def data_version(scores_collection, prn):
+    # Changes whenever a score for this student is added or re-graded
+    row = next(scores_collection.aggregate([
+        {"$match": {"prn": prn}},
+        {"$group": {"_id": None, "count": {"$sum": 1}, "latest": {"$max": "$timestamp"}, "versions": {"$sum": "$version"}}},
+    ]), None)
+    if not row:
+        return "empty"
+    return f"{row['count']}:{row['latest']}:{row['versions']}"
+
+
+def results_version(feed, scores_collection, prn):
+    return feed.version("prn", prn) or data_version(scores_collection, prn)
+
+
+def subjects_version(feed, test_ids):
+    # None without the feed: subjects then refresh on the TTL, as test edits are rare
+    versions = [feed.version("test_def", test_id) for test_id in test_ids]
+    return None if None in versions else "|".join(versions)
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_results(prn, version, _scores_collection):
+    projection = {"_id": 0, "test_id": 1, "timestamp": 1, "total_marks": 1, "max_marks": 1,
+                  "results.question_number": 1, "results.score": 1}
+    return list(_scores_collection.find({"prn": prn}, projection))
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_result_pages(prn, test_id, version, _scores_collection):
+    # Score documents for View Test Results; feedback comes separately, on demand
+    query = {"prn": prn}
+    if test_id:
+        query["test_id"] = test_id
+    return list(_scores_collection.find(query, {"_id": 0}))
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_question_feedback(feedback_id, _feedback_collection, _score_document):
+    # Question text and feedback, fetched when a result is opened. Feedback documents are
+    # never modified, so their id alone is the cache key.
+    return load_feedback(_feedback_collection, _score_document).get("results", [])
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_test_subjects(test_ids, version, _client):
+    # Test definitions live in one database per teacher, one collection per test
+    wanted = set(test_ids)
+    test_subjects = {}
+    for db_name in _client.list_database_names():
+        if db_name.startswith(SYSTEM_DATABASES):
+            continue
+        current_db = _client[db_name]
+        for test_id in wanted.intersection(current_db.list_collection_names()):
+            test_info = current_db[test_id].find_one({}, {"_id": 0, "subject": 1})
+            if test_info and "subject" in test_info:
+                test_subjects[test_id] = test_info["subject"]
+    return test_subjects
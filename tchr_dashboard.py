@@ -5,15 +5,13 @@ from streamlit_option_menu import option_menu
 import os
 from dotenv import load_dotenv
 import bcrypt
-import fitz  # PyMuPDF
-import base64
-import re
-from dotenv import load_dotenv
-from mistralai import Mistral
-from mistralai.client import MistralClient
-import time
-import math
+import traceback
+
+from change_feed import get_change_feed, REFRESH_INTERVAL
 
+# Heavier modules (PyMuPDF, NumPy, pandas, Plotly, the Mistral SDK) are imported inside the
+# sections that use them, so login and page switches on a cold start don't pay for them.
+# `python startup_profile.py tchr_dashboard.py` reports import and first-render times.
 
 # Load environment variables
 load_dotenv()
@@ -21,6 +19,15 @@ MONGO_URI = st.secrets["MONGO_URI"]  # Securely fetch MongoDB URI from .env
 
 # Connect to MongoDB
 client = MongoClient(MONGO_URI)
+# Process-wide change-stream listener: invalidates cached tests and class statistics on any write
+feed = get_change_feed(MONGO_URI)
+
+
+@st.fragment(run_every=REFRESH_INTERVAL)
+def refresh_on_change(scope, key, seen):
+    # Reads the feed's in-memory version only; reruns the page once new data has landed
+    if feed.version(scope, key) != seen:
+        st.rerun()
 
 
 # ---------------- Streamlit UI Configuration ----------------
@@ -30,8 +37,8 @@ st.set_page_config(page_title="Teacher Dashboard", page_icon="📚", layout="wid
 with st.sidebar:
     selected = option_menu(
         menu_title="Teacher Dashboard",
-        options=["🔑Login/Signup","🏠 Home", "📝 Create New Test", "📊 Evaluate the Test"],
-        icons=["house", "file-earmark-plus", "clipboard-check"],
+        options=["🔑Login/Signup","🏠 Home", "📝 Create New Test", "📊 Evaluate the Test", "📈 Class Analytics", "⚙️ Pipeline Metrics"],
+        icons=["key", "house", "file-earmark-plus", "clipboard-check", "bar-chart-line", "speedometer2"],
         menu_icon="cast",
         default_index=1,
     )
@@ -230,6 +237,9 @@ elif selected == "📝 Create New Test":
         st.error("❌ Please log in to create tests.")
         st.stop()
 
+    from test_catalog import build_test_document, invalidate_test
+    from ocr_backends import OCR_BACKENDS
+
     teacher_name = st.session_state["teacher_name"].replace(" ", "_")  # Replace spaces with underscores
     teacher_db = client[teacher_name]  # Use sanitized name for MongoDB database
 
@@ -242,6 +252,13 @@ elif selected == "📝 Create New Test":
         questions = []
         keywords = []
 
+        # None stores no ocr_backend, so the test follows OCR_BACKEND from secrets even if it changes later
+        ocr_backend = st.selectbox(
+            "OCR engine", [None] + OCR_BACKENDS, index=0,
+            format_func=lambda name: "default (app setting)" if name is None else name,
+            help="tesseract runs locally on the server; tesseract+pixtral sends only low-confidence pages to Pixtral.",
+        )
+
         for i in range(1, 7):
             q = st.text_area(f"Question {i}")
             k = st.text_input(f"Keywords for Question {i} (comma-separated)")
@@ -254,17 +271,23 @@ elif selected == "📝 Create New Test":
             if quiz_id and subject_name and any(questions):
                 collection = teacher_db[quiz_id]  # Create a collection named after the test ID
 
-                # Insert test data
-                test_data = {
-                    "subject": subject_name,
-                    "quiz_id": quiz_id,
-                    "questions": [{"question": q, "keywords": k} for q, k in zip(questions, keywords)],
-                    "created_by": st.session_state["teacher_name"]  # Store the teacher name
-                }
+                # Store the test with numbered questions and parsed, stemmed keywords
+                test_data = build_test_document(
+                    quiz_id, subject_name, questions, keywords,
+                    created_by=st.session_state["teacher_name"],  # Store the teacher name
+                    ocr_backend=ocr_backend,
+                )
 
-                collection.insert_one(test_data)
+                # Saving the same Test ID again replaces the definition instead of adding a second one
+                collection.replace_one({"quiz_id": quiz_id}, test_data, upsert=True)
+                invalidate_test(teacher_db.name, quiz_id)
 
                 st.success(f"Test '{quiz_id}' created successfully in database '{st.session_state['teacher_name']}'!")
+
+                graded = client["student"]["student_scores"].count_documents({"test_id": quiz_id})
+                if graded:
+                    st.info(f"{graded} answer sheet(s) were already graded for this test. "
+                            "Use 'Regrade after a test edit' on the Evaluate page to update them without re-uploading.")
             else:
                 st.error("Please fill in all fields.")
 
@@ -278,6 +301,21 @@ elif selected == "📊 Evaluate the Test":
         st.error("❌ Please log in to view your tests.")
         st.stop()
 
+    from mistralai import Mistral
+    from pipeline_metrics import EvaluationMetrics, save_metrics
+    from answer_routing import SMALL_MODEL, LOW_BAND, HIGH_BAND
+    from test_catalog import get_test_definition, get_test_questions
+    from ocr_backends import DEFAULT_OCR_BACKEND, MIN_LOCAL_CONFIDENCE, build_ocr_backend
+    from prompts import get_grading_template
+    from page_analysis import MIN_INK_DENSITY, MIN_INK_STDDEV
+    from page_layout import MAX_TILES
+    from scheduler import scheduler, OCR, GRADING, DEFAULT_BUDGETS, BATCH
+    from grading_pipeline import (
+        GradingPipeline, BATCH_SIZE,
+        ALREADY_GRADED, PAGE_RENDERED, PAGE_OCR, ANSWER_SEGMENTED, QUESTION_GRADED, SAVED, SHEET_TRANSCRIBED, BATCH_GRADED,
+        REGRADE_PLANNED, SCORES_WRITTEN,
+    )
+
     # Teacher's database (replace spaces with underscores)
     teacher_name = st.session_state["teacher_name"].replace(" ", "_")
     teacher_db = client[teacher_name]
@@ -290,189 +328,73 @@ elif selected == "📊 Evaluate the Test":
     mistral_image_client = Mistral(api_key=MISTRAL_API_KEY_IMAGE)
     mistral_eval_client = Mistral(api_key=MISTRAL_API_KEY_EVALUATION)
     
-    # Import required libraries
-    from datetime import datetime
-    
     # Connect to student scores database
     students_db = client["student"]
     scores_collection = students_db["student_scores"]
+    metrics_collection = students_db["pipeline_metrics"]
 
     # Function to fetch questions and keywords from MongoDB
     def fetch_questions(test_id):
         try:
-            collection = teacher_db[test_id]
-            document = collection.find_one({}, {"_id": 0, "questions": 1})
-            return document["questions"] if document and "questions" in document else []
+            return get_test_questions(teacher_db, test_id)
         except Exception as e:
             st.error(f"❌ Error accessing test '{test_id}': {e}")
             return []
 
-    # Function to convert PDF to base64 images using PyMuPDF
-    def pdf_to_base64_pymupdf(pdf_path):
-        doc = fitz.open(pdf_path)
-        return [base64.b64encode(doc[page_num].get_pixmap().tobytes("png")).decode("utf-8") for page_num in range(len(doc))]
-
-    # Extract text from images using Mistral API for OCR
-    def extract_text_from_images(base64_images):
-        full_text = ""
-        
-        for idx, image in enumerate(base64_images):
-            # Use Mistral directly with IMAGE key
-            
-            extract_messages = [{"role": "user", "content": [
-                {"type": "text", "text": "Extract all the handwritten text from this image, preserving formatting and layout."},
-                {"type": "image_url", "image_url": f"data:image/png;base64,{image}"}
-            ]}]
-            
-            try:
-                # Using Mistral's best model for image processing
-                chat_response = mistral_image_client.chat.complete(model="pixtral-12b-2409", messages=extract_messages)
-                extracted_text = chat_response.choices[0].message.content.strip()
-                full_text += f"\nPage {idx+1}:\n{extracted_text}\n"
-               
-            except Exception as e:
-                st.error(f"Error processing image {idx+1}: {str(e)}")
-                full_text += f"\nPage {idx+1}: Error processing image\n"
-                
-            # Small delay to prevent overloading APIs
-            time.sleep(0.5)
-            
-        return full_text
-
-    # Improved function to match answers with the correct questions
-    def match_answers_to_questions(full_text, questions_data):
-        st.subheader("Matching answers to questions...")
-        grouped_answers = {}
-        
-        # First ensure questions are sorted by question number
-        questions_data = sorted(questions_data, key=lambda x: int(x.get("question_number", "0")) if x.get("question_number", "0").isdigit() else 0)
-        
-        for question in questions_data:
-            q_num = question.get("question_number", "0")
-            q_text = question.get("question", "No question found")
-            
-            # Try to find the question text in the full text
-            pattern = re.escape(q_text[:20])
-            match = re.search(pattern, full_text, re.IGNORECASE)
-            
-            if match:
-                # Extract from match to next question or end
-                start_pos = match.start()
-                end_pos = len(full_text)
-                
-                # Find the next question start if it exists
-                for next_q in questions_data:
-                    if next_q.get("question_number", "0") > q_num:
-                        next_pattern = re.escape(next_q.get("question", "")[:20])
-                        next_match = re.search(next_pattern, full_text[start_pos:], re.IGNORECASE)
-                        if next_match:
-                            end_pos = start_pos + next_match.start()
-                            break
-                
-                grouped_answers[q_num] = full_text[start_pos:end_pos].strip()
-            else:
-                grouped_answers[q_num] = "No Answer Found"
-                
-        return grouped_answers
-
-    # Function to evaluate answers using Mistral
-    def evaluate_answers(grouped_answers, questions_data, student_name, prn, test_id):
-        results = []
-        total_marks = 0
-        max_marks = len(questions_data) * 5  # Each question is out of 5 marks
-        
-        # Sort questions by question number for consistent display
-        questions_data = sorted(questions_data, key=lambda x: int(x.get("question_number", "0")) if x.get("question_number", "0").isdigit() else 0)
-        
-        for i, question in enumerate(questions_data):
-            q_num = question.get("question_number", "0")
-            q_text = question.get("question", "No question found")
-            keywords = question.get("expected_keywords", [])
-            student_answer = grouped_answers.get(q_num, "No Answer Found")
-            
-            score = 0 if student_answer == "No Answer Found" or student_answer.strip() == "" else None
-            
-            if score is None:
-                prompt = f"""
-                            As an expert educational assessor, evaluate the following student answer based on content accuracy, keyword usage, and clarity.  
-                            Be EXTREMELY lenient and generous while giving marks to encourage student learning.  
-                            Use a minimum score of 3 and maximum of 5, even for minimal or partially correct answers.
-                            If the student has made any attempt at all, the minimum score should be 3.
-                            If the answer has some relevance to the topic, give at least 4 marks.
-                            Only give less than 3 marks if the answer is completely blank or entirely unrelated.
-                            Give same marking for same answer content everytime.
-
-                            QUESTION {q_num}: {q_text}
-
-                            EXPECTED KEYWORDS: {', '.join(keywords)}
-
-                            STUDENT ANSWER: {student_answer}
-
-                            Evaluation Criteria:  
-                            - Content Accuracy: Assess factual correctness and relevance with extreme leniency.  
-                            - Keyword Usage: Consider even minimal keyword matches positively.  
-                            - Clarity & Completeness: Reward any attempt at structure and coherence.  
-
-                            STRICT RESPONSE FORMAT (NO MARKING SYSTEM DISCLOSURE):  
-                            Score: [numeric score from 3-5 unless completely blank]  
-                            Feedback: [Short, 4-5 lines of encouraging feedback highlighting strengths first, then gentle suggestions]  
-                            """
-                
-                # Use Mistral API with EVALUATION key
-                eval_prompt = [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-                
-                try:
-                    # Using Mistral's best model for evaluation
-                    eval_response = mistral_eval_client.chat.complete(model="mistral-large-latest", messages=eval_prompt)
-                    evaluation_result = eval_response.choices[0].message.content
-                except Exception as e:
-                    st.error(f"Error evaluating question {q_num}: {str(e)}")
-                    evaluation_result = "Error in evaluation process. Score: 0"
-                    score = 0
-                
-               
-                # Extract score using regex
-                if score is None:  # Only if we haven't set it due to error
-                    score_match = re.search(r'Score:\s*(\d+\.?\d*)', evaluation_result)
-                    if score_match:
-                        raw_score = float(score_match.group(1))
-                        # Ensure minimum of 3 unless blank
-                        score = max(3, math.ceil(raw_score))
-                    else:
-                        score = 3  # Default to minimum score if parsing fails
-                
-            total_marks += score
-            
-            results.append({
-                "question_number": q_num, 
-                "question": q_text, 
-                "evaluation": evaluation_result, 
-                "score": score
-            })
-            
-            # Display with improved formatting
-            st.subheader(f"Question {i+1} (ID: {q_num})")
-            st.markdown(f"{q_text}")
-            st.markdown(f"Score: {score}/5")
-            st.markdown(evaluation_result)
-        
-        # Save to MongoDB
-        scores_collection.insert_one({
-            "test_id": test_id,
-            "student_name": student_name,
-            "prn": prn,
-            "results": results,
-            "total_marks": total_marks,
-            "max_marks": max_marks,
-            "timestamp": datetime.now()
-        })
-        
-        st.success(f"Evaluation results saved successfully! Total Marks: {total_marks}/{max_marks}")
+    # OCR, segmentation, grading and saving live in grading_pipeline.py; everything below is configuration
+    # Thresholds for skipping blank pages before OCR, the versioned grading prompt (see prompts.py),
+    # the routing bands, the cheaper model used for confident answers and the number of layout tiles
+    # per page (1 sends whole pages) are all configurable through secrets
+    grading_template = get_grading_template(st.secrets.get("GRADING_PROMPT_VERSION"))
+    pipeline = GradingPipeline(
+        mistral_image_client,
+        mistral_eval_client,
+        students_db,
+        grading_template,
+        teacher=teacher_name,
+        min_ink_density=float(st.secrets.get("MIN_INK_DENSITY", MIN_INK_DENSITY)),
+        min_ink_stddev=float(st.secrets.get("MIN_INK_STDDEV", MIN_INK_STDDEV)),
+        routing_low=float(st.secrets.get("ROUTING_LOW_BAND", LOW_BAND)),
+        routing_high=float(st.secrets.get("ROUTING_HIGH_BAND", HIGH_BAND)),
+        small_model=st.secrets.get("SMALL_GRADING_MODEL", SMALL_MODEL),
+        max_tiles=int(st.secrets.get("MAX_TILES_PER_PAGE", MAX_TILES)),
+    )
+    pipeline.ensure_indexes()
+
+    # OCR engine per test, falling back to OCR_BACKEND from secrets and then Pixtral
+    def pipeline_for_test(test_id):
+        definition = get_test_definition(teacher_db, test_id) or {}
+        backend_name = definition.get("ocr_backend") or st.secrets.get("OCR_BACKEND", DEFAULT_OCR_BACKEND)
+        try:
+            backend = build_ocr_backend(
+                backend_name, mistral_image_client,
+                float(st.secrets.get("MIN_LOCAL_OCR_CONFIDENCE", MIN_LOCAL_CONFIDENCE)),
+            )
+        except RuntimeError as e:
+            st.warning(f"OCR engine '{backend_name}' is unavailable ({e}); using Pixtral.")
+            backend = build_ocr_backend(DEFAULT_OCR_BACKEND, mistral_image_client)
+        return pipeline.with_ocr_backend(backend)
+
+    # API calls from every session share one concurrency budget per resource; teachers get
+    # equal shares unless TEACHER_WEIGHTS in secrets says otherwise
+    scheduler.set_budget(OCR, st.secrets.get("OCR_CONCURRENCY", DEFAULT_BUDGETS[OCR]))
+    scheduler.set_budget(GRADING, st.secrets.get("GRADING_CONCURRENCY", DEFAULT_BUDGETS[GRADING]))
+    scheduler.set_weight(teacher_name, st.secrets.get("TEACHER_WEIGHTS", {}).get(teacher_name, 1.0))
+
+    def show_question_result(placeholder, i, question_result):
+        with placeholder.container():
+            st.subheader(f"Question {i+1} (ID: {question_result.get('question_number')})")
+            st.markdown(question_result.get("question", ""))
+            st.markdown(f"Score: {question_result.get('score', 0)}/5")
+            st.markdown(question_result.get("evaluation", ""))
+            if question_result.get("error"):
+                st.error(f"Error evaluating question {question_result.get('question_number')}: {question_result['error']}")
+
+    def show_saved_results(saved):
+        st.warning("This answer sheet was already graded. Showing the stored result; tick 'Force regrade' to evaluate it again.")
+        for i, question_result in enumerate(saved.get("results", [])):
+            show_question_result(st.empty(), i, question_result)
+        st.success(f"Total Marks: {saved.get('total_marks', 0)}/{saved.get('max_marks', 0)}")
 
     # Streamlit UI
     st.subheader("Handwritten Answer Evaluator")
@@ -482,6 +404,7 @@ elif selected == "📊 Evaluate the Test":
     student_name = st.text_input("Enter Student Name:")
     prn = st.text_input("Enter PRN Number:")
     uploaded_answers = st.file_uploader("Upload Answer Sheet (PDF)", type=["pdf"])
+    force_regrade = st.checkbox("Force regrade", help="Evaluate again even if this sheet was already graded for this student.")
 
     
 
@@ -490,27 +413,439 @@ elif selected == "📊 Evaluate the Test":
             st.error("Please fill all fields and upload an answer sheet.")
         else:
             try:
-                with st.spinner("Processing..."):
-                    pdf_path = "uploaded_answers.pdf"
-                    with open(pdf_path, "wb") as f:
-                        f.write(uploaded_answers.read())
-                    
+                metrics = EvaluationMetrics(test_id, prn, teacher=teacher_name)
+                metrics.labels["prompt_version"] = grading_template.version
+
+                with metrics.stage("fetch_questions"):
                     questions_data = fetch_questions(test_id)
-                    
-                    if not questions_data:
-                        st.error("No questions found in the database. Please check MongoDB entries.")
-                    else:
-                        st.info("Converting PDF to images...")
-                        base64_images = pdf_to_base64_pymupdf(pdf_path)
-                        
-                        st.info("Extracting text from images...")
-                        full_text = extract_text_from_images(base64_images)
-                        
-                        st.info("Matching answers to questions...")
-                        grouped_answers = match_answers_to_questions(full_text, questions_data)
-                        
-                        st.info("Evaluating answers...")
-                        evaluate_answers(grouped_answers, questions_data, student_name, prn, test_id)
+
+                if not questions_data:
+                    st.error("No questions found in the database. Please check MongoDB entries.")
+                else:
+                    # Results are drawn as each pipeline event arrives instead of after the whole sheet.
+                    # Progress: rendering 0-10%, OCR 10-60%, segmentation 60-65%, grading 65-100%.
+                    progress = st.progress(0.0, text="Converting PDF to images...")
+                    answer_placeholders = []
+                    ocr_pages, ocr_done, graded = 0, 0, 0
+
+                    # Streamlit already holds the upload in memory; no temp file needed
+                    pdf_bytes = uploaded_answers.getvalue()
+                    sheet_pipeline = pipeline_for_test(test_id)
+                    metrics.labels["ocr_backend"] = sheet_pipeline.ocr_backend.name
+                    for update in sheet_pipeline.evaluate(pdf_bytes, questions_data, test_id, student_name, prn, metrics, force_regrade):
+                        kind = update["event"]
+                        if kind == ALREADY_GRADED:
+                            progress.empty()
+                            show_saved_results(update["score"])
+
+                        elif kind == PAGE_RENDERED:
+                            ocr_pages += update["status"] == "ok"
+                            progress.progress(0.1 * (update["page"] + 1) / update["total"],
+                                              text=f"Rendered page {update['page']+1} of {update['total']}")
+                            if update["page"] + 1 == update["total"]:
+                                skipped = update["total"] - ocr_pages
+                                if skipped:
+                                    st.info(f"Skipped OCR for {skipped} blank or duplicate page(s).")
+
+                        elif kind == PAGE_OCR:
+                            ocr_done += 1
+                            if "error" in update:
+                                st.error(f"Error processing image {update['page']+1}: {update['error']}")
+                            progress.progress(0.1 + 0.5 * ocr_done / max(ocr_pages, 1),
+                                              text=f"Extracted text from {ocr_done} of {ocr_pages} page(s)")
+
+                        elif kind == ANSWER_SEGMENTED:
+                            placeholder = st.empty()
+                            placeholder.info(f"Question {len(answer_placeholders)+1} (ID: {update['question_number']}): "
+                                             + ("grading..." if update["found"] else "no answer found"))
+                            answer_placeholders.append(placeholder)
+                            progress.progress(0.65, text="Evaluating answers...")
+
+                        elif kind == QUESTION_GRADED:
+                            graded += 1
+                            show_question_result(answer_placeholders[update["index"]], update["index"], update["result"])
+                            progress.progress(0.65 + 0.35 * graded / update["total"],
+                                              text=f"Graded {graded} of {update['total']} question(s)")
+
+                        elif kind == SAVED:
+                            progress.progress(1.0, text="Done")
+                            st.success(f"Evaluation results saved successfully! Total Marks: {update['total_marks']}/{update['max_marks']}")
+
+                    metrics_doc = save_metrics(metrics_collection, metrics)
+                    with st.expander("Pipeline metrics for this sheet"):
+                        st.json({k: v for k, v in metrics_doc.items() if k != "_id"}, expanded=False)
+            except Exception as e:
+                st.error(f"An error occurred: {e}")
+                st.error(traceback.format_exc())
+
+    # ---- Whole class, question-major ----
+    with st.expander("📚 Evaluate a whole class"):
+        st.write(
+            "Upload every sheet for one test. Each question is graded for several students per request, "
+            "so the rubric is shared and sent once per batch. Name files `<PRN>_<Student Name>.pdf`."
+        )
+        class_test_id = st.text_input("Test ID", key="class_test_id")
+        class_files = st.file_uploader("Answer sheets (PDF)", type=["pdf"], accept_multiple_files=True, key="class_files")
+        batch_size = st.number_input("Students per request", min_value=1, max_value=20, value=BATCH_SIZE)
+        class_force_regrade = st.checkbox("Force regrade", key="class_force_regrade")
+
+        if st.button("Evaluate class") and class_test_id and class_files:
+            try:
+                questions_data = fetch_questions(class_test_id)
+                if not questions_data:
+                    st.error("No questions found in the database. Please check MongoDB entries.")
+                else:
+                    sheets = []
+                    for uploaded in class_files:
+                        stem = uploaded.name.rsplit(".", 1)[0]
+                        sheet_prn, _, sheet_name = stem.partition("_")
+                        sheets.append({
+                            "prn": sheet_prn,
+                            "student_name": sheet_name.replace("_", " ") or sheet_prn,
+                            "pdf_bytes": uploaded.getvalue(),
+                        })
+
+                    # Transcription 0-50%, grading 50-100%; bulk runs queue behind interactive single sheets
+                    progress = st.progress(0.0, text="Transcribing answer sheets...")
+                    class_rows = []
+                    for update in pipeline_for_test(class_test_id).with_priority(BATCH).evaluate_class(
+                        sheets, questions_data, class_test_id, int(batch_size), class_force_regrade
+                    ):
+                        kind = update["event"]
+                        if kind == SHEET_TRANSCRIBED:
+                            progress.progress(0.5 * (update["index"] + 1) / update["total"],
+                                              text=f"Transcribed {update['index']+1} of {update['total']} sheet(s)")
+                        elif kind == BATCH_GRADED:
+                            progress.progress(0.5 + 0.5 * update["done"] / update["total"],
+                                              text=f"Graded {update['done']} of {update['total']} batch(es)")
+                        elif kind == ALREADY_GRADED:
+                            save_metrics(metrics_collection, update["metrics"])
+                            class_rows.append({"PRN": update["prn"], "Total Marks": update["score"].get("total_marks", 0),
+                                               "Max Marks": update["score"].get("max_marks", 0), "Status": "already graded"})
+                        elif kind == SAVED:
+                            save_metrics(metrics_collection, update["metrics"])
+                            class_rows.append({"PRN": update["prn"], "Total Marks": update["total_marks"],
+                                               "Max Marks": update["max_marks"], "Status": "graded"})
+
+                    progress.progress(1.0, text="Done")
+                    st.dataframe(class_rows, use_container_width=True, hide_index=True)
             except Exception as e:
                 st.error(f"An error occurred: {e}")
                 st.error(traceback.format_exc())
+
+    # ---- Regrade after a test edit ----
+    with st.expander("♻️ Regrade after a test edit"):
+        st.write(
+            "Updates stored scores to the current test definition using the saved transcripts. "
+            "Only questions whose wording, keywords or segmented answer changed are graded again; no OCR is run."
+        )
+        regrade_test_id = st.text_input("Test ID", key="regrade_test_id")
+        if st.button("Regrade") and regrade_test_id:
+            try:
+                questions_data = fetch_questions(regrade_test_id)
+                if not questions_data:
+                    st.error("No questions found in the database. Please check MongoDB entries.")
+                else:
+                    progress = st.progress(0.0, text="Comparing stored scores with the test definition...")
+                    for update in pipeline.with_priority(BATCH).regrade_test(questions_data, regrade_test_id, BATCH_SIZE):
+                        kind = update["event"]
+                        if kind == REGRADE_PLANNED:
+                            if update["skipped"]:
+                                st.warning(f"{len(update['skipped'])} sheet(s) were graded before transcripts were stored "
+                                           f"and need re-uploading: {', '.join(update['skipped'])}")
+                            if not update["students"]:
+                                progress.progress(1.0, text="All stored scores already match this test definition.")
+                            else:
+                                st.info(f"Regrading {update['answers']} answer(s) for {update['students']} student(s); "
+                                        f"{update['resegmented']} transcript(s) re-segmented.")
+                        elif kind == BATCH_GRADED:
+                            progress.progress(0.9 * update["done"] / update["total"],
+                                              text=f"Graded {update['done']} of {update['total']} batch(es)")
+                        elif kind == SCORES_WRITTEN:
+                            progress.progress(0.9 + 0.1 * update["written"] / update["total"],
+                                              text=f"Saved {update['written']} of {update['total']} score(s)")
+                        elif kind == SAVED:
+                            for sheet_metrics in update["metrics"]:
+                                save_metrics(metrics_collection, sheet_metrics)
+                            st.success(f"Updated {update['students']} score(s).")
+            except Exception as e:
+                st.error(f"An error occurred: {e}")
+                st.error(traceback.format_exc())
+
+    # ---- Class keyword coverage ----
+    with st.expander("📐 Class keyword coverage"):
+        st.write("Share of each question's keywords found in every graded student's answer.")
+        coverage_test_id = st.text_input("Test ID", key="coverage_test_id")
+        if st.button("Compute coverage") and coverage_test_id:
+            import pandas as pd
+            from keyword_coverage import coverage_matrix, load_class_answers
+
+            students, question_numbers, matrix = coverage_matrix(
+                load_class_answers(scores_collection, students_db["student_feedback"], coverage_test_id), fetch_questions(coverage_test_id)
+            )
+            if not students:
+                st.info("No graded answers stored for this test yet.")
+            else:
+                coverage_df = pd.DataFrame(matrix * 100, index=students, columns=[f"Q{q}" for q in question_numbers])
+                st.dataframe(coverage_df.round(1), use_container_width=True)
+                st.caption("Class mean per question (%)")
+                st.dataframe(coverage_df.mean().round(1).to_frame("Mean coverage").T, use_container_width=True)
+
+
+# -------------------- Class Analytics Section --------------------
+elif selected == "📈 Class Analytics":
+    st.title("📈 Class Analytics")
+    st.write("Score distribution, question difficulty and outliers for a test.")
+
+    # Ensure teacher is logged in
+    if "teacher_name" not in st.session_state or not st.session_state["teacher_name"]:
+        st.error("❌ Please log in to view class analytics.")
+        st.stop()
+
+    import pandas as pd
+    import plotly.express as px
+    from datetime import datetime, timedelta
+    from class_analytics import get_test_statistics, OUTLIER_Z
+    from score_export import export_query, export_scores, FORMATS
+
+    teacher_name = st.session_state["teacher_name"].replace(" ", "_")
+    teacher_db = client[teacher_name]
+    scores_collection = client["student"]["student_scores"]
+
+    test_ids = sorted(teacher_db.list_collection_names())
+    if not test_ids:
+        st.info("No tests found. Create a new test in the 'Create New Test' section.")
+        st.stop()
+
+    selected_test = st.selectbox("Select Test", test_ids)
+    if feed.live:
+        refresh_on_change("test", selected_test, feed.version("test", selected_test))
+
+    # ---- Gradebook export ----
+    with st.expander("⬇️ Export results"):
+        export_scope = st.radio("Rows", ["Selected test", "All my tests in a date range"], horizontal=True, key="export_scope")
+        if export_scope == "Selected test":
+            export_filter = export_query([selected_test])
+            export_name = selected_test
+        else:
+            col1, col2 = st.columns(2)
+            start_date = col1.date_input("From", datetime.now().date() - timedelta(days=30), key="export_from")
+            end_date = col2.date_input("To", datetime.now().date(), key="export_to")
+            export_filter = export_query(
+                test_ids, datetime.combine(start_date, datetime.min.time()),
+                datetime.combine(end_date + timedelta(days=1), datetime.min.time()),
+            )
+            export_name = f"{teacher_name}_{start_date}_{end_date}"
+        export_format = st.radio("Format", list(FORMATS), horizontal=True, key="export_format")
+        extension, mime = FORMATS[export_format]
+        # Built only when clicked: streamed from the database into a temporary file, sent as bytes
+        st.download_button(
+            f"Download {export_format}",
+            lambda: export_scores(scores_collection, export_filter, extension),
+            file_name=f"{export_name}.{extension}",
+            mime=mime,
+        )
+    stats = get_test_statistics(scores_collection, selected_test)
+    if not stats:
+        st.info("No graded answer sheets for this test yet.")
+        st.stop()
+
+    # ---- Summary ----
+    summary = stats["summary"]
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Students", summary["students"])
+    col2.metric("Mean", f"{summary['mean']:.1f}%")
+    col3.metric("Std. deviation", f"{summary['stddev']:.1f}")
+    col4.metric("Min / Max", f"{summary['min']:.0f}% / {summary['max']:.0f}%")
+    col5.metric("Median", f"{summary['median']:.1f}%" if summary["median"] is not None else "N/A")
+    if summary["p25"] is not None:
+        st.caption(f"25th percentile: {summary['p25']:.1f}% · 75th percentile: {summary['p75']:.1f}% · 90th percentile: {summary['p90']:.1f}%")
+
+    col1, col2 = st.columns(2)
+
+    # ---- Score distribution ----
+    with col1:
+        distribution_df = pd.DataFrame(stats["distribution"])
+        fig = px.bar(distribution_df, x="bucket", y="students",
+                     title="Score Distribution",
+                     labels={"bucket": "Score (%)", "students": "Students"})
+        st.plotly_chart(fig, use_container_width=True)
+
+    # ---- Per-question performance ----
+    with col2:
+        questions_df = pd.DataFrame(stats["questions"])
+        if not questions_df.empty:
+            questions_df["Question"] = "Q" + questions_df["question_number"].astype(str)
+            fig = px.bar(questions_df, x="Question", y="mean", error_y="stddev",
+                         title="Mean Score by Question",
+                         labels={"mean": "Mean score (out of 5)"},
+                         range_y=[0, 5.5])
+            st.plotly_chart(fig, use_container_width=True)
+
+    if not questions_df.empty:
+        st.dataframe(
+            questions_df[["Question", "mean", "variance", "answered", "students"]]
+            .rename(columns={"mean": "Mean", "variance": "Variance", "answered": "Answered", "students": "Students"})
+            .set_index("Question").round(2),
+            use_container_width=True,
+        )
+
+    # ---- Outliers ----
+    st.subheader("🎯 Outlier Students")
+    if stats["outliers"]:
+        st.write(f"Students more than {OUTLIER_Z:g} standard deviations from the class mean.")
+        st.dataframe(pd.DataFrame(stats["outliers"]).round(2), use_container_width=True)
+    else:
+        st.info("No outliers for this test.")
+
+
+# -------------------- Pipeline Metrics Section --------------------
+elif selected == "⚙️ Pipeline Metrics":
+    st.title("⚙️ Pipeline Metrics")
+    st.write("Throughput, latency and cost of the grading pipeline.")
+
+    # Ensure teacher is logged in
+    if "teacher_name" not in st.session_state or not st.session_state["teacher_name"]:
+        st.error("❌ Please log in to view pipeline metrics.")
+        st.stop()
+
+    import pandas as pd
+    from datetime import datetime, timedelta
+    from pipeline_metrics import (
+        collect_totals, render_openmetrics, estimate_routing_savings, estimate_latency_savings, route_latencies,
+        sheets_per_hour, latency_percentiles, per_sheet_summary, prompt_template_report, grading_mode_report,
+    )
+    from prompts import GRADING_TEMPLATES
+    from test_catalog import test_cache
+    from scheduler import scheduler
+
+    teacher_name = st.session_state["teacher_name"].replace(" ", "_")
+    metrics_collection = client["student"]["pipeline_metrics"]
+
+    windows = {
+        "Last hour": timedelta(hours=1),
+        "Last 24 hours": timedelta(days=1),
+        "Last 7 days": timedelta(days=7),
+        "Last 30 days": timedelta(days=30),
+        "All time": None,
+    }
+    col1, col2 = st.columns(2)
+    with col1:
+        window_label = st.selectbox("Time window", list(windows.keys()), index=1)
+    with col2:
+        scope = st.radio("Scope", ["My evaluations", "All teachers"], horizontal=True)
+
+    since = datetime.now() - windows[window_label] if windows[window_label] else None
+    teacher_filter = teacher_name if scope == "My evaluations" else None
+
+    summary = per_sheet_summary(metrics_collection, since, teacher_filter)
+    if not summary:
+        st.info("No evaluations recorded in this window yet.")
+        st.stop()
+
+    # ---- Headline numbers ----
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Sheets graded", summary["sheets"])
+    col2.metric("Avg time per sheet", f"{summary['avg_seconds']:.1f}s")
+    col3.metric("API calls per sheet", f"{summary['api_calls_per_sheet']:.1f}")
+    col4.metric("Tokens per sheet", f"{summary['tokens_per_sheet']:.0f}")
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Cost per sheet", f"${summary['cost_per_sheet']:.4f}")
+    col2.metric("Cache hit rate", f"{summary['cache_hit_rate'] * 100:.1f}%")
+    col3.metric("Retry rate", f"{summary['retry_rate'] * 100:.1f}%")
+    col4.metric("Error rate", f"{summary['error_rate'] * 100:.1f}%")
+
+    st.caption(f"Pages per sheet: {summary['pages_per_sheet']:.1f} · Blank or duplicate pages skipped before OCR per sheet: {summary['ocr_skipped_per_sheet']:.1f} · Pages read by local OCR per sheet: {summary['ocr_local_per_sheet']:.1f}")
+
+    # ---- Throughput ----
+    st.subheader("📈 Sheets Graded per Hour")
+    hourly = sheets_per_hour(metrics_collection, since, teacher_filter)
+    if hourly:
+        st.bar_chart(pd.DataFrame(hourly).set_index("hour")["sheets"])
+
+    # ---- Latency ----
+    st.subheader("⏱️ Latency Percentiles (seconds)")
+    try:
+        percentiles = latency_percentiles(metrics_collection, since, teacher_filter)
+    except pymongo.errors.OperationFailure as e:
+        percentiles = []
+        st.warning(f"Latency percentiles need MongoDB 7.0 or newer: {e}")
+    if percentiles:
+        st.dataframe(pd.DataFrame(percentiles).set_index("stage").round(2), use_container_width=True)
+
+    # ---- Model routing ----
+    st.subheader("🔀 Answer Routing")
+    totals = collect_totals(metrics_collection, {**({"teacher": teacher_filter} if teacher_filter else {}), **({"timestamp": {"$gte": since}} if since else {})})
+    routing = summary["routing"]
+    if sum(routing.values()):
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            st.bar_chart(pd.Series(routing, name="answers"))
+        with col2:
+            st.metric("Answers not sent to the large model", f"{(1 - routing['large'] / sum(routing.values())) * 100:.1f}%")
+            st.metric("Estimated savings", f"${estimate_routing_savings(totals):.4f}")
+            st.metric("Estimated grading time saved", f"{estimate_latency_savings(totals):.1f}s")
+        latencies = route_latencies(totals)
+        if latencies:
+            st.caption("Average grading time per answer: " + ", ".join(
+                f"{route} {seconds * 1000:.1f} ms" for route, seconds in latencies.items()
+            ))
+
+    # ---- Prompt templates ----
+    st.subheader("🧾 Grading Prompt Templates")
+    st.dataframe(
+        pd.DataFrame([
+            {"version": version, "static_tokens_per_question": template.static_tokens()}
+            for version, template in GRADING_TEMPLATES.items()
+        ]).set_index("version"),
+        use_container_width=True,
+    )
+    template_rows = prompt_template_report(metrics_collection, since, teacher_filter)
+    if template_rows:
+        st.dataframe(pd.DataFrame(template_rows).set_index("version").round(2), use_container_width=True)
+
+    # ---- Grading modes ----
+    st.subheader("📚 Per-Sheet vs Question-Major Grading")
+    mode_rows = grading_mode_report(metrics_collection, since, teacher_filter)
+    if mode_rows:
+        st.dataframe(pd.DataFrame(mode_rows).set_index("mode").round(4), use_container_width=True)
+        st.caption("Batch requests are charged to students in equal shares, so per-sheet values can be fractional.")
+
+    # ---- In-process caches ----
+    st.subheader("🗄️ Test Definition Cache")
+    cache_stats = test_cache.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Cached tests", f"{cache_stats['size']}/{cache_stats['maxsize']}")
+    col2.metric("Hits", cache_stats["hits"])
+    col3.metric("Misses", cache_stats["misses"])
+    col4.metric("Hit rate", f"{cache_stats['hit_rate'] * 100:.1f}%")
+
+    feed_stats = feed.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Change feed", "live" if feed_stats["live"] else "unavailable" if not feed_stats["available"] else "reconnecting")
+    col2.metric("Events", feed_stats["events"])
+    col3.metric("Invalidations", feed_stats["invalidations"])
+    col4.metric("Reconnects", feed_stats["reconnects"])
+    if not feed_stats["live"]:
+        st.caption(f"Without the change feed, cached tests expire after their TTL. Last error: {feed_stats['error']}")
+
+    # ---- Shared API scheduler ----
+    st.subheader("🚦 API Scheduler")
+    st.caption(f"Average queue wait per sheet in this window: {summary['queue_wait_per_sheet']:.1f}s")
+    for resource, resource_stats in scheduler.stats().items():
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric(f"{resource.upper()} running", f"{resource_stats['running']}/{resource_stats['budget']}")
+        col2.metric("Queued", resource_stats["queued"])
+        col3.metric("Wait p50", f"{resource_stats['wait_p50']:.2f}s")
+        col4.metric("Wait p95", f"{resource_stats['wait_p95']:.2f}s")
+        if resource_stats["queues"]:
+            st.dataframe(pd.DataFrame(resource_stats["queues"]), use_container_width=True, hide_index=True)
+
+    # ---- Export ----
+    st.download_button(
+        "Download OpenMetrics snapshot",
+        render_openmetrics(collect_totals(metrics_collection, {"teacher": teacher_filter} if teacher_filter else None)),
+        file_name="grading_metrics.txt",
+        mime="text/plain",
+    )
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import re
+
+from answer_routing import as_keyword_list, tokenize
+from caching import TTLCache
+
+
+# Test documents written by "Create New Test" from this version on carry compiled
+# questions; older documents (raw comma-separated keywords, no numbers) are compiled on load.
+SCHEMA_VERSION = 2
+ANCHOR_PREFIX_CHARS = 20
+
+
+def question_anchor(q_num, question_text):
+    # Matches "Q1", "Q.1", "Question 1", "Ans 1" markers or the first words of the question
+    markers = rf"\b(?:Q(?:uestion)?|Ans(?:wer)?)\s*\.?\s*{re.escape(str(q_num))}\b"
+    prefix = " ".join(question_text.split())[:ANCHOR_PREFIX_CHARS]
+    if prefix:
+        return rf"(?:{markers}|{re.escape(prefix)})"
+    return markers
+
+
+def compile_questions(questions, keywords=None):
+    # Accepts either the form's parallel lists or stored question dicts.
+    # Empty slots are dropped; question numbers follow the slot the teacher used.
+    if keywords is not None:
+        questions = [{"question": q, "keywords": k} for q, k in zip(questions, keywords)]
+
+    compiled = []
+    for slot, question in enumerate(questions, start=1):
+        text = (question.get("question") or "").strip()
+        if not text:
+            continue
+        q_num = str(question.get("question_number") or slot)
+        keyword_list = [keyword.lower() for keyword in as_keyword_list(question.get("keywords"))]
+        compiled.append({
+            "question_number": q_num,
+            "question": text,
+            "keywords": keyword_list,
+            "keyword_terms": [sorted(set(tokenize(keyword))) for keyword in keyword_list],
+            "anchor": question_anchor(q_num, text),
+        })
+    return compiled
+
+
+def question_fingerprint(question):
+    # Changes whenever a question's wording or keywords change, i.e. when its grades go stale
+    payload = json.dumps([question["question"], question["keywords"]], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def anchors_fingerprint(questions):
+    # Changes whenever answers would be cut differently out of a transcript
+    payload = json.dumps([(question["question_number"], question["anchor"]) for question in questions])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def build_test_document(quiz_id, subject, questions, keywords, created_by, ocr_backend=None):
+    document = {
+        "schema_version": SCHEMA_VERSION,
+        "subject": subject,
+        "quiz_id": quiz_id,
+        "questions": compile_questions(questions, keywords),
+        "created_by": created_by,
+    }
+    if ocr_backend:
+        # Per-test OCR engine (see ocr_backends.py); absent means the app default
+        document["ocr_backend"] = ocr_backend
+    return document
+
+
+def load_questions(document):
+    # Ready-to-use questions for the evaluation hot path, with anchor regexes compiled
+    if not document:
+        return []
+    questions = document.get("questions", [])
+    if document.get("schema_version") != SCHEMA_VERSION:
+        questions = compile_questions(questions)
+    return [
+        {**question, "anchor_re": re.compile(question["anchor"], re.IGNORECASE)}
+        for question in questions
+    ]
+
+
+# ---------------- In-process cache ----------------
+
+# Compiled test definitions keyed by (teacher database, test_id). Shared by every page and
+# worker in the process. change_feed.py invalidates entries on any edit, from this app or
+# elsewhere; while it is not live, entries expire after TEST_CACHE_TTL seconds instead.
+TEST_CACHE_SIZE = 256
+TEST_CACHE_TTL = 600
+test_cache = TTLCache(maxsize=TEST_CACHE_SIZE, ttl=TEST_CACHE_TTL)
+
+
+def get_test_definition(teacher_db, test_id):
+    # {"questions": [...], "ocr_backend": name or None}, or None for an unknown test
+    def load():
+        document = teacher_db[test_id].find_one({}, {"_id": 0})
+        questions = load_questions(document)
+        if not questions:
+            return None
+        return {"questions": questions, "ocr_backend": document.get("ocr_backend")}
+
+    return test_cache.get_or_load((teacher_db.name, test_id), load)
+
+
+def get_test_questions(teacher_db, test_id):
+    definition = get_test_definition(teacher_db, test_id)
+    return definition["questions"] if definition else []
+
+
+def invalidate_test(teacher_db_name, test_id):
+    test_cache.invalidate((teacher_db_name, test_id))
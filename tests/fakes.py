@@ -0,0 +1,46 @@
+import copy
+import itertools
+import types
+
+
+# In-memory stand-ins for the few pymongo collection calls the tests reach. Queries are
+# equality matches on top-level fields; a None value also matches a missing field, as in MongoDB.
+
+_ids = itertools.count(1)
+
+
+def _matches(document, query):
+    return all(document.get(field) == value for field, value in query.items())
+
+
+class FakeCollection:
+
+    def __init__(self, documents=()):
+        self.documents = []
+        for document in documents:
+            self.insert_one(document)
+
+    def insert_one(self, document):
+        document.setdefault("_id", next(_ids))
+        self.documents.append(copy.deepcopy(document))
+        return document["_id"]
+
+    def find(self, query=None):
+        return [copy.deepcopy(d) for d in self.documents if _matches(d, query or {})]
+
+    def find_one(self, query=None, projection=None):
+        found = self.find(query)
+        return found[0] if found else None
+
+
+class FakeEvalClient:
+    # Mistral client stand-in: chat.complete returns `content` and records every call
+    def __init__(self, content="Score: 4\nFeedback: Covers the main points."):
+        self.content = content
+        self.calls = []
+        self.chat = self
+
+    def complete(self, model, messages, **kwargs):
+        self.calls.append({"model": model, "messages": messages, **kwargs})
+        message = types.SimpleNamespace(content=self.content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
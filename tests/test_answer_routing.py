@@ -0,0 +1,48 @@
+from answer_routing import (
+    route_answer, local_score, normalised_answer_key, stem, ROUTE_LOCAL, ROUTE_SMALL, ROUTE_LARGE,
+)
+
+QUESTION = "Explain photosynthesis in plants."
+KEYWORDS = "chlorophyll, sunlight, carbon dioxide, glucose"
+
+
+def test_short_off_topic_answer_is_scored_locally():
+    route, signals = route_answer("I do not know.", QUESTION, KEYWORDS)
+    assert route == ROUTE_LOCAL
+    assert signals["coverage"] == 0.0
+
+
+def test_long_answer_with_little_overlap_goes_to_the_large_model():
+    answer = " ".join(["Plants are living things that grow in soil and need water every day to stay alive"] * 2)
+    route, signals = route_answer(answer, QUESTION, KEYWORDS)
+    assert signals["words"] >= 15
+    assert route == ROUTE_LARGE
+
+
+def test_answer_covering_every_keyword_goes_to_the_small_model():
+    answer = ("Photosynthesis: chlorophyll in plants absorbs sunlight and turns carbon dioxide and water "
+              "into glucose.")
+    route, signals = route_answer(answer, QUESTION, KEYWORDS)
+    assert signals["coverage"] == 1.0
+    assert route == ROUTE_SMALL
+
+
+def test_bands_are_configurable():
+    answer = "Chlorophyll absorbs sunlight."
+    assert route_answer(answer, QUESTION, KEYWORDS, low=0.0, high=0.01)[0] == ROUTE_SMALL
+    assert route_answer(answer, QUESTION, KEYWORDS, low=0.99, high=1.0)[0] == ROUTE_LOCAL
+
+
+def test_multi_word_keyword_needs_every_word():
+    assert local_score("carbon is everywhere", QUESTION, ["carbon dioxide"])["coverage"] == 0.0
+    assert local_score("carbon dioxide is a gas", QUESTION, ["carbon dioxide"])["coverage"] == 1.0
+
+
+def test_keywords_match_across_word_forms():
+    assert stem("processes") == stem("processing") == stem("processed")
+    assert local_score("the leaves absorbed light", QUESTION, ["absorbs"])["coverage"] == 1.0
+
+
+def test_near_duplicate_answers_share_a_cache_key():
+    assert normalised_answer_key(1, "Light  energy,\nChlorophyll!") == normalised_answer_key("1", "light energy chlorophyll")
+    assert normalised_answer_key(1, "light") != normalised_answer_key(2, "light")
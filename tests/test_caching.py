@@ -0,0 +1,65 @@
+import time
+
+from caching import TTLCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=None)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = TTLCache(maxsize=4, ttl=60)
+    cache.set("a", 1)
+    now[0] += 59
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_no_ttl_never_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = TTLCache(maxsize=4, ttl=None)
+    cache.set("a", 1)
+    now[0] += 10 ** 9
+    assert cache.get("a") == 1
+
+
+def test_get_or_load_only_loads_on_a_miss():
+    cache = TTLCache(maxsize=4, ttl=None)
+    loads = []
+    assert cache.get_or_load("a", lambda: loads.append(1) or "value") == "value"
+    assert cache.get_or_load("a", lambda: loads.append(1) or "other") == "value"
+    assert len(loads) == 1
+    # None is not cached, so a missing test is looked up again next time
+    assert cache.get_or_load("missing", lambda: None) is None
+    assert cache.stats()["size"] == 1
+
+
+def test_invalidation():
+    cache = TTLCache(maxsize=8, ttl=None)
+    for key in [("t1", "A"), ("t1", "B"), ("t2", "A")]:
+        cache.set(key, 1)
+    assert cache.invalidate(("t2", "A"))
+    assert not cache.invalidate(("t2", "A"))
+    assert cache.invalidate_where(lambda key: key[0] == "t1") == 2
+    assert cache.stats()["size"] == 0
+
+
+def test_stats_count_hits_and_misses():
+    cache = TTLCache(maxsize=4, ttl=None)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
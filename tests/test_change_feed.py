@@ -0,0 +1,89 @@
+import pytest
+
+import change_feed
+from change_feed import ChangeFeed
+from class_analytics import analytics_cache
+from test_catalog import test_cache
+
+
+@pytest.fixture
+def feed():
+    # Never started: changes are fed to _apply directly, as the listener thread would
+    feed = ChangeFeed("mongodb://unused", ttl_caches=[])
+    feed.live = True
+    analytics_cache.clear()
+    test_cache.clear()
+    yield feed
+    analytics_cache.clear()
+    test_cache.clear()
+
+
+def score_change(prn, test_id, operation="insert"):
+    return {"operationType": operation, "ns": {"db": "student", "coll": "student_scores"},
+            "fullDocument": {"prn": prn, "test_id": test_id}}
+
+
+def test_score_write_bumps_student_and_test(feed):
+    analytics_cache.set("T1", "stale")
+    analytics_cache.set("T2", "other test")
+    before = {key: feed.version(*key) for key in [("prn", "P1"), ("test", "T1"), ("prn", "P2"), ("test", "T2")]}
+
+    feed._apply(score_change("P1", "T1"))
+
+    assert analytics_cache.get("T1") is None
+    assert analytics_cache.get("T2") == "other test"
+    assert feed.version("prn", "P1") != before[("prn", "P1")]
+    assert feed.version("test", "T1") != before[("test", "T1")]
+    assert feed.version("prn", "P2") == before[("prn", "P2")]
+    assert feed.version("test", "T2") == before[("test", "T2")]
+
+
+def test_delete_without_document_clears_everything(feed):
+    analytics_cache.set("T1", "stale")
+    analytics_cache.set("T2", "stale")
+    before = feed.version("prn", "P9")
+
+    feed._apply({"operationType": "delete", "ns": {"db": "student", "coll": "student_scores"}})
+
+    assert analytics_cache.get("T1") is None and analytics_cache.get("T2") is None
+    assert feed.version("prn", "P9") != before
+
+
+def test_test_edit_drops_its_definition(feed):
+    test_cache.set(("teacher_a", "T1"), "stale")
+    test_cache.set(("teacher_a", "T2"), "other test")
+    before = feed.version("test_def", "T1")
+
+    feed._apply({"operationType": "update", "ns": {"db": "teacher_a", "coll": "T1"}, "fullDocument": {}})
+
+    assert test_cache.get(("teacher_a", "T1")) is None
+    assert test_cache.get(("teacher_a", "T2")) == "other test"
+    assert feed.version("test_def", "T1") != before
+    assert feed.version("test_def", "T2") == "feed:0:0"
+
+
+def test_dropped_teacher_database_drops_its_tests(feed):
+    test_cache.set(("teacher_a", "T1"), "stale")
+    test_cache.set(("teacher_b", "T1"), "other teacher")
+
+    feed._apply({"operationType": "dropDatabase", "ns": {"db": "teacher_a"}})
+
+    assert test_cache.get(("teacher_a", "T1")) is None
+    assert test_cache.get(("teacher_b", "T1")) == "other teacher"
+
+
+def test_caches_are_dropped_before_versions_move(feed, monkeypatch):
+    # A rerun woken by the new version must never find the old cache entry
+    seen = []
+    invalidate = change_feed.invalidate_test_statistics
+
+    def record(test_id):
+        seen.append(feed.version("test", test_id))
+        invalidate(test_id)
+
+    monkeypatch.setattr(change_feed, "invalidate_test_statistics", record)
+    before = feed.version("test", "T1")
+    feed._apply(score_change("P1", "T1"))
+    assert seen == [before]
+    assert feed.version("test", "T1") != before
+    assert feed.stats()["events"] == 1 and feed.stats()["invalidations"] == 1
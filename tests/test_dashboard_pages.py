@@ -0,0 +1,110 @@
+import os
+import sys
+import types
+from datetime import datetime
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+mongomock = pytest.importorskip("mongomock")
+
+import change_feed
+import streamlit_option_menu
+from score_store import split_feedback, feedback_document
+from test_catalog import build_test_document, test_cache
+
+
+# Smoke test: every sidebar page of both dashboards runs without raising, against an in-memory
+# MongoDB. Pages are picked by replacing option_menu (a custom component AppTest cannot click).
+
+TEACHER = "Smoke Teacher"
+TEACHER_PAGES = ["🔑Login/Signup", "🏠 Home", "📝 Create New Test", "📊 Evaluate the Test",
+                 "📈 Class Analytics", "⚙️ Pipeline Metrics"]
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUDENT_PAGES = ["🔑 Login/Signup", "🏠 Home", "📊 View Test Results", "📈 Performance Analytics"]
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    client = mongomock.MongoClient()
+    factory = lambda *args, **kwargs: client
+    import pymongo
+    monkeypatch.setattr(pymongo, "MongoClient", factory)
+    # The change feed needs a replica set; the pages fall back to querying without one
+    monkeypatch.setattr(change_feed, "get_change_feed", lambda uri: change_feed.ChangeFeed(uri, ttl_caches=[]))
+    # Only the Evaluate page builds clients; no call is made while it renders
+    mistralai = types.ModuleType("mistralai")
+    mistralai.Mistral = lambda api_key: types.SimpleNamespace(api_key=api_key)
+    monkeypatch.setitem(sys.modules, "mistralai", mistralai)
+    test_cache.clear()
+
+    teacher_db = client[TEACHER.replace(" ", "_")]
+    teacher_db["SMOKE1"].insert_one(build_test_document(
+        "SMOKE1", "Biology", ["What is osmosis?", "What is diffusion?"], ["water, membrane", "particles"], TEACHER,
+    ))
+    hot, payload = split_feedback({
+        "test_id": "SMOKE1", "student_name": "Smoke Student", "prn": "PRN001", "total_marks": 7, "max_marks": 10,
+        "timestamp": datetime(2025, 1, 1), "version": 1, "transcript": "Q1 water crosses a membrane",
+        "results": [
+            {"question_number": "1", "question": "What is osmosis?", "answer": "water", "evaluation": "Score: 4",
+             "score": 4},
+            {"question_number": "2", "question": "What is diffusion?", "answer": "particles", "evaluation": "Score: 3",
+             "score": 3},
+        ],
+    })
+    client["student"]["stud_metadata"].insert_one(
+        {"student_name": "Smoke Student", "prn": "PRN001", "mothers_name": "Smoke", "password": "unused"}
+    )
+    feedback = feedback_document(payload)
+    client["student"]["student_feedback"].insert_one(feedback)
+    client["student"]["student_scores"].insert_one({**hot, "feedback_id": feedback["_id"]})
+    yield client
+    test_cache.clear()
+
+
+def open_page(monkeypatch, script, page, session):
+    monkeypatch.setattr(streamlit_option_menu, "option_menu", lambda *args, **kwargs: page)
+    app = AppTest.from_file(os.path.join(REPO, script), default_timeout=60)
+    app.secrets["MONGO_URI"] = "mongodb://smoke"
+    app.secrets["MISTRAL_API_KEY_IMAGE"] = "smoke"
+    app.secrets["MISTRAL_API_KEY_EVALUATION"] = "smoke"
+    for key, value in session.items():
+        app.session_state[key] = value
+    return app.run()
+
+
+def assert_page_ran(app):
+    # Aggregation operators mongomock lacks ($percentile, $stdDevPop) need a real server;
+    # the page got as far as its first query, so that alone is not a failure
+    errors = [e for e in app.exception if not any("mongomock" in line for line in e.stack_trace)]
+    assert not errors, [e.value for e in errors]
+    if app.exception:
+        pytest.skip(f"needs a real MongoDB server: {app.exception[0].value}")
+
+
+@pytest.mark.parametrize("page", TEACHER_PAGES)
+def test_teacher_page_opens(mongo, monkeypatch, page):
+    app = open_page(monkeypatch, "tchr_dashboard.py", page, {"authenticated": True, "teacher_name": TEACHER})
+    assert not [e.value for e in app.error if "log in" in e.value]
+    assert_page_ran(app)
+
+
+@pytest.mark.parametrize("page", STUDENT_PAGES)
+def test_student_page_opens(mongo, monkeypatch, page):
+    session = {"authenticated": True, "student_name": "Smoke Student", "prn": "PRN001"}
+    app = open_page(monkeypatch, "stud_dashboard.py", page, session)
+    assert_page_ran(app)
+
+
+@pytest.mark.parametrize("choice, stored", [(None, None), ("tesseract", "tesseract")])
+def test_new_test_follows_the_app_ocr_setting_by_default(mongo, monkeypatch, choice, stored):
+    app = open_page(monkeypatch, "tchr_dashboard.py", "📝 Create New Test",
+                    {"authenticated": True, "teacher_name": TEACHER})
+    assert app.selectbox[0].value is None
+    app.text_input[0].input("OCR1")
+    app.text_input[1].input("Biology")
+    app.text_area[0].input("Explain osmosis.")
+    app.selectbox[0].select(choice)
+    app.button[0].click().run()
+    assert_page_ran(app)
+    assert mongo["Smoke_Teacher"]["OCR1"].find_one({"quiz_id": "OCR1"}).get("ocr_backend") == stored
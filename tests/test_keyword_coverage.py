@@ -0,0 +1,35 @@
+import math
+
+from scipy.sparse import issparse
+
+from keyword_coverage import build_keyword_index, term_matrix, coverage_matrix
+
+
+QUESTIONS = [
+    {"question_number": "1", "keywords": "photosynthesis, chlorophyll"},
+    {"question_number": "2", "keywords": "newton law, gravity"},
+]
+
+
+def test_term_matrix_is_sparse_presence():
+    index = build_keyword_index(QUESTIONS)
+    matrix = term_matrix(["gravity gravity gravity", "nothing relevant"], index["vocabulary"])
+    assert issparse(matrix)
+    assert matrix.shape == (2, len(index["vocabulary"]))
+    assert matrix.nnz == 1
+    assert matrix.toarray().max() == 1.0
+
+
+def test_coverage_matrix():
+    answers = [
+        ("P1", "1", "Photosynthesis happens where chlorophyll absorbs light"),
+        ("P1", "2", "Gravity pulls things down"),
+        ("P2", "2", "Newton's law of gravity"),
+    ]
+    students, question_numbers, matrix = coverage_matrix(answers, QUESTIONS)
+    assert students == ["P1", "P2"]
+    assert question_numbers == ["1", "2"]
+    assert matrix[0, 0] == 1.0
+    assert matrix[0, 1] == 0.5
+    assert math.isnan(matrix[1, 0])
+    assert matrix[1, 1] == 1.0
@@ -0,0 +1,41 @@
+import sys
+import types
+
+import pytest
+
+from ocr_backends import build_ocr_backend, PixtralBackend, TESSERACT, TESSERACT_WITH_FALLBACK, PIXTRAL
+
+
+def fake_pytesseract(installed):
+    module = types.ModuleType("pytesseract")
+
+    class TesseractNotFoundError(EnvironmentError):
+        pass
+
+    def get_tesseract_version():
+        if not installed:
+            raise TesseractNotFoundError("tesseract is not installed or it's not in your PATH")
+        return "5.3.0"
+
+    module.TesseractNotFoundError = TesseractNotFoundError
+    module.get_tesseract_version = get_tesseract_version
+    return module
+
+
+@pytest.mark.parametrize("name", [TESSERACT, TESSERACT_WITH_FALLBACK])
+def test_missing_binary_raises_so_the_dashboard_falls_back(monkeypatch, name):
+    pytest.importorskip("PIL")
+    monkeypatch.setitem(sys.modules, "pytesseract", fake_pytesseract(installed=False))
+    with pytest.raises(RuntimeError, match="binary"):
+        build_ocr_backend(name)
+
+
+def test_installed_binary_builds_the_backend(monkeypatch):
+    pytest.importorskip("PIL")
+    monkeypatch.setitem(sys.modules, "pytesseract", fake_pytesseract(installed=True))
+    backend = build_ocr_backend(TESSERACT_WITH_FALLBACK)
+    assert backend.name == f"{TESSERACT}+{PIXTRAL}"
+
+
+def test_pixtral_is_the_default():
+    assert isinstance(build_ocr_backend(PIXTRAL), PixtralBackend)
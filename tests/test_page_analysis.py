@@ -0,0 +1,108 @@
+import random
+
+import fitz
+import numpy as np
+import pytest
+
+from page_analysis import (
+    grayscale_thumbnail, analyse_page, page_fingerprint, dhash, hamming_distance, find_duplicate,
+    same_submission, _block_means, DHASH_SIZE,
+)
+
+
+def ruled_page(doc, lines):
+    # An answer-booklet page: ruled lines and a header, plus `lines` of text at (slot, words)
+    page = doc.new_page()
+    for k in range(30):
+        page.draw_line((40, 60 + k * 25), (560, 60 + k * 25), color=(0.6, 0.6, 0.9))
+    page.insert_text((40, 40), "Name: ________  PRN: ________", fontsize=12)
+    for slot, words in lines:
+        page.insert_text((50, 55 + slot * 25), "answer " * words, fontsize=13)
+    return page
+
+
+def rescan(page, rng, noise, shift=2):
+    # The page as a scanner would return it again: rendered to pixels, shifted a little and
+    # with sensor noise, then placed on a new page of its own
+    pixmap = page.get_pixmap(matrix=fitz.Matrix(2, 2), colorspace=fitz.csGRAY, alpha=False)
+    pixels = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.stride)[:, :pixmap.width]
+    pixels = np.roll(pixels.astype(float), rng.integers(-shift, shift + 1, size=2), axis=(0, 1))
+    pixels = np.clip(pixels + rng.normal(0, noise, pixels.shape), 0, 255).astype(np.uint8)
+    image = fitz.Pixmap(fitz.csGRAY, pixmap.width, pixmap.height, np.ascontiguousarray(pixels).tobytes(), False)
+    doc = fitz.open()
+    copy = doc.new_page(width=page.rect.width, height=page.rect.height)
+    copy.insert_image(copy.rect, pixmap=image)
+    return doc
+
+
+def fingerprints(doc):
+    return [page_fingerprint(analyse_page(page)) for page in doc]
+
+
+def test_block_means_match_per_pixel_average():
+    doc = fitz.open()
+    ruled_page(doc, [(3, 6), (10, 4)])
+    pixmap = grayscale_thumbnail(doc[0])
+    cols, rows = 7, 5
+    grid = _block_means(pixmap, cols, rows)
+    width, height, stride, samples = pixmap.width, pixmap.height, pixmap.stride, pixmap.samples
+    for r in range(rows):
+        for c in range(cols):
+            values = [samples[y * stride + x] for y in range(height) if y * rows // height == r
+                      for x in range(width) if x * cols // width == c]
+            assert grid[r][c] == pytest.approx(sum(values) / len(values))
+
+
+def test_dhash_size():
+    doc = fitz.open()
+    ruled_page(doc, [(0, 3)])
+    assert len(dhash(grayscale_thumbnail(doc[0]))) == DHASH_SIZE * DHASH_SIZE // 4
+
+
+def test_identical_pages_are_duplicates():
+    doc = fitz.open()
+    lines = [(2, 8), (9, 5), (15, 7)]
+    ruled_page(doc, lines)
+    ruled_page(doc, lines)
+    first, second = fingerprints(doc)
+    assert hamming_distance(first["dhash"], second["dhash"]) == 0
+    assert find_duplicate(second, [(0, first)]) == 0
+    assert same_submission([first, second], [first, second])
+
+
+@pytest.mark.parametrize("noise", [0.0, 2.0, 4.0])
+def test_rescans_of_a_page_are_duplicates(noise):
+    rng = random.Random(int(noise))
+    pixel_rng = np.random.default_rng(int(noise))
+    for _ in range(10):
+        doc = fitz.open()
+        ruled_page(doc, [(rng.randint(0, 29), rng.randint(3, 9)) for _ in range(rng.choice([2, 4, 8]))])
+        scans = [rescan(doc[0], pixel_rng, noise) for _ in range(2)]
+        first, second = (page_fingerprint(analyse_page(scan[0])) for scan in scans)
+        # Not the same render twice: an exact-match check would miss this pair
+        assert first != second
+        assert find_duplicate(second, [(0, first)]) == 0
+
+
+@pytest.mark.parametrize("n_lines", [2, 3, 4, 8])
+def test_sparse_pages_on_one_template_are_not_duplicates(n_lines):
+    rng = random.Random(n_lines)
+    for _ in range(50):
+        doc = fitz.open()
+        for _ in range(2):
+            ruled_page(doc, [(rng.randint(0, 29), rng.randint(2, 9)) for _ in range(n_lines)])
+        stats = [analyse_page(page) for page in doc]
+        first, second = (page_fingerprint(page) for page in stats)
+        if first == second or any(page["blank"] for page in stats):
+            # Both pages drew the same lines, or one would never reach duplicate detection
+            continue
+        assert find_duplicate(second, [(0, first)]) is None
+        assert not same_submission([first], [second])
+
+
+def test_records_without_fingerprints_never_match():
+    doc = fitz.open()
+    ruled_page(doc, [(4, 6)])
+    (page,) = fingerprints(doc)
+    assert not same_submission([page], [page["dhash"]])
+    assert not same_submission([page], [])
@@ -0,0 +1,101 @@
+import time
+
+import pytest
+
+from grading_pipeline import GradingPipeline
+from pipeline_metrics import (
+    EvaluationMetrics, call_with_retries, route_latencies, estimate_latency_savings, estimate_routing_savings,
+)
+from prompts import get_grading_template
+from tests.fakes import FakeEvalClient
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"Status {status_code}")
+        self.status_code = status_code
+
+
+class TransportError(Exception):
+    pass
+
+
+class ReadTimeout(TransportError):
+    pass
+
+
+def flaky(errors, result="ok"):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return fn, calls
+
+
+@pytest.mark.parametrize("error", [StatusError(429), StatusError(503), ReadTimeout(), TimeoutError(), ConnectionError()])
+def test_transient_errors_are_retried(error):
+    fn, calls = flaky([error])
+    metrics = EvaluationMetrics("T1", "P1")
+    assert call_with_retries(fn, metrics, backoff=0) == "ok"
+    assert len(calls) == 2
+    assert metrics.counters["retries"] == 1
+    assert metrics.counters["errors"] == 0
+
+
+@pytest.mark.parametrize("error", [StatusError(401), StatusError(400), KeyError("choices"), TypeError("bad")])
+def test_other_errors_are_raised_at_once(error):
+    fn, calls = flaky([error])
+    metrics = EvaluationMetrics("T1", "P1")
+    with pytest.raises(type(error)):
+        call_with_retries(fn, metrics, backoff=0)
+    assert len(calls) == 1
+    assert metrics.counters["retries"] == 0
+    assert metrics.counters["errors"] == 1
+
+
+def test_gives_up_after_the_last_attempt():
+    fn, calls = flaky([StatusError(500)] * 3)
+    with pytest.raises(StatusError):
+        call_with_retries(fn, attempts=3, backoff=0)
+    assert len(calls) == 3
+
+
+class SlowEvalClient(FakeEvalClient):
+    def complete(self, model, messages, **kwargs):
+        time.sleep(0.05)
+        return super().complete(model, messages, **kwargs)
+
+
+def test_grading_time_is_recorded_per_route():
+    students_db = {name: None for name in
+                   ("student_scores", "student_scores_history", "submission_hashes", "student_feedback")}
+    pipeline = GradingPipeline(None, SlowEvalClient(), students_db, get_grading_template())
+    question = {"question_number": "1", "question": "Explain osmosis.", "keywords": ["membrane", "water"]}
+    answer = ("Water moves across a partially permeable membrane from a dilute solution to a more "
+              "concentrated one until both sides reach the same concentration.")
+
+    metrics = EvaluationMetrics("latency-T1", "P1")
+    first = pipeline.grade_answer(question, answer, "latency-T1", metrics)
+    second = pipeline.grade_answer(question, answer, "latency-T1", metrics)
+    assert first["route"] in ("small", "large") and second["route"] == "cache"
+
+    latencies = route_latencies({"counters": metrics.counters})
+    assert latencies[first["route"]] >= 0.05
+    assert latencies["cache"] < 0.05
+
+
+def test_latency_savings_charge_each_route_its_own_time():
+    totals = {"counters": {
+        "routed_cache": 10, "routed_cache_ms": 10,
+        "routed_local": 5, "routed_local_ms": 5,
+        "routed_small": 4, "routed_small_ms": 4000,
+        "routed_large": 2, "routed_large_ms": 6000,
+    }, "tokens": {}}
+    assert route_latencies(totals) == {"cache": 0.001, "local": 0.001, "small": 1.0, "large": 3.0}
+    assert estimate_latency_savings(totals) == pytest.approx(15 * 2.999 + 4 * 2.0)
+    # Without a large-model call there is nothing to compare against, as for the cost estimate
+    del totals["counters"]["routed_large"]
+    assert estimate_latency_savings(totals) == estimate_routing_savings(totals) == 0.0
@@ -0,0 +1,54 @@
+import json
+
+from grading_pipeline import GradingPipeline
+from pipeline_metrics import EvaluationMetrics
+from prompts import get_grading_template
+from tests.fakes import FakeEvalClient
+
+ANSWER = ("Plants use light energy captured by chlorophyll in the leaves to turn carbon dioxide and water "
+          "into glucose, releasing oxygen as a by-product of the reaction.")
+QUESTION = {"question_number": "1", "question": "Explain photosynthesis.", "keywords": ["chlorophyll", "glucose"]}
+
+
+def pipeline_with(client):
+    students_db = {name: None for name in
+                   ("student_scores", "student_scores_history", "submission_hashes", "student_feedback")}
+    return GradingPipeline(None, client, students_db, get_grading_template())
+
+
+def test_same_answer_is_graded_once():
+    client = FakeEvalClient()
+    pipeline = pipeline_with(client)
+    for _ in range(2):
+        result = pipeline.grade_answer(QUESTION, ANSWER, "cache-T1", EvaluationMetrics("cache-T1", "P1"))
+    assert len(client.calls) == 1
+    assert result["route"] == "cache"
+
+
+def test_editing_the_question_grades_again():
+    client = FakeEvalClient()
+    pipeline = pipeline_with(client)
+    pipeline.grade_answer(QUESTION, ANSWER, "cache-T2", EvaluationMetrics("cache-T2", "P1"))
+
+    for edited in ({**QUESTION, "keywords": ["chlorophyll", "stomata"]},
+                   {**QUESTION, "question": "Explain photosynthesis and respiration."}):
+        result = pipeline.grade_answer(edited, ANSWER, "cache-T2", EvaluationMetrics("cache-T2", "P1"))
+        assert result["route"] != "cache"
+    assert len(client.calls) == 3
+
+
+def test_question_major_regrade_after_edit_calls_the_grader():
+    client = FakeEvalClient(json.dumps({"grades": [{"id": "S1", "score": 4, "feedback": "Good."}]}))
+    pipeline = pipeline_with(client)
+
+    def grade(question):
+        sheet = {"answers": {"1": ANSWER}, "results": [None], "metrics": EvaluationMetrics("cache-T3", "P1")}
+        list(pipeline.grade_question_major([sheet], [question], "cache-T3"))
+        return sheet["results"][0]
+
+    grade(QUESTION)
+    assert len(client.calls) == 1
+    assert grade(QUESTION)["route"] == "cache"
+    assert len(client.calls) == 1
+    assert grade({**QUESTION, "keywords": ["chlorophyll", "stomata"]})["route"] != "cache"
+    assert len(client.calls) == 2
@@ -0,0 +1,95 @@
+import threading
+
+from grading_pipeline import GradingPipeline
+from prompts import get_grading_template
+from scheduler import FairScheduler, BATCH, INTERACTIVE, OCR
+from pipeline_metrics import EvaluationMetrics
+
+
+def blocked_scheduler(budget=1):
+    # A scheduler whose single slot is held until `release` is set, so later submissions queue
+    scheduler = FairScheduler({OCR: budget})
+    release = threading.Event()
+    started = threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    blocker = scheduler.submit(OCR, "holder", hold)
+    started.wait(5)
+    return scheduler, release, blocker
+
+
+def run_order(submissions, weights=None):
+    scheduler, release, blocker = blocked_scheduler()
+    for tenant, weight in (weights or {}).items():
+        scheduler.set_weight(tenant, weight)
+    order = []
+    futures = [scheduler.submit(OCR, tenant, lambda label=label: order.append(label), priority)
+               for tenant, label, priority in submissions]
+    release.set()
+    for future in [blocker, *futures]:
+        future.result(5)
+    return order
+
+
+def test_teachers_take_turns():
+    submissions = [("a", f"a{i}", INTERACTIVE) for i in range(3)] + [("b", f"b{i}", INTERACTIVE) for i in range(3)]
+    assert run_order(submissions) == ["a0", "b0", "a1", "b1", "a2", "b2"]
+
+
+def test_interactive_before_batch():
+    submissions = [("a", "batch0", BATCH), ("a", "batch1", BATCH), ("b", "interactive", INTERACTIVE)]
+    assert run_order(submissions) == ["interactive", "batch0", "batch1"]
+
+
+def test_weights_share_dispatches():
+    submissions = [("a", f"a{i}", INTERACTIVE) for i in range(4)] + [("b", f"b{i}", INTERACTIVE) for i in range(2)]
+    assert run_order(submissions, {"a": 2.0}) == ["a0", "b0", "a1", "a2", "b1", "a3"]
+
+
+def test_cancelled_tasks_are_skipped_without_charging_the_teacher():
+    scheduler, release, blocker = blocked_scheduler()
+    order = []
+    cancelled = [scheduler.submit(OCR, "a", lambda i=i: order.append(f"cancelled{i}")) for i in range(3)]
+    kept = [scheduler.submit(OCR, "a", lambda: order.append("a")),
+            scheduler.submit(OCR, "b", lambda: order.append("b0")),
+            scheduler.submit(OCR, "b", lambda: order.append("b1"))]
+    assert all(future.cancel() for future in cancelled)
+    release.set()
+    for future in [blocker, *kept]:
+        future.result(5)
+    assert order == ["a", "b0", "b1"]
+
+
+def test_closing_the_ocr_generator_cancels_queued_pages():
+    scheduler = FairScheduler({OCR: 1})
+    gate = threading.Event()
+    calls = []
+
+    class Backend:
+        name = "fake"
+        resource = OCR
+
+        def recognise(self, image, metrics):
+            # The first page returns at once; the second holds the only slot until the gate opens
+            calls.append(image)
+            if len(calls) > 1:
+                gate.wait(5)
+            return {"text": image, "confidence": None, "backend": self.name}
+
+    students_db = {name: None for name in
+                   ("student_scores", "student_scores_history", "submission_hashes", "student_feedback")}
+    pipeline = GradingPipeline(None, None, students_db, get_grading_template(), teacher="t",
+                               scheduler=scheduler, ocr_backend=Backend())
+    pages = [{"status": "ok", "tiles": [f"page{i}"]} for i in range(5)]
+    events = pipeline.extract_text_from_images(pages, EvaluationMetrics("T1", "P1"))
+
+    assert next(events)["page"] == 0
+    # The session goes away while page 1 runs (or is about to) and pages 2-4 are queued
+    events.close()
+    gate.set()
+    scheduler.submit(OCR, "t", lambda: None).result(5)
+    assert calls in (["page0"], ["page0", "page1"])
+    assert scheduler.stats()[OCR]["queued"] == 0
@@ -0,0 +1,61 @@
+import csv
+import io
+from datetime import datetime
+
+import pytest
+from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
+
+import score_export
+from score_export import export_scores, export_query, score_row, BASE_COLUMNS
+
+
+class ScoresCollection:
+    # The two cursor calls export_scores makes: distinct() for the question columns and a
+    # projected, sorted find() for the rows
+    def __init__(self, documents):
+        self.documents = documents
+
+    def distinct(self, field, query):
+        return sorted({result["question_number"] for document in self.documents for result in document["results"]})
+
+    def find(self, query, projection=None, batch_size=None):
+        documents = self.documents
+
+        class Cursor:
+            def sort(self, keys):
+                return iter(sorted(documents, key=lambda d: tuple(d[field] for field, _ in keys)))
+        return Cursor()
+
+
+def scores(n):
+    return ScoresCollection([
+        {"test_id": "T1", "prn": f"P{i:04d}", "student_name": f"Student {i}", "timestamp": datetime(2025, 1, 1),
+         "total_marks": 7, "max_marks": 10,
+         "results": [{"question_number": "1", "score": 3}, {"question_number": "2", "score": 4}]}
+        for i in range(n)
+    ])
+
+
+@pytest.mark.parametrize("extension", ["csv", "parquet"])
+@pytest.mark.parametrize("spool_bytes", [8 * 1024 * 1024, 64])
+def test_export_is_accepted_by_download_button(monkeypatch, extension, spool_bytes):
+    # 64 bytes forces the spool onto disk before it is read back
+    if extension == "parquet":
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(score_export, "SPOOL_BYTES", spool_bytes)
+    data = export_scores(scores(50), export_query(["T1"]), extension)
+    converted, _ = convert_data_to_bytes_and_infer_mime(data, RuntimeError("unsupported type"))
+    assert converted == data and len(data) > 0
+
+
+def test_csv_rows():
+    data = export_scores(scores(3), export_query(["T1"]), "csv")
+    rows = list(csv.DictReader(io.StringIO(data.decode("utf-8"))))
+    assert list(rows[0]) == BASE_COLUMNS + ["Q1", "Q2"]
+    assert [row["prn"] for row in rows] == ["P0000", "P0001", "P0002"]
+    assert rows[0]["percentage"] == "70.0" and rows[0]["Q2"] == "4"
+
+
+def test_score_row_without_max_marks():
+    row = score_row({"test_id": "T1", "prn": "P1", "results": []})
+    assert row["percentage"] is None
@@ -0,0 +1,53 @@
+import zlib
+
+from score_store import split_feedback, feedback_document, merge_feedback, load_feedback, COLD_FIELDS
+from tests.fakes import FakeCollection
+
+
+SCORE = {
+    "test_id": "T1",
+    "prn": "P1",
+    "total_marks": 7,
+    "results": [
+        {"question_number": "1", "question": "Define osmosis.", "answer": "Water moves...",
+         "evaluation": "Score: 4\nFeedback: Good.", "score": 4, "route": "large"},
+        {"question_number": "2", "question": "Define diffusion.", "answer": "Particles spread...",
+         "evaluation": "Score: 3\nFeedback: Brief.", "score": 3, "route": "local"},
+    ],
+    "transcript": "Page 1: ...",
+}
+
+
+def test_split_keeps_only_scores_on_the_hot_side():
+    hot, payload = split_feedback(SCORE)
+    assert "transcript" not in hot
+    assert all(field not in result for result in hot["results"] for field in COLD_FIELDS)
+    assert [result["score"] for result in hot["results"]] == [4, 3]
+    assert payload["transcript"] == SCORE["transcript"]
+    assert payload["results"][1] == {field: SCORE["results"][1][field] for field in COLD_FIELDS}
+
+
+def test_split_without_feedback_fields():
+    hot, payload = split_feedback({"total_marks": 5})
+    assert hot == {"total_marks": 5} and payload is None
+
+
+def test_merge_restores_the_full_document():
+    hot, payload = split_feedback(SCORE)
+    feedback = feedback_document(payload)
+    assert feedback["raw_bytes"] > 0
+    assert zlib.decompress(feedback["blob"])
+    assert merge_feedback(hot, feedback) == SCORE
+
+
+def test_merge_without_feedback_returns_the_score():
+    hot, _ = split_feedback(SCORE)
+    assert merge_feedback(hot, None) is hot
+
+
+def test_load_feedback_accepts_old_inline_documents():
+    hot, payload = split_feedback(SCORE)
+    feedback = feedback_document(payload)
+    collection = FakeCollection([feedback])
+    assert load_feedback(collection, {**hot, "feedback_id": feedback["_id"]})["results"] == SCORE["results"]
+    assert load_feedback(collection, SCORE) is SCORE
@@ -0,0 +1,37 @@
+from grading_pipeline import GradingPipeline
+from prompts import get_grading_template
+from tests.fakes import FakeCollection
+
+
+def pipeline_with(scores, history, submissions):
+    students_db = {
+        "student_scores": FakeCollection(scores),
+        "student_scores_history": FakeCollection(history),
+        "submission_hashes": FakeCollection(submissions),
+        "student_feedback": FakeCollection(),
+    }
+    return GradingPipeline(None, None, students_db, get_grading_template())
+
+
+def attempt(version, total):
+    return {"_id": "S1", "test_id": "T1", "prn": "P1", "version": version, "total_marks": total}
+
+
+def test_resubmitted_earlier_attempt_shows_its_own_marks():
+    history = [{**attempt(1, 10), "_id": "H1", "score_id": "S1"}]
+    pipeline = pipeline_with([attempt(2, 25)], history, [])
+    first = {"test_id": "T1", "prn": "P1", "score_id": "S1", "version": 1}
+    latest = {"test_id": "T1", "prn": "P1", "score_id": "S1", "version": 2}
+    assert pipeline.load_saved_score(first)["total_marks"] == 10
+    assert pipeline.load_saved_score(latest)["total_marks"] == 25
+
+
+def test_missing_history_means_regrade():
+    pipeline = pipeline_with([attempt(3, 25)], [], [])
+    assert pipeline.load_saved_score({"test_id": "T1", "prn": "P1", "score_id": "S1", "version": 2}) is None
+
+
+def test_records_without_version_only_match_a_single_attempt():
+    record = {"test_id": "T1", "prn": "P1", "score_id": "S1"}
+    assert pipeline_with([attempt(1, 10)], [], []).load_saved_score(record)["total_marks"] == 10
+    assert pipeline_with([attempt(2, 25)], [], []).load_saved_score(record) is None